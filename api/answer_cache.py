@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import datetime as dt
+import os
+import threading
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from db.models import AnswerCache
+from observability.metrics import CACHE_LOOKUPS
+
+# Distância de cosseno máxima entre perguntas para reaproveitar a resposta (0 desativa).
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.05"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Intervalo mínimo, por processo, entre remoções das respostas expiradas (feitas ao gravar).
+ANSWER_CACHE_PURGE_INTERVAL = float(os.getenv("ANSWER_CACHE_PURGE_INTERVAL", "300"))
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def lookup_answer(session: Session, embedding: list[float], chunk_ids: list[int]) -> str | None:
+    """
+    Resposta de uma pergunta próxima (distância <= ANSWER_CACHE_MAX_DISTANCE)
+    que recuperou exatamente o mesmo conjunto de chunks.
+    """
+    if ANSWER_CACHE_MAX_DISTANCE <= 0 or not chunk_ids:
+        return None
+    distance = AnswerCache.embedding.cosine_distance(embedding)
+    stmt = (
+        select(AnswerCache.answer, distance.label("distance"))
+        .where(AnswerCache.chunk_ids == sorted(chunk_ids))
+        .where(AnswerCache.created_at >= _expiry_cutoff())
+        .order_by(distance)
+        .limit(1)
+    )
+    row = session.execute(stmt).first()
+    hit = row is not None and row.distance <= ANSWER_CACHE_MAX_DISTANCE
+    _record("hits" if hit else "misses")
+    return row.answer if hit else None
+
+
+def store_answer(
+    session: Session, question: str, embedding: list[float], chunk_ids: list[int], answer: str
+) -> None:
+    if ANSWER_CACHE_MAX_DISTANCE <= 0 or not chunk_ids:
+        return
+    session.add(
+        AnswerCache(question=question, embedding=embedding, chunk_ids=sorted(chunk_ids), answer=answer)
+    )
+    if _purge_due():
+        purge_expired_answers(session)
+
+
+def purge_expired_answers(session: Session) -> int:
+    """Apaga as respostas mais antigas que ANSWER_CACHE_TTL, que `lookup_answer` já ignora."""
+    result = session.execute(delete(AnswerCache).where(AnswerCache.created_at < _expiry_cutoff()))
+    return result.rowcount or 0
+
+
+def answer_cache_stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": _stats["hits"] / lookups if lookups else 0.0}
+
+
+def _expiry_cutoff() -> dt.datetime:
+    return dt.datetime.utcnow() - dt.timedelta(seconds=ANSWER_CACHE_TTL)
+
+
+def _purge_due() -> bool:
+    global _last_purge
+    now = time.monotonic()
+    with _stats_lock:
+        if now - _last_purge < ANSWER_CACHE_PURGE_INTERVAL:
+            return False
+        _last_purge = now
+        return True
+
+
+def _record(outcome: str) -> None:
+    with _stats_lock:
+        _stats[outcome] += 1
+    CACHE_LOOKUPS.labels("answer", outcome).inc()
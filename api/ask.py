@@ -1,15 +1,27 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.dependencies import get_db_session
+from api.answer_cache import answer_cache_stats, lookup_answer, store_answer
+from api.dependencies import get_async_db_session
+from api.query_cache import get_query_embedding, query_cache
+from db.connection import get_async_session
+from db.local_index import RETRIEVAL_BACKEND, get_local_index
 from db.models import Chunk, Document
-from ingestion.embeddings import embed_texts, get_client
+from db.vector_index import apply_search_settings, first_stage_limit, nearest_chunk_ids
+from ingestion.embeddings import get_async_client
+from observability.metrics import LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS, RETRIEVAL_SECONDS
 
 router = APIRouter(prefix="/ask", tags=["ask"])
 
@@ -17,6 +29,8 @@ router = APIRouter(prefix="/ask", tags=["ask"])
 class AskRequest(BaseModel):
     question: str = Field(..., min_length=4)
     top_k: int = Field(default=6, ge=1, le=20)
+    ef_search: int | None = Field(default=None, ge=1, le=1000)
+    probes: int | None = Field(default=None, ge=1, le=10000)
 
 
 class AskContext(BaseModel):
@@ -30,37 +44,181 @@ class AskResponse(BaseModel):
     question: str
     answer: str
     contexts: list[AskContext]
+    cached: bool = False
+
+
+@dataclass
+class Retrieval:
+    embedding: list[float]
+    chunk_ids: list[int]
+    contexts: list[AskContext]
+    cached_answer: str | None = None
 
 
 @router.post("", response_model=AskResponse)
-def ask_endpoint(payload: AskRequest, session: Session = Depends(get_db_session)) -> AskResponse:
-    query_embedding = embed_texts([payload.question])[0]
-    stmt = (
-        select(Chunk, Document)
-        .join(Document, Document.id == Chunk.document_id)
-        .order_by(Chunk.embedding.cosine_distance(query_embedding))
-        .limit(payload.top_k)
+async def ask_endpoint(
+    payload: AskRequest, session: AsyncSession = Depends(get_async_db_session)
+) -> AskResponse:
+    retrieval = await _retrieve(payload, session)
+    if retrieval.cached_answer is not None:
+        return AskResponse(
+            question=payload.question,
+            answer=retrieval.cached_answer,
+            contexts=retrieval.contexts,
+            cached=True,
+        )
+
+    answer, from_llm = await _assemble_answer(payload.question, retrieval.contexts)
+    if from_llm:
+        await session.run_sync(
+            store_answer, payload.question, retrieval.embedding, retrieval.chunk_ids, answer
+        )
+        await session.commit()
+    return AskResponse(question=payload.question, answer=answer, contexts=retrieval.contexts)
+
+
+@router.post("/stream")
+async def ask_stream_endpoint(
+    payload: AskRequest, session: AsyncSession = Depends(get_async_db_session)
+) -> StreamingResponse:
+    """
+    Server-Sent Events: `contexts` assim que a busca termina, `token` a cada
+    trecho gerado pelo modelo e `done` com a resposta completa.
+    """
+    retrieval = await _retrieve(payload, session)
+    return StreamingResponse(
+        _answer_events(payload.question, retrieval),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
+
+@router.get("/cache-stats")
+def cache_stats_endpoint() -> dict:
+    return {"query_embeddings": query_cache.stats(), "answers": answer_cache_stats()}
+
+
+async def _retrieve(payload: AskRequest, session: AsyncSession) -> Retrieval:
+    query_embedding = await get_query_embedding(payload.question, session)
+    started = time.perf_counter()
+    if RETRIEVAL_BACKEND == "local":
+        candidates = await _local_candidates(query_embedding, payload.top_k)
+    else:
+        candidates = await _pgvector_candidates(session, query_embedding, payload)
+    RETRIEVAL_SECONDS.labels(RETRIEVAL_BACKEND).observe(time.perf_counter() - started)
+
     contexts: list[AskContext] = []
+    chunk_ids: list[int] = []
     seen_previews: set[str] = set()
-    for chunk, document in session.execute(stmt):
-        metadata = chunk.metadata_json or {}
-        preview = _build_preview(chunk.chunk_text)
+    for chunk_id, record in candidates:
+        chunk_ids.append(chunk_id)
+        preview = _build_preview(record["text"])
         if preview in seen_previews:
             continue
         seen_previews.add(preview)
         contexts.append(
             AskContext(
-                url=document.url,
-                title=document.title or metadata.get("title"),
-                breadcrumbs=metadata.get("breadcrumbs", []),
+                url=record["url"],
+                title=record["title"],
+                breadcrumbs=record["breadcrumbs"],
                 preview=preview,
             )
         )
 
-    answer = _assemble_answer(payload.question, contexts)
-    return AskResponse(question=payload.question, answer=answer, contexts=contexts)
+    cached_answer = None
+    if contexts:
+        cached_answer = await session.run_sync(lookup_answer, query_embedding, chunk_ids)
+    return Retrieval(
+        embedding=query_embedding,
+        chunk_ids=chunk_ids,
+        contexts=contexts,
+        cached_answer=cached_answer,
+    )
+
+
+async def _pgvector_candidates(
+    session: AsyncSession, query_embedding: list[float], payload: AskRequest
+) -> list[tuple[int, dict]]:
+    await session.run_sync(
+        apply_search_settings,
+        ef_search=payload.ef_search,
+        probes=payload.probes,
+        limit=first_stage_limit(payload.top_k),
+    )
+    nearest = nearest_chunk_ids(query_embedding, payload.top_k).subquery()
+    stmt = (
+        select(Chunk, Document)
+        .join(nearest, nearest.c.id == Chunk.id)
+        .join(Document, Document.id == Chunk.document_id)
+        .order_by(Chunk.embedding.cosine_distance(query_embedding))
+    )
+    candidates = []
+    for chunk, document in await session.execute(stmt):
+        metadata = chunk.metadata_json or {}
+        record = {
+            "url": document.url,
+            "title": document.title or metadata.get("title"),
+            "breadcrumbs": metadata.get("breadcrumbs", []),
+            "text": chunk.chunk_text,
+        }
+        candidates.append((chunk.id, record))
+    return candidates
+
+
+async def _local_candidates(query_embedding: list[float], top_k: int) -> list[tuple[int, dict]]:
+    index = await asyncio.to_thread(get_local_index)
+    await asyncio.to_thread(index.refresh_if_due)
+    results = await asyncio.to_thread(index.search, query_embedding, top_k)
+    return [(chunk_id, record) for chunk_id, record, _score in results]
+
+
+async def _answer_events(question: str, retrieval: Retrieval) -> AsyncIterator[str]:
+    yield _sse(
+        "contexts",
+        {"question": question, "contexts": [ctx.model_dump() for ctx in retrieval.contexts]},
+    )
+
+    if retrieval.cached_answer is not None:
+        yield _sse("token", {"text": retrieval.cached_answer})
+        yield _sse("done", {"answer": retrieval.cached_answer, "cached": True})
+        return
+    if not retrieval.contexts:
+        answer = _no_context_answer(question)
+        yield _sse("token", {"text": answer})
+        yield _sse("done", {"answer": answer, "cached": False})
+        return
+
+    parts: list[str] = []
+    started = time.perf_counter()
+    try:
+        async for delta in _llm_answer_stream(question, retrieval.contexts):
+            if not parts:
+                LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+            parts.append(delta)
+            yield _sse("token", {"text": delta})
+    except Exception:
+        LLM_SECONDS.labels("stream", "error").observe(time.perf_counter() - started)
+        if not parts:
+            fallback = _fallback_answer(question, retrieval.contexts)
+            yield _sse("token", {"text": fallback})
+            yield _sse("done", {"answer": fallback, "cached": False})
+            return
+        # Resposta parcial já enviada: encerra sem gravar no cache.
+        yield _sse("done", {"answer": "".join(parts).strip(), "cached": False, "truncated": True})
+        return
+
+    LLM_SECONDS.labels("stream", "ok").observe(time.perf_counter() - started)
+    answer = "".join(parts).strip()
+    if answer:
+        # A sessão da dependência já foi fechada quando o corpo do stream roda.
+        async with get_async_session() as session:
+            await session.run_sync(store_answer, question, retrieval.embedding, retrieval.chunk_ids, answer)
+            await session.commit()
+    yield _sse("done", {"answer": answer, "cached": False})
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
 def _build_preview(text: str, limit: int = 400) -> str:
@@ -71,20 +229,60 @@ def _build_preview(text: str, limit: int = 400) -> str:
 LLM_MODEL = os.getenv("ASK_MODEL", "gpt-4o-mini")
 
 
-def _assemble_answer(question: str, contexts: list[AskContext]) -> str:
+async def _assemble_answer(question: str, contexts: list[AskContext]) -> tuple[str, bool]:
+    """Devolve (resposta, veio_do_llm); só respostas do LLM vão para o cache."""
     if not contexts:
-        return f"Não encontrei contexto relevante para “{question}”."
+        return _no_context_answer(question), False
+    started = time.perf_counter()
     try:
-        return _llm_answer(question, contexts)
+        answer = await _llm_answer(question, contexts)
     except Exception:
-        lines = [f"Principais referências para “{question}”:"]  # fallback
-        for idx, ctx in enumerate(contexts, start=1):
-            title = ctx.title or "Documento sem título"
-            lines.append(f"{idx}. {title} ({ctx.url})")
-        return "\n".join(lines)
+        LLM_SECONDS.labels("complete", "error").observe(time.perf_counter() - started)
+        return _fallback_answer(question, contexts), False
+    LLM_SECONDS.labels("complete", "ok").observe(time.perf_counter() - started)
+    return answer, True
+
+
+def _no_context_answer(question: str) -> str:
+    return f"Não encontrei contexto relevante para “{question}”."
+
+
+def _fallback_answer(question: str, contexts: list[AskContext]) -> str:
+    lines = [f"Principais referências para “{question}”:"]
+    for idx, ctx in enumerate(contexts, start=1):
+        title = ctx.title or "Documento sem título"
+        lines.append(f"{idx}. {title} ({ctx.url})")
+    return "\n".join(lines)
+
+
+async def _llm_answer(question: str, contexts: list[AskContext]) -> str:
+    client = get_async_client()
+    completion = await client.chat.completions.create(
+        model=LLM_MODEL,
+        temperature=0.2,
+        max_tokens=512,
+        messages=_build_messages(question, contexts),
+    )
+    if completion.choices:
+        return completion.choices[0].message.content.strip()
+    raise RuntimeError("Resposta vazia do modelo.")
+
+
+async def _llm_answer_stream(question: str, contexts: list[AskContext]) -> AsyncIterator[str]:
+    client = get_async_client()
+    stream = await client.chat.completions.create(
+        model=LLM_MODEL,
+        temperature=0.2,
+        max_tokens=512,
+        messages=_build_messages(question, contexts),
+        stream=True,
+    )
+    async for event in stream:
+        if event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
 
 
-def _llm_answer(question: str, contexts: list[AskContext]) -> str:
+def _build_messages(question: str, contexts: list[AskContext]) -> list[dict]:
     summaries = []
     for ctx in contexts:
         title = ctx.title or ctx.url
@@ -98,16 +296,7 @@ def _llm_answer(question: str, contexts: list[AskContext]) -> str:
         f"Pergunta: {question}\n"
         "Responda em português. Cite arquivos e etapas práticas sempre que aparecerem no contexto. Inclua um resumo curto e oriente como executar o passo a passo."
     )
-    client = get_client()
-    completion = client.chat.completions.create(
-        model=LLM_MODEL,
-        temperature=0.2,
-        max_tokens=512,
-        messages=[
-            {"role": "system", "content": "Responda somente com base no contexto fornecido."},
-            {"role": "user", "content": prompt},
-        ],
-    )
-    if completion.choices:
-        return completion.choices[0].message.content.strip()
-    raise RuntimeError("Resposta vazia do modelo.")
+    return [
+        {"role": "system", "content": "Responda somente com base no contexto fornecido."},
+        {"role": "user", "content": prompt},
+    ]
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from db.connection import get_session
+from db.connection import get_async_session, get_session
 
 
 def get_db_session() -> Generator[Session, None, None]:
@@ -13,3 +14,8 @@ def get_db_session() -> Generator[Session, None, None]:
         yield session
     finally:
         session.close()
+
+
+async def get_async_db_session() -> AsyncGenerator[AsyncSession, None]:
+    async with get_async_session() as session:
+        yield session
@@ -6,6 +6,8 @@ from sqlalchemy.orm import Session
 
 from api.dependencies import get_db_session
 from crawler.crawl import Crawler, CrawlerConfig
+from db.queries import crawl_cache_lookup, get_document_by_url
+from ingestion.embeddings import EMBEDDING_MODEL
 from ingestion.updater import ingest_page
 
 router = APIRouter(prefix="/ingest-url", tags=["ingest"])
@@ -27,11 +29,16 @@ class IngestResponse(BaseModel):
 def ingest_url_endpoint(
     payload: IngestRequest, session: Session = Depends(get_db_session)
 ) -> IngestResponse:
-    crawler = Crawler(CrawlerConfig(max_pages=1))
+    # Páginas embedadas com outro modelo vão sem GET condicional: um 304 manteria os vetores antigos.
+    crawler = Crawler(
+        CrawlerConfig(max_pages=1), cache_lookup=crawl_cache_lookup(session, embedding_model=EMBEDDING_MODEL)
+    )
     target_url = str(payload.url)
     try:
         page = next(iter(crawler.crawl(target_url)))
     except StopIteration:
+        if crawler.not_modified:
+            return _not_modified_response(session, crawler.not_modified[0])
         raise HTTPException(status_code=404, detail="Conteúdo não encontrado")
 
     result = ingest_page(session, page)
@@ -43,3 +50,14 @@ def ingest_url_endpoint(
         chunks=result.chunks,
         message=message,
     )
+
+
+def _not_modified_response(session: Session, url: str) -> IngestResponse:
+    document = get_document_by_url(session, url)
+    return IngestResponse(
+        url=url,
+        created=False,
+        updated=False,
+        chunks=len(document.chunks) if document else 0,
+        message="Sem mudanças (304)",
+    )
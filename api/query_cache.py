@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.queries import get_cached_embeddings, store_embeddings
+from ingestion.embeddings import EMBEDDING_MODEL, aembed_texts, embedding_key
+from observability.metrics import CACHE_LOOKUPS
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+# Compartilha as entradas entre workers via tabela embedding_cache do Postgres.
+QUERY_CACHE_SHARED = os.getenv("QUERY_CACHE_SHARED", "0") == "1"
+# Rótulo das perguntas na embedding_cache: a chave (e a coluna model) não se
+# confunde com a dos chunks, que embutem o texto original e não o normalizado.
+QUERY_CACHE_MODEL = f"query:{EMBEDDING_MODEL}"
+
+
+class QueryEmbeddingCache:
+    """LRU com TTL, thread-safe, para embeddings de perguntas do /ask."""
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> list[float] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: list[float]) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def record(self, outcome: str) -> None:
+        """Conta um acerto local (`hits`), no Postgres (`shared_hits`) ou uma falta (`misses`)."""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        CACHE_LOOKUPS.labels("query_embedding", outcome).inc()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+        }
+
+
+query_cache = QueryEmbeddingCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+
+def normalize_question(question: str) -> str:
+    """Caixa, espaços e pontuação final não mudam a pergunta."""
+    return " ".join(question.casefold().split()).rstrip("?!.;: ")
+
+
+async def get_query_embedding(question: str, session: AsyncSession | None = None) -> list[float]:
+    normalized = normalize_question(question)
+    key = embedding_key(normalized, QUERY_CACHE_MODEL)
+    cached = query_cache.get(key)
+    if cached is not None:
+        query_cache.record("hits")
+        return cached
+
+    shared_backend = QUERY_CACHE_SHARED and session is not None
+    if shared_backend:
+        shared = (await session.run_sync(get_cached_embeddings, [key])).get(key)
+        if shared is not None:
+            query_cache.record("shared_hits")
+            query_cache.put(key, shared)
+            return shared
+
+    query_cache.record("misses")
+    # Embute a forma normalizada: o vetor guardado vale para todas as variantes com a mesma chave.
+    embedding = (await aembed_texts([normalized]))[0]
+    query_cache.put(key, embedding)
+    if shared_backend:
+        await session.run_sync(store_embeddings, {key: embedding}, QUERY_CACHE_MODEL)
+        await session.commit()
+    return embedding
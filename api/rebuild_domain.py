@@ -1,51 +1,89 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel, HttpUrl
-from sqlalchemy.orm import Session
+import datetime as dt
 
-from api.dependencies import get_db_session
-from crawler.crawl import Crawler, CrawlerConfig
-from db.queries import delete_domain
-from ingestion.updater import ingest_page
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field, HttpUrl
+
+from api.rebuild_jobs import JobConflictError, RebuildJob, job_manager
 
 router = APIRouter(prefix="/rebuild-domain", tags=["rebuild"])
 
 
 class RebuildRequest(BaseModel):
     base_url: HttpUrl
+    max_pages: int = Field(default=2000, ge=1, le=20000)
 
 
-class RebuildResponse(BaseModel):
+class RebuildJobResponse(BaseModel):
+    job_id: str
     domain: str
+    base_url: str
+    status: str
     pages: int
     chunks: int
+    errors: int
+    recent_errors: list[str]
+    generation: int | None = None
     deleted_documents: int
+    pages_per_second: float
+    created_at: dt.datetime
+    started_at: dt.datetime | None = None
+    finished_at: dt.datetime | None = None
     message: str
 
 
-@router.post("", response_model=RebuildResponse)
-def rebuild_domain_endpoint(
-    payload: RebuildRequest, session: Session = Depends(get_db_session)
-) -> RebuildResponse:
-    base_url = str(payload.base_url)
-    domain = payload.base_url.host
-    deleted = delete_domain(session, domain)
-    session.commit()
-
-    crawler = Crawler(CrawlerConfig(max_pages=2000))
-    pages_processed = 0
-    total_chunks = 0
-
-    for page in crawler.crawl(base_url):
-        result = ingest_page(session, page)
-        pages_processed += 1
-        total_chunks += result.chunks
-
-    return RebuildResponse(
-        domain=domain,
-        pages=pages_processed,
-        chunks=total_chunks,
-        deleted_documents=deleted,
-        message=f"Reconstrução concluída ({pages_processed} páginas, {total_chunks} chunks)",
+@router.post("", response_model=RebuildJobResponse, status_code=202)
+def rebuild_domain_endpoint(payload: RebuildRequest) -> RebuildJobResponse:
+    """Enfileira o rebuild do domínio e responde na hora com o id do job."""
+    try:
+        job = job_manager.submit(str(payload.base_url), payload.base_url.host, payload.max_pages)
+    except JobConflictError as exc:
+        raise HTTPException(status_code=409, detail=f"Rebuild já em andamento para o domínio (job {exc})")
+    return _job_response(job)
+
+
+@router.get("/jobs", response_model=list[RebuildJobResponse])
+def list_jobs_endpoint() -> list[RebuildJobResponse]:
+    return [_job_response(job) for job in job_manager.jobs()]
+
+
+@router.get("/jobs/{job_id}", response_model=RebuildJobResponse)
+def job_status_endpoint(job_id: str) -> RebuildJobResponse:
+    return _job_response(_get_job(job_id))
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=RebuildJobResponse)
+def cancel_job_endpoint(job_id: str) -> RebuildJobResponse:
+    """Interrompe o crawl no próximo lote e descarta a geração em construção; a atual segue ativa."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return _job_response(job)
+
+
+def _get_job(job_id: str) -> RebuildJob:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
+def _job_response(job: RebuildJob) -> RebuildJobResponse:
+    return RebuildJobResponse(
+        job_id=job.id,
+        domain=job.domain,
+        base_url=job.base_url,
+        status=job.status,
+        pages=job.pages,
+        chunks=job.chunks,
+        errors=job.errors,
+        recent_errors=job.recent_errors,
+        generation=job.generation,
+        deleted_documents=job.deleted_documents,
+        pages_per_second=job.pages_per_second,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        message=job.message or {"queued": "Na fila", "running": "Em andamento"}.get(job.status, ""),
     )
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from crawler.crawl import Crawler, CrawlerConfig
+from crawler.extract import PageContent
+from db.connection import get_session
+from ingestion.pipeline import run_pipeline
+from ingestion.updater import (
+    REBUILD_MAX_ERRORS,
+    IngestionResult,
+    abort_rebuild,
+    finish_rebuild,
+    lost_pages,
+    start_rebuild,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rebuilds simultâneos; os demais ficam "queued" até uma vaga abrir.
+REBUILD_MAX_JOBS = int(os.getenv("REBUILD_MAX_JOBS", "2"))
+# Downloads simultâneos por job: baixo o bastante para não disputar CPU com o /ask.
+REBUILD_CONCURRENCY = int(os.getenv("REBUILD_CONCURRENCY", "8"))
+REBUILD_BATCH_PAGES = int(os.getenv("REBUILD_BATCH_PAGES", "16"))
+# Processos de parse e chunking, compartilhados pelos jobs: esse trabalho disputa o GIL com o /ask.
+REBUILD_WORKERS = int(os.getenv("REBUILD_WORKERS", str(max((os.cpu_count() or 2) // 2, 1))))
+REBUILD_JOB_HISTORY = int(os.getenv("REBUILD_JOB_HISTORY", "50"))
+
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+RECENT_ERRORS = 20
+
+
+class JobConflictError(Exception):
+    """Já existe um rebuild ativo para o domínio."""
+
+
+@dataclass
+class RebuildJob:
+    base_url: str
+    domain: str
+    max_pages: int = 2000
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    created_at: dt.datetime = field(default_factory=dt.datetime.utcnow)
+    started_at: dt.datetime | None = None
+    finished_at: dt.datetime | None = None
+    generation: int | None = None
+    # Depois do flip o job só limpa a geração antiga; cancelar já não desfaz nada.
+    activated: bool = False
+    deleted_documents: int = 0
+    pages: int = 0
+    chunks: int = 0
+    errors: int = 0
+    recent_errors: list[str] = field(default_factory=list)
+    message: str = ""
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def pages_per_second(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or dt.datetime.utcnow()
+        elapsed = (end - self.started_at).total_seconds()
+        return round(self.pages / elapsed, 2) if elapsed > 0 else 0.0
+
+    def record_error(self, message: str) -> None:
+        self.errors += 1
+        self.recent_errors = (self.recent_errors + [message])[-RECENT_ERRORS:]
+
+
+class RebuildJobManager:
+    """
+    Fila de rebuilds em segundo plano com pool limitado de workers. Cada job
+    roda `ingestion.pipeline.run_pipeline` num event loop próprio (thread do
+    pool), fora do loop que atende o /ask; parse e chunking vão para um pool
+    de processos compartilhado, para não disputar o GIL com as requisições.
+    O estado fica em memória, por processo.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = REBUILD_MAX_JOBS,
+        history: int = REBUILD_JOB_HISTORY,
+        workers: int = REBUILD_WORKERS,
+    ) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="rebuild")
+        self._workers = max(workers, 1)
+        self._process_pool: ProcessPoolExecutor | None = None
+        self._jobs: OrderedDict[str, RebuildJob] = OrderedDict()
+        self._history = history
+        self._lock = threading.Lock()
+
+    def submit(self, base_url: str, domain: str, max_pages: int = 2000) -> RebuildJob:
+        with self._lock:
+            for job in self._jobs.values():
+                if job.domain == domain and job.status in ACTIVE_STATUSES:
+                    raise JobConflictError(job.id)
+            job = RebuildJob(base_url=base_url, domain=domain, max_pages=max_pages)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> RebuildJob | None:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list[RebuildJob]:
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> RebuildJob | None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = dt.datetime.utcnow()
+                job.message = "Cancelado antes de iniciar"
+            elif job.status == "running":
+                job.status = "cancelling"
+            job.cancel_event.set()
+        return job
+
+    def _parse_pool(self) -> ProcessPoolExecutor:
+        """Criado no primeiro job; spawn porque o processo da API já tem threads e event loops rodando."""
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self._workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._process_pool
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.status not in ACTIVE_STATUSES]
+        for job_id in finished[: max(len(self._jobs) - self._history, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: RebuildJob) -> None:
+        with self._lock:
+            if job.cancel_event.is_set():
+                return
+            job.status = "running"
+            job.started_at = dt.datetime.utcnow()
+        try:
+            asyncio.run(_rebuild(job, self._parse_pool(), self._workers))
+        except Exception as exc:  # o job registra a falha; o worker segue para o próximo
+            logger.exception("Rebuild %s (%s) falhou", job.id, job.domain)
+            if isinstance(exc, ExceptionGroup):  # falha num estágio do pipeline (TaskGroup)
+                exc = exc.exceptions[0]
+            job.record_error(str(exc))
+            job.status = "failed"
+            job.message = f"Falhou após {job.pages} páginas: {exc}"
+        else:
+            if job.cancel_event.is_set() and not job.activated:
+                job.status = "cancelled"
+                job.message = f"Cancelado após {job.pages} páginas, {job.chunks} chunks"
+            else:
+                job.status = "completed"
+                job.message = f"Reconstrução concluída ({job.pages} páginas, {job.chunks} chunks)"
+        finally:
+            job.finished_at = dt.datetime.utcnow()
+
+
+async def _rebuild(job: RebuildJob, executor: ProcessPoolExecutor, workers: int) -> None:
+    """
+    Grava o domínio numa geração sombra enquanto o /ask segue com a atual;
+    no fim, flip atômico e limpeza em lotes da geração antiga. Cancelamento
+    ou falha descartam a geração nova sem tocar na ativa.
+    """
+    session = get_session()
+    try:
+        job.generation = await asyncio.to_thread(start_rebuild, session, job.domain)
+        try:
+            await _crawl_into_generation(session, job, executor, workers)
+        except BaseException:
+            await asyncio.to_thread(abort_rebuild, session, job.domain, job.generation)
+            raise
+        if job.cancel_event.is_set():
+            await asyncio.to_thread(abort_rebuild, session, job.domain, job.generation)
+            return
+        if not job.pages:
+            await asyncio.to_thread(abort_rebuild, session, job.domain, job.generation)
+            raise RuntimeError("Nenhuma página ingerida; a geração atual foi mantida")
+        if job.errors > REBUILD_MAX_ERRORS:
+            # Páginas publicadas que falharam sumiriam do /ask com o flip: a geração incompleta não é publicada.
+            await asyncio.to_thread(abort_rebuild, session, job.domain, job.generation)
+            raise RuntimeError(
+                f"{job.errors} páginas publicadas não foram baixadas (REBUILD_MAX_ERRORS={REBUILD_MAX_ERRORS}); "
+                "a geração atual foi mantida"
+            )
+        await asyncio.to_thread(_activate, session, job)
+    finally:
+        session.close()
+
+
+async def _crawl_into_generation(session, job: RebuildJob, executor: ProcessPoolExecutor, workers: int) -> None:
+    """Mesmo pipeline do scripts/rebuild_domain.py; uma falha de ingestão interrompe o job."""
+    crawler = Crawler(
+        CrawlerConfig(max_pages=job.max_pages, concurrency=REBUILD_CONCURRENCY), parse_executor=executor
+    )
+    started = time.monotonic()
+
+    def count(page: PageContent, result: IngestionResult) -> None:
+        job.pages += 1
+        job.chunks += result.chunks
+
+    embed_session = get_session()
+    try:
+        await run_pipeline(
+            crawler,
+            job.base_url,
+            executor=executor,
+            workers=workers,
+            embed_session=embed_session,
+            write_session=session,
+            batch_pages=REBUILD_BATCH_PAGES,
+            generation=job.generation,
+            on_result=count,
+            should_stop=job.cancel_event.is_set,
+        )
+    finally:
+        embed_session.close()
+
+    for url in await asyncio.to_thread(lost_pages, session, job.domain, crawler):
+        job.record_error(f"Falha ao baixar {url}")
+    logger.info(
+        "Rebuild %s (%s): %s páginas em %.0fs", job.id, job.domain, job.pages, time.monotonic() - started
+    )
+
+
+def _activate(session, job: RebuildJob) -> None:
+    job.deleted_documents = finish_rebuild(session, job.domain, job.generation)
+    job.activated = True
+
+
+job_manager = RebuildJobManager()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import base64
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import numpy as np
+
+from ingestion.embedding_providers import hashing_embedding
+
+
+def fake_embedding(text: str, dimensions: int = 1536) -> np.ndarray:
+    """
+    Vetor determinístico por feature hashing das palavras (o mesmo do provedor
+    "hashing"): textos com vocabulário parecido ficam próximos no cosseno,
+    então a busca do /ask recupera chunks coerentes com a pergunta.
+    """
+    return hashing_embedding(text, dimensions)
+
+
+@dataclass
+class FakeOpenAIStats:
+    embedding_requests: int = 0
+    embedding_inputs: int = 0
+    embedding_tokens: int = 0
+    chat_requests: int = 0
+    request_sizes: list[tuple[int, int]] = field(default_factory=list)  # (entradas, tokens) por requisição
+
+
+class FakeOpenAIServer:
+    """
+    Substituto local dos endpoints /v1/embeddings e /v1/chat/completions
+    (inclusive streaming), compatível com o SDK `openai` via OPENAI_BASE_URL.
+
+    `embedding_latency` e `chat_latency` (segundos por requisição) simulam o
+    tempo de rede/modelo; `count_tokens` mede o tamanho de cada lote recebido.
+    """
+
+    def __init__(
+        self,
+        *,
+        dimensions: int = 1536,
+        embedding_latency: float = 0.0,
+        chat_latency: float = 0.0,
+        count_tokens: Callable[[str], int] = lambda text: max(1, len(text.split())),
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.dimensions = dimensions
+        self.embedding_latency = embedding_latency
+        self.chat_latency = chat_latency
+        self.count_tokens = count_tokens
+        self.stats = FakeOpenAIStats()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self) -> FakeOpenAIStats:
+        """Zera os contadores e devolve os acumulados até aqui."""
+        with self._lock:
+            stats, self.stats = self.stats, FakeOpenAIStats()
+        return stats
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _embeddings(self, body: dict) -> dict:
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        tokens = sum(self.count_tokens(text) for text in inputs)
+        with self._lock:
+            self.stats.embedding_requests += 1
+            self.stats.embedding_inputs += len(inputs)
+            self.stats.embedding_tokens += tokens
+            self.stats.request_sizes.append((len(inputs), tokens))
+        time.sleep(self.embedding_latency)
+
+        encode_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text, body.get("dimensions") or self.dimensions)
+            embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode() if encode_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", ""),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _answer(self, body: dict) -> str:
+        with self._lock:
+            self.stats.chat_requests += 1
+        time.sleep(self.chat_latency)
+        prompt = body["messages"][-1]["content"]
+        question = prompt.rsplit("Pergunta:", 1)[-1].split("\n", 1)[0].strip()
+        return f"Resposta de teste para: {question}. Consulte os documentos listados no contexto."
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/embeddings"):
+                    self._json(server._embeddings(body))
+                elif self.path.endswith("/chat/completions"):
+                    answer = server._answer(body)
+                    if body.get("stream"):
+                        self._stream(body, answer)
+                    else:
+                        self._json(_completion(body, answer))
+                else:
+                    self._json({"error": {"message": f"Endpoint não simulado: {self.path}"}}, status=404)
+
+            def _json(self, payload: dict, status: int = 200) -> None:
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, body: dict, answer: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for piece in re.findall(r"\S+\s*", answer):
+                    self.wfile.write(f"data: {json.dumps(_chunk(body, piece))}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+def _completion(body: dict, answer: str) -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", ""),
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk(body: dict, piece: str) -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", ""),
+        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+    }
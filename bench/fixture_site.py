@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import email.utils
+import hashlib
+import html
+import random
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECTIONS = (
+    "Plataforma",
+    "Deploy",
+    "Observabilidade",
+    "Segurança",
+    "Dados",
+    "Redes",
+    "Desenvolvimento",
+    "Suporte",
+)
+TOPICS = (
+    "argo cd",
+    "kubernetes",
+    "helm",
+    "terraform",
+    "vault",
+    "grafana",
+    "prometheus",
+    "kafka",
+    "postgres",
+    "redis",
+    "nginx",
+    "istio",
+    "jenkins",
+    "sonar",
+    "airflow",
+    "spark",
+)
+VOCABULARY = (
+    "configurar ambiente cluster namespace pipeline deploy rollback réplica serviço ingress certificado "
+    "segredo variável permissão grupo acesso token chave backup restauração monitoramento alerta métrica "
+    "painel log rastreamento latência disponibilidade escala recurso limite quota imagem registro versão "
+    "branch revisão aprovação ambiente homologação produção teste integração migração banco tabela índice "
+    "consulta fila tópico consumidor produtor partição retenção rede sub-rede firewall regra rota proxy "
+    "balanceador domínio dns volume armazenamento snapshot política auditoria incidente chamado suporte "
+    "equipe responsável prazo documentação exemplo comando arquivo diretório manifesto template parâmetro"
+).split()
+COMMANDS = (
+    "kubectl apply -f manifests/{topic}.yaml",
+    "helm upgrade --install {topic} charts/{topic} -n {section}",
+    "terraform plan -var-file=envs/{section}.tfvars",
+    "argocd app sync {topic}-{section}",
+    "vault kv get secret/{section}/{topic}",
+)
+
+
+@dataclass
+class FixturePortal:
+    """Portal sintético: caminho -> HTML, mais o sitemap. Gerado de forma determinística pela semente."""
+
+    pages: dict[str, str] = field(default_factory=dict)
+    sitemap: str = ""
+
+
+def generate_portal(
+    pages: int, *, seed: int = 0, long_page_ratio: float = 0.1, duplicate_ratio: float = 0.05
+) -> FixturePortal:
+    """
+    Gera `pages` páginas divididas em seções, com menu (<nav>), breadcrumbs,
+    títulos, blocos de código e links entre páginas relacionadas.
+
+    Uma fração `long_page_ratio` tem seções grandes (exercita a divisão de
+    chunks) e `duplicate_ratio` ganha uma versão para impressão quase idêntica
+    (exercita a deduplicação).
+    """
+    rng = random.Random(seed)
+    sections = [_section_name(i) for i in range(min(max(pages // 25, 1), len(SECTIONS) * 4))]
+    paths = [f"/{_slug(sections[i % len(sections)])}/pagina-{i}.html" for i in range(pages)]
+    by_section: dict[str, list[int]] = {}
+    for i in range(pages):
+        by_section.setdefault(sections[i % len(sections)], []).append(i)
+
+    portal = FixturePortal()
+    portal.pages["/"] = _index_page(sections, by_section, paths)
+    for section, members in by_section.items():
+        portal.pages[f"/{_slug(section)}/"] = _section_page(section, sections, members, paths)
+
+    for i, path in enumerate(paths):
+        section = sections[i % len(sections)]
+        topic = TOPICS[rng.randrange(len(TOPICS))]
+        title = f"{topic.title()}: {rng.choice(VOCABULARY)} {rng.choice(VOCABULARY)} ({i})"
+        long_page = rng.random() < long_page_ratio
+        body = _page_body(rng, title, section, topic, long_page)
+        related = rng.sample(range(pages), k=min(5, pages))
+        links = "".join(f'<li><a href="{paths[j]}">Página {j}</a></li>' for j in related if j != i)
+        printable = rng.random() < duplicate_ratio
+        if printable:
+            links += f'<li><a href="{path}?print=1">Versão para impressão</a></li>'
+        menu = {"sections": sections, "members": by_section[section], "paths": paths}
+        portal.pages[path] = _layout(title, section, body=body + f"<h2>Veja também</h2><ul>{links}</ul>", **menu)
+        if printable:
+            portal.pages[f"{path}?print=1"] = _layout(
+                title, section, body=body + "<p>Versão para impressão.</p>", **menu
+            )
+
+    urls = "".join(f"<url><loc>{{base}}{html.escape(path)}</loc></url>" for path in portal.pages)
+    portal.sitemap = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+    )
+    return portal
+
+
+class FixtureServer:
+    """
+    Servidor HTTP local (thread) que serve o portal com ETag e Last-Modified,
+    respondendo 304 a GETs condicionais como um portal real.
+    """
+
+    def __init__(self, portal: FixturePortal, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.portal = portal
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fixture-site", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def domain(self) -> str:
+        return self.base_url.split("://", 1)[1]
+
+    def __enter__(self) -> "FixtureServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+        last_modified = email.utils.formatdate(0, usegmt=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                if self.path == "/sitemap.xml":
+                    body = server.portal.sitemap.replace("{base}", server.base_url)
+                    content_type = "application/xml"
+                else:
+                    body, content_type = server.portal.pages.get(self.path), "text/html; charset=utf-8"
+                if body is None:
+                    self._send(404, b"", "text/plain")
+                    return
+                payload = body.encode("utf-8")
+                etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, b"", content_type, etag)
+                    return
+                self._send(200, payload, content_type, etag)
+
+            def _send(self, status: int, payload: bytes, content_type: str, etag: str | None = None) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("Last-Modified", last_modified)
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+def _page_body(rng: random.Random, title: str, section: str, topic: str, long_page: bool) -> str:
+    parts = [f"<h1>{html.escape(title)}</h1>", f"<p>{_paragraph(rng, 40)}</p>"]
+    for _ in range(rng.randint(3, 6)):
+        parts.append(f"<h2>{rng.choice(VOCABULARY).title()} de {html.escape(topic)}</h2>")
+        for _ in range(rng.randint(1, 3)):
+            parts.append(f"<p>{_paragraph(rng, rng.randint(40, 120))}</p>")
+        if rng.random() < 0.5:
+            command = rng.choice(COMMANDS).format(topic=_slug(topic), section=_slug(section))
+            parts.append(f"<pre><code>{html.escape(command)}</code></pre>")
+        if rng.random() < 0.3:
+            items = "".join(f"<li>{_paragraph(rng, 12)}</li>" for _ in range(rng.randint(3, 6)))
+            parts.append(f"<ul>{items}</ul>")
+    if long_page:
+        parts.append("<h2>Referência completa</h2>")
+        parts.extend(f"<p>{_paragraph(rng, 150)}</p>" for _ in range(rng.randint(15, 30)))
+    return "".join(parts)
+
+
+def _layout(
+    title: str, section: str, *, body: str, sections: list[str], members: list[int], paths: list[str]
+) -> str:
+    siblings = "".join(f'<li><a href="{paths[j]}">Página {j}</a></li>' for j in members[:10])
+    menu = "".join(
+        f'<li><a href="/{_slug(name)}/">{html.escape(name)}</a>'
+        + (f"<ul>{siblings}</ul>" if name == section else "")
+        + "</li>"
+        for name in sections
+    )
+    return (
+        f"<!doctype html><html><head><meta charset='utf-8'><title>{html.escape(title)}</title></head><body>"
+        f"<header>Portal Interno</header><nav><ul>{menu}</ul></nav>"
+        f'<ul class="breadcrumbs"><li>Início</li><li>{html.escape(section)}</li><li>{html.escape(title)}</li></ul>'
+        f"<main>{body}</main><footer>Equipe de Plataforma</footer></body></html>"
+    )
+
+
+def _index_page(sections: list[str], by_section: dict[str, list[int]], paths: list[str]) -> str:
+    items = "".join(f'<li><a href="/{_slug(name)}/">{html.escape(name)}</a></li>' for name in sections)
+    body = f"<h1>Portal Interno</h1><ul>{items}</ul>"
+    return _layout(
+        "Portal Interno", sections[0], body=body, sections=sections, members=by_section[sections[0]], paths=paths
+    )
+
+
+def _section_page(section: str, sections: list[str], members: list[int], paths: list[str]) -> str:
+    items = "".join(f'<li><a href="{paths[j]}">Página {j}</a></li>' for j in members)
+    body = f"<h1>{html.escape(section)}</h1><ul>{items}</ul>"
+    return _layout(section, section, body=body, sections=sections, members=members, paths=paths)
+
+
+def _section_name(position: int) -> str:
+    name = SECTIONS[position % len(SECTIONS)]
+    return name if position < len(SECTIONS) else f"{name} {position // len(SECTIONS) + 1}"
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+
+def _slug(text: str) -> str:
+    ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return "-".join(ascii_text.lower().split())
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuração compartilhada por módulos do banco (db.models, db.local_index) e da ingestão.
+
+# Largura dos vetores; deve bater com o provedor de embeddings (mudar exige recriar as tabelas e reingerir).
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+
+# "pgvector" (padrão) consulta o banco; "local" busca no snapshot memory-mapped (db.local_index),
+# e só então db.models instala os triggers que alimentam chunk_changes.
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pgvector")
@@ -1,7 +1,15 @@
 from __future__ import annotations
 
+import os
+from functools import lru_cache
+
+import soupsieve
 from bs4 import BeautifulSoup, Tag
 
+# "html.parser" (puro Python, padrão) ou "lxml" (parser em C, bem mais rápido).
+HTML_PARSER = os.getenv("HTML_PARSER", "html.parser")
+PARSER_BACKENDS = ("html.parser", "lxml")
+
 NOISE_SELECTORS = [
     "header",
     "footer",
@@ -17,15 +25,33 @@ NOISE_SELECTORS = [
 ]
 
 
-def extract_main(html: str) -> BeautifulSoup:
+@lru_cache
+def _noise_pattern() -> soupsieve.SoupSieve:
+    # Um único seletor compilado: uma passada na árvore em vez de uma por seletor.
+    return soupsieve.compile(", ".join(NOISE_SELECTORS))
+
+
+def parse_html(html: str, backend: str | None = None) -> BeautifulSoup:
+    """Faz o parse do HTML com o backend configurado (HTML_PARSER)."""
+    backend = backend or HTML_PARSER
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Backend de parser desconhecido: {backend}")
+    return BeautifulSoup(html, backend)
+
+
+def extract_main(html: str | BeautifulSoup, backend: str | None = None) -> BeautifulSoup:
     """
     Remove elementos de navegação/ruído e devolve apenas <main> ou <article>.
+
+    Aceita também um soup já parseado, que é limpo in-place.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    soup = html if isinstance(html, BeautifulSoup) else parse_html(html, backend)
 
-    for selector in NOISE_SELECTORS:
-        for node in soup.select(selector):
-            node.decompose()
+    for node in _noise_pattern().select(soup):
+        # Nós aninhados em um ruído já removido chegam aqui destruídos.
+        if node.decomposed:
+            continue
+        node.decompose()
 
     main = soup.find("main") or soup.find("article")
     return main or soup
@@ -1,19 +1,29 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import logging
-from collections import deque
+import time
+from concurrent.futures import Executor
 from dataclasses import dataclass
-from typing import Iterable
+from typing import AsyncIterator, Callable, Iterable
+from urllib.parse import urlparse
 
+import httpx
 import requests
 from requests import Response
 
 from crawler.extract import PageContent, parse_page
+from crawler.frontier import START_PRIORITY, Frontier, url_depth
 from crawler.normalize_urls import canonicalize, is_internal
+from crawler.sitemap import parse_sitemap, sitemap_url
+from db.crawl_cache import CachedPage
+from observability.metrics import FETCH_SECONDS
 
 logger = logging.getLogger(__name__)
 
+GONE_STATUSES = (404, 410)
+
 
 @dataclass
 class CrawlerConfig:
@@ -21,32 +31,64 @@ class CrawlerConfig:
     timeout: int = 20
     user_agent: str = "CorpGuideCrawler/0.1"
     same_domain_only: bool = True
+    concurrency: int = 16
+    max_connections_per_host: int = 6
+    seed_sitemap: bool = True
+    max_sitemaps: int = 10
 
 
 class Crawler:
-    """Crawler simples baseado em requests, com fila BFS e deduplicação."""
+    """
+    Crawler baseado em requests/httpx, com fronteira priorizada e deduplicação.
+
+    Páginas rasas (menos segmentos no path ou mais altas no menu de navegação)
+    são baixadas primeiro; o sitemap.xml, quando existe, semeia a fronteira.
+    """
 
-    def __init__(self, config: CrawlerConfig | None = None) -> None:
+    def __init__(
+        self,
+        config: CrawlerConfig | None = None,
+        cache_lookup: Callable[[str], CachedPage | None] | None = None,
+        parse_executor: Executor | None = None,
+    ) -> None:
         self.config = config or CrawlerConfig()
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": self.config.user_agent})
+        # Com cache_lookup, os downloads viram GETs condicionais e respostas 304
+        # são puladas sem parse; os links em cache continuam alimentando a fila.
+        self.cache_lookup = cache_lookup
+        self.not_modified: list[str] = []
+        self.failed: list[str] = []
+        # 404/410 ficam fora de `failed`: a página foi removida do site, não falhou.
+        self.gone: list[str] = []
+        # No crawl assíncrono, o parse roda neste executor (ex.: ProcessPoolExecutor
+        # para usar vários núcleos); None usa o pool de threads padrão.
+        self.parse_executor = parse_executor
 
     def crawl(self, start_url: str) -> Iterable[PageContent]:
         base_url = canonicalize(start_url)
         base_domain = canonicalize(start_url).split("://", 1)[1].split("/", 1)[0]
         visited: set[str] = set()
-        queue = deque([base_url])
+        frontier = Frontier()
+        frontier.push(base_url, START_PRIORITY)
+        if self._should_seed_sitemap():
+            self._seed_sitemap(frontier, base_url, base_domain)
 
-        while queue and len(visited) < self.config.max_pages:
-            url = queue.popleft()
-            if url in visited:
-                continue
+        while frontier and len(visited) < self.config.max_pages:
+            url = frontier.pop()
             if self.config.same_domain_only and not is_internal(url, base_domain):
                 continue
+            cached = self.cache_lookup(url) if self.cache_lookup else None
             try:
-                response = self._fetch(url)
+                response = self._fetch(url, cached)
             except requests.RequestException as exc:
-                logger.warning("Falha ao baixar %s: %s", url, exc)
+                self._record_failure(url, exc.response.status_code if exc.response is not None else None, exc)
+                continue
+
+            if response.status_code == 304 and cached:
+                visited.add(url)
+                self.not_modified.append(url)
+                self._enqueue(frontier, cached.links, [], base_domain)
                 continue
 
             content_type = response.headers.get("Content-Type", "")
@@ -58,24 +100,207 @@ class Crawler:
             visited.add(url)
             html = self._decode_response(response)
             page = parse_page(url, html)
+            self._set_validators(page, response)
             yield page
 
-            for link in page.links:
-                if link not in visited and link not in queue:
-                    if not self.config.same_domain_only or is_internal(link, base_domain):
-                        queue.append(link)
+            self._enqueue(frontier, page.links, page.nav_hierarchy, base_domain)
 
-    def _fetch(self, url: str) -> Response:
-        response = self.session.get(url, timeout=self.config.timeout)
+    async def crawl_async(self, start_url: str) -> AsyncIterator[PageContent]:
+        """
+        Versão concorrente de `crawl` sobre httpx: mantém até `concurrency`
+        downloads em andamento, limitados a `max_connections_per_host` por host.
+        """
+        base_url = canonicalize(start_url)
+        base_domain = base_url.split("://", 1)[1].split("/", 1)[0]
+        visited: set[str] = set()
+        frontier = Frontier()
+        frontier.push(base_url, START_PRIORITY)
+        host_limits: dict[str, asyncio.Semaphore] = {}
+        pending: set[asyncio.Task] = set()
+
+        limits = httpx.Limits(
+            max_connections=self.config.concurrency,
+            max_keepalive_connections=self.config.concurrency,
+        )
+        async with httpx.AsyncClient(
+            headers={"User-Agent": self.config.user_agent},
+            timeout=self.config.timeout,
+            limits=limits,
+            follow_redirects=True,
+        ) as client:
+            if self._should_seed_sitemap():
+                await self._seed_sitemap_async(client, frontier, base_url, base_domain)
+            try:
+                while frontier or pending:
+                    while (
+                        frontier
+                        and len(pending) < self.config.concurrency
+                        and len(visited) + len(pending) < self.config.max_pages
+                    ):
+                        url = frontier.pop()
+                        if self.config.same_domain_only and not is_internal(url, base_domain):
+                            continue
+                        host = urlparse(url).netloc
+                        limit = host_limits.setdefault(
+                            host, asyncio.Semaphore(self.config.max_connections_per_host)
+                        )
+                        # A consulta pode ir ao banco: fora do event loop, uma por vez (mesma sessão).
+                        cached = await asyncio.to_thread(self.cache_lookup, url) if self.cache_lookup else None
+                        pending.add(
+                            asyncio.create_task(self._fetch_page_async(client, limit, url, cached))
+                        )
+
+                    if not pending:
+                        break
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        url, page, links = task.result()
+                        if url is None:
+                            continue
+                        visited.add(url)
+                        if page is not None:
+                            yield page
+                        nav = page.nav_hierarchy if page is not None else []
+                        self._enqueue(frontier, links, nav, base_domain)
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    def _enqueue(
+        self, frontier: Frontier, links: Iterable[str], nav_hierarchy: list[dict], base_domain: str
+    ) -> None:
+        """Links do menu entram com a profundidade do menu; os demais, com a do path."""
+        candidates = {link: float(url_depth(link)) for link in links}
+        for item in nav_hierarchy:
+            if item.get("url"):
+                depth = float(item["depth"])
+                candidates[item["url"]] = min(depth, candidates.get(item["url"], depth))
+        for link, priority in candidates.items():
+            if not self.config.same_domain_only or is_internal(link, base_domain):
+                frontier.push(link, priority)
+
+    def _should_seed_sitemap(self) -> bool:
+        return self.config.seed_sitemap and self.config.max_pages > 1
+
+    def _seed_sitemap(self, frontier: Frontier, base_url: str, base_domain: str) -> None:
+        pending_sitemaps = [sitemap_url(base_url)]
+        fetched = 0
+        while pending_sitemaps and fetched < self.config.max_sitemaps:
+            target = pending_sitemaps.pop(0)
+            fetched += 1
+            try:
+                response = self.session.get(target, timeout=self.config.timeout)
+                response.raise_for_status()
+            except requests.RequestException as exc:
+                logger.info("Sitemap indisponível em %s: %s", target, exc)
+                continue
+            pending_sitemaps.extend(self._push_sitemap_entries(frontier, response.content, base_domain))
+
+    async def _seed_sitemap_async(
+        self, client: httpx.AsyncClient, frontier: Frontier, base_url: str, base_domain: str
+    ) -> None:
+        pending_sitemaps = [sitemap_url(base_url)]
+        fetched = 0
+        while pending_sitemaps and fetched < self.config.max_sitemaps:
+            target = pending_sitemaps.pop(0)
+            fetched += 1
+            try:
+                response = await client.get(target)
+                response.raise_for_status()
+            except httpx.HTTPError as exc:
+                logger.info("Sitemap indisponível em %s: %s", target, exc)
+                continue
+            pending_sitemaps.extend(self._push_sitemap_entries(frontier, response.content, base_domain))
+
+    def _push_sitemap_entries(self, frontier: Frontier, content: bytes, base_domain: str) -> list[str]:
+        entries, children = parse_sitemap(content)
+        for entry in entries:
+            if self.config.same_domain_only and not is_internal(entry.url, base_domain):
+                continue
+            # <priority> do sitemap (0.0-1.0, padrão 0.5) desempata páginas da mesma profundidade.
+            bonus = (entry.priority if entry.priority is not None else 0.5) - 0.5
+            frontier.push(entry.url, url_depth(entry.url) - bonus)
+        return children
+
+    async def _fetch_page_async(
+        self,
+        client: httpx.AsyncClient,
+        limit: asyncio.Semaphore,
+        url: str,
+        cached: CachedPage | None = None,
+    ) -> tuple[str | None, PageContent | None, Iterable[str]]:
+        """Baixa e processa uma URL; devolve (None, None, ()) em caso de falha."""
+        try:
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url, headers=self._conditional_headers(cached))
+                except httpx.HTTPError:
+                    FETCH_SECONDS.labels("error").observe(time.perf_counter() - started)
+                    raise
+                FETCH_SECONDS.labels(str(response.status_code)).observe(time.perf_counter() - started)
+            # httpx trata 3xx como erro em raise_for_status, então o 304 vem antes.
+            if response.status_code == 304 and cached:
+                self.not_modified.append(url)
+                return url, None, cached.links
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            status = exc.response.status_code if isinstance(exc, httpx.HTTPStatusError) else None
+            self._record_failure(url, status, exc)
+            return None, None, ()
+
+        content_type = response.headers.get("Content-Type", "")
+        if "text/html" not in content_type:
+            logger.info("Ignorando %s (content-type: %s)", url, content_type)
+            return url, None, ()
+
+        html = self._decode_response(response)
+        loop = asyncio.get_running_loop()
+        page = await loop.run_in_executor(self.parse_executor, parse_page, url, html)
+        self._set_validators(page, response)
+        return url, page, page.links
+
+    def _fetch(self, url: str, cached: CachedPage | None = None) -> Response:
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                url, timeout=self.config.timeout, headers=self._conditional_headers(cached)
+            )
+        except requests.RequestException:
+            FETCH_SECONDS.labels("error").observe(time.perf_counter() - started)
+            raise
+        FETCH_SECONDS.labels(str(response.status_code)).observe(time.perf_counter() - started)
         response.raise_for_status()
         return response
 
-    def _decode_response(self, response: Response) -> str:
+    def _record_failure(self, url: str, status: int | None, exc: Exception) -> None:
+        if status in GONE_STATUSES:
+            logger.info("Página removida %s (%s)", url, status)
+            self.gone.append(url)
+            return
+        logger.warning("Falha ao baixar %s: %s", url, exc)
+        self.failed.append(url)
+
+    @staticmethod
+    def _conditional_headers(cached: CachedPage | None) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    @staticmethod
+    def _set_validators(page: PageContent, response: Response | httpx.Response) -> None:
+        page.etag = response.headers.get("ETag")
+        page.last_modified = response.headers.get("Last-Modified")
+
+    def _decode_response(self, response: Response | httpx.Response) -> str:
         content = response.content
         encodings = [
             "utf-8",
             response.encoding,
-            response.apparent_encoding,
+            getattr(response, "apparent_encoding", None),
             "latin-1",
         ]
         for enc in encodings:
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+import copy
 from collections import deque
 from dataclasses import dataclass, field
 from typing import Iterable
 
 from bs4 import BeautifulSoup, Tag
+from ftfy import fix_text
 from markdownify import markdownify as html_to_md
 
-from crawler.clean_html import clean_text, extract_main
+from crawler.clean_html import clean_text, extract_main, parse_html
 from crawler.normalize_urls import resolve
+from observability.metrics import PARSE_SECONDS
+
+HEADING_TAGS = ("h1", "h2", "h3", "h4")
 
 
 @dataclass
@@ -18,6 +23,19 @@ class HeadingNode:
     depth: int
 
 
+@dataclass
+class ParsedDocument:
+    """Resultado do parse único do HTML, compartilhado por chunker e payload."""
+
+    text: str
+    sections: list[dict] = field(default_factory=list)
+    main: Tag | None = field(default=None, repr=False, compare=False)
+
+    def __getstate__(self) -> dict:
+        # A árvore do BeautifulSoup não atravessa processos (pool de parse).
+        return {**self.__dict__, "main": None}
+
+
 @dataclass
 class PageContent:
     url: str
@@ -28,24 +46,36 @@ class PageContent:
     nav_hierarchy: list[dict] = field(default_factory=list)
     breadcrumbs: list[str] = field(default_factory=list)
     links: set[str] = field(default_factory=set)
+    etag: str | None = None
+    last_modified: str | None = None
+    document: ParsedDocument | None = field(default=None, repr=False, compare=False)
 
 
-def parse_page(url: str, html: str) -> PageContent:
-    """Extrai todos os dados estruturados necessários para a ingestão."""
-    soup = BeautifulSoup(html, "html.parser")
-    main = extract_main(html)
+@PARSE_SECONDS.time()
+def parse_page(url: str, html: str, backend: str | None = None) -> PageContent:
+    """Extrai todos os dados estruturados necessários para a ingestão (`backend`: ver HTML_PARSER)."""
+    soup = parse_html(html, backend)
 
-    title = (soup.title.string.strip() if soup.title else "") or _first_heading(main)
-    headings = list(_extract_headings(main))
+    # Título, navegação e breadcrumbs vêm do HTML completo, antes da limpeza.
+    page_title = soup.title.string.strip() if soup.title and soup.title.string else ""
     nav_hierarchy = list(_extract_nav_tree(soup, base_url=url))
     breadcrumbs = _extract_breadcrumbs(soup)
+
+    main = extract_main(soup)
+    title = page_title or _first_heading(main)
     links = {
         link
         for href in _extract_links(main)
         if (link := resolve(url, href)) is not None
     }
 
+    # A ordem importa: clean_text altera a árvore (substitui <code>/<pre> por texto),
+    # então as seções são extraídas antes e o texto completo por último.
+    sections = list(_split_sections(_section_root(main), title=title, url=url))
+    headings = list(_extract_headings(main))
     markdown = html_to_md(str(main), strip=["style", "script"])
+    text = clean_text(main)
+
     return PageContent(
         url=url,
         title=title,
@@ -55,9 +85,78 @@ def parse_page(url: str, html: str) -> PageContent:
         nav_hierarchy=nav_hierarchy,
         breadcrumbs=breadcrumbs,
         links=links,
+        document=ParsedDocument(text=text, sections=sections, main=main),
     )
 
 
+def ensure_document(page: PageContent) -> ParsedDocument:
+    """Devolve o documento parseado, refazendo o parse só se a página não o tiver."""
+    if page.document is None:
+        page.document = parse_page(page.url, page.raw_html).document
+    return page.document
+
+
+def _section_root(main: Tag) -> Tag:
+    """
+    Nó cujos filhos diretos viram seções. Sem <main>/<article>, `extract_main`
+    devolve o documento inteiro, e aí os títulos estão dentro de <body>: o lxml
+    sempre cria <html><body>, o html.parser só quando estão no HTML.
+    """
+    if isinstance(main, BeautifulSoup):
+        return main.body or main
+    return main
+
+
+def _split_sections(root: Tag, title: str, url: str) -> Iterable[dict]:
+    domain = url.split("://", 1)[-1].split("/", 1)[0]
+    hierarchy: list[str] = []
+    current = {
+        "title": title,
+        "depth": 1,
+        "parts": [],
+        "breadcrumbs": [],
+        "url": url,
+        "domain": domain,
+    }
+
+    for node in root.children:
+        if isinstance(node, Tag) and node.name in HEADING_TAGS:
+            if current["parts"]:
+                yield {
+                    "title": current["title"],
+                    "text": "\n\n".join(current["parts"]),
+                    "depth": current["depth"],
+                    "breadcrumbs": list(current["breadcrumbs"]),
+                    "url": current["url"],
+                    "domain": current["domain"],
+                }
+                current["parts"] = []
+            text = fix_text(node.get_text(strip=True))
+            depth = int(node.name[1])
+            hierarchy = hierarchy[: depth - 1]
+            hierarchy.append(text)
+            current.update(
+                {
+                    "title": text or title,
+                    "depth": depth,
+                    "breadcrumbs": list(hierarchy),
+                }
+            )
+        else:
+            markdown = html_to_md(str(node), strip=[])
+            current["parts"].append(fix_text(markdown))
+
+    if current["parts"]:
+        yield {
+            "title": current["title"],
+            "text": "\n\n".join(current["parts"]),
+            "depth": current["depth"],
+            "breadcrumbs": list(current["breadcrumbs"]),
+            "url": current["url"],
+            "domain": current["domain"],
+        }
+
+
 def _extract_links(root: Tag) -> Iterable[str]:
     for a in root.find_all("a", href=True):
         href = a["href"].strip()
@@ -105,7 +204,8 @@ def _extract_breadcrumbs(soup: BeautifulSoup) -> list[str]:
 
 def _first_heading(root: Tag) -> str:
     for tag in root.find_all(["h1", "h2", "h3"]):
-        text = clean_text(tag)
+        # Cópia para não alterar a árvore compartilhada (clean_text é destrutivo).
+        text = clean_text(copy.copy(tag))
         if text:
             return text
     return ""
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+from urllib.parse import urlparse
+
+START_PRIORITY = -1.0
+
+
+class Frontier:
+    """
+    Fila de prioridade de URLs com pertinência O(1).
+
+    Menor prioridade sai primeiro; empates seguem a ordem de inserção (BFS).
+    Reinserir uma URL ainda pendente com prioridade melhor a promove.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, str]] = []
+        self._pending: dict[str, float] = {}
+        self._done: set[str] = set()
+        self._counter = itertools.count()
+
+    def push(self, url: str, priority: float | None = None) -> bool:
+        if priority is None:
+            priority = url_depth(url)
+        if url in self._done:
+            return False
+        current = self._pending.get(url)
+        if current is not None and current <= priority:
+            return False
+        self._pending[url] = priority
+        heapq.heappush(self._heap, (priority, next(self._counter), url))
+        return True
+
+    def pop(self) -> str | None:
+        """Remove a próxima URL e a marca como vista (não volta para a fila)."""
+        while self._heap:
+            priority, _, url = heapq.heappop(self._heap)
+            # Entradas obsoletas ficam no heap após uma promoção; são descartadas aqui.
+            if self._pending.get(url) != priority:
+                continue
+            del self._pending[url]
+            self._done.add(url)
+            return url
+        return None
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._pending or url in self._done
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __bool__(self) -> bool:
+        return bool(self._pending)
+
+
+def url_depth(url: str) -> int:
+    """Quantidade de segmentos do path: `/guia/deploy/argo` -> 3."""
+    return len([part for part in urlparse(url).path.split("/") if part])
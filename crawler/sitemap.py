@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import gzip
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+
+from crawler.normalize_urls import canonicalize
+
+
+@dataclass
+class SitemapEntry:
+    url: str
+    priority: float | None = None
+
+
+def parse_sitemap(content: bytes) -> tuple[list[SitemapEntry], list[str]]:
+    """
+    Lê um sitemap (urlset) ou sitemap index.
+
+    Devolve as URLs de páginas e as URLs de sitemaps filhos; XML inválido vira listas vazias.
+    """
+    if content[:2] == b"\x1f\x8b":
+        try:
+            content = gzip.decompress(content)
+        except OSError:
+            return [], []
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError:
+        return [], []
+
+    entries: list[SitemapEntry] = []
+    children: list[str] = []
+    for node in root:
+        loc = _child_text(node, "loc")
+        if not loc:
+            continue
+        if _local_name(node.tag) == "sitemap":
+            children.append(loc)
+        elif _local_name(node.tag) == "url":
+            entries.append(SitemapEntry(url=canonicalize(loc), priority=_parse_priority(node)))
+    return entries, children
+
+
+def sitemap_url(base_url: str) -> str:
+    scheme, rest = base_url.split("://", 1)
+    return f"{scheme}://{rest.split('/', 1)[0]}/sitemap.xml"
+
+
+def _parse_priority(node: ET.Element) -> float | None:
+    value = _child_text(node, "priority")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _child_text(node: ET.Element, name: str) -> str:
+    for child in node:
+        if _local_name(child.tag) == name:
+            return (child.text or "").strip()
+    return ""
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
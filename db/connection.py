@@ -5,6 +5,7 @@ from functools import lru_cache
 
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 load_dotenv()
@@ -27,3 +28,18 @@ def get_session_factory():
 
 def get_session():
     return get_session_factory()()
+
+
+@lru_cache
+def get_async_engine():
+    # Mesmo DATABASE_URL: o dialeto psycopg (v3) tem variante assíncrona nativa.
+    return create_async_engine(DATABASE_URL)
+
+
+@lru_cache
+def get_async_session_factory():
+    return async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+
+
+def get_async_session() -> AsyncSession:
+    return get_async_session_factory()()
@@ -0,0 +1,12 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+
+@dataclass
+class CachedPage:
+    """Validadores e links da última versão ingerida de uma URL (linha de crawl_cache)."""
+
+    etag: str | None = None
+    last_modified: str | None = None
+    links: list[str] = field(default_factory=list)
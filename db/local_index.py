@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from config import RETRIEVAL_BACKEND
+from db.connection import get_session
+from db.models import Chunk, ChunkChange, Document, install_change_triggers
+from db.queries import visible_documents
+
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "data/vector_index")
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+LOCAL_INDEX_REFRESH_SECONDS = float(os.getenv("LOCAL_INDEX_REFRESH_SECONDS", "60"))
+
+PREVIEW_CHARS = 401  # um a mais que o preview do /ask, para ele decidir se põe "..."
+SEARCH_BLOCK_ROWS = 65536
+REFRESH_BATCH_ROWS = 5000
+KEEP_VERSIONS = 2
+
+_chunks_changed = threading.Event()
+
+
+def notify_chunks_changed() -> None:
+    """Chamado após um commit de ingestão: o próximo /ask local faz refresh incremental."""
+    _chunks_changed.set()
+
+
+def export_snapshot(session: Session, path: str = LOCAL_INDEX_PATH, dtype: str = LOCAL_INDEX_DTYPE) -> pathlib.Path:
+    """
+    Exporta chunks.embedding para `path/<versão>/` (vetores normalizados, ids e
+    metadados) e troca o ponteiro CURRENT de forma atômica.
+    """
+    root = pathlib.Path(path)
+    # Nanossegundos e pid no nome: dois exports no mesmo segundo não disputam o diretório.
+    now = time.time_ns()
+    stamp = time.strftime("%Y%m%d%H%M%S", time.localtime(now // 1_000_000_000))
+    version = root / f"{stamp}-{now % 1_000_000_000:09d}-{os.getpid()}"
+    version.mkdir(parents=True)
+
+    # O refresh depende do log: garante os triggers mesmo se db.models rodou com outro RETRIEVAL_BACKEND.
+    install_change_triggers()
+    # Lido antes das linhas: o que for gravado durante o export volta no primeiro refresh.
+    change_cursor = _change_cursor(session)
+    total = session.scalar(select(func.count()).select_from(_visible_chunk_ids().subquery())) or 0
+    dimensions = Chunk.embedding.type.dim
+    vectors = np.lib.format.open_memmap(
+        version / "vectors.npy", mode="w+", dtype=np.dtype(dtype), shape=(total, dimensions)
+    )
+    ids = np.zeros(total, dtype=np.int64)
+    records: list[dict] = []
+
+    rows = session.execute(_rows_query().order_by(Chunk.id).execution_options(yield_per=2000))
+    position = 0
+    for row in rows:
+        if position >= total:  # chunks inseridos durante o export entram no próximo refresh
+            break
+        vectors[position] = _normalize(row.embedding)
+        ids[position] = row.id
+        records.append(_record(row))
+        position += 1
+    vectors.flush()
+    del vectors
+
+    np.save(version / "ids.npy", ids[:position])
+    (version / "records.json").write_text(json.dumps(records, ensure_ascii=False), encoding="utf-8")
+    (version / "meta.json").write_text(json.dumps({"rows": position, "dtype": dtype, "change_cursor": change_cursor}), encoding="utf-8")
+
+    pointer = root / "CURRENT.tmp"
+    pointer.write_text(version.name, encoding="utf-8")
+    os.replace(pointer, root / "CURRENT")
+    _prune_versions(root, keep=version.name)
+    _prune_change_log(session, root)
+    return version
+
+
+class LocalVectorIndex:
+    """
+    Busca top-k por cosseno sobre o snapshot memory-mapped, mais um delta em
+    memória com chunks inseridos ou alterados depois do export e tombstones
+    das versões substituídas/removidas. Vários workers na mesma máquina
+    compartilham o page cache do arquivo.
+    """
+
+    def __init__(self, path: str = LOCAL_INDEX_PATH) -> None:
+        root = pathlib.Path(path)
+        self.root = root
+        self.version = _current_version(root)
+        version = root / self.version
+        meta = json.loads((version / "meta.json").read_text(encoding="utf-8"))
+        if "change_cursor" not in meta:
+            raise RuntimeError(
+                f"Snapshot {version} sem change_cursor: exporte de novo com `python -m db.local_index export`"
+            )
+        self.change_cursor = meta["change_cursor"]
+        self.vectors = np.load(version / "vectors.npy", mmap_mode="r")[: meta["rows"]]
+        self.ids = np.load(version / "ids.npy")
+        self.records = json.loads((version / "records.json").read_text(encoding="utf-8"))
+        self.removed = np.zeros(len(self.ids), dtype=bool)
+        self.delta_vectors = np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+        self.delta_ids = np.zeros(0, dtype=np.int64)
+        self.delta_records: list[dict] = []
+        self.refreshed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def search(self, query: list[float], top_k: int) -> list[tuple[int, dict, float]]:
+        """Devolve (chunk_id, registro, similaridade) do mais para o menos similar."""
+        q = _normalize(query)
+        base_scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start : start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            base_scores[start : start + len(block)] = block @ q
+        base_scores[self.removed] = -np.inf
+
+        delta_vectors, delta_ids, delta_records = self.delta_vectors, self.delta_ids, self.delta_records
+        scores = np.concatenate([base_scores, delta_vectors @ q])
+        k = min(top_k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+
+        results = []
+        for position in best:
+            if not np.isfinite(scores[position]):
+                continue
+            if position < len(self.ids):
+                results.append((int(self.ids[position]), self.records[position], float(scores[position])))
+            else:
+                offset = position - len(self.ids)
+                results.append((int(delta_ids[offset]), delta_records[offset], float(scores[position])))
+        return results
+
+    def refresh(self, session: Session) -> None:
+        """
+        Relê os chunks registrados em chunk_changes desde o export (ou último
+        refresh): a versão antiga vira tombstone e, se o chunk ainda é visível,
+        a atual entra no delta.
+        """
+        with self._lock:
+            cursor = _change_cursor(session)
+            changed = np.fromiter(
+                session.scalars(
+                    select(ChunkChange.chunk_id).where(ChunkChange.txid >= self.change_cursor).distinct()
+                ),
+                dtype=np.int64,
+            )
+            if len(changed):
+                self.removed |= np.isin(self.ids, changed)
+
+                keep = ~np.isin(self.delta_ids, changed)
+                delta_vectors = [self.delta_vectors[keep]]
+                delta_ids = [self.delta_ids[keep]]
+                delta_records = [record for record, kept in zip(self.delta_records, keep) if kept]
+                for start in range(0, len(changed), REFRESH_BATCH_ROWS):
+                    batch = changed[start : start + REFRESH_BATCH_ROWS].tolist()
+                    rows = session.execute(_rows_query().where(Chunk.id.in_(batch))).all()
+                    if rows:
+                        delta_vectors.append(np.vstack([_normalize(row.embedding) for row in rows]))
+                        delta_ids.append(np.array([row.id for row in rows], dtype=np.int64))
+                        delta_records += [_record(row) for row in rows]
+
+                # Troca as referências de uma vez: buscas em andamento seguem com o estado anterior.
+                self.delta_vectors = np.concatenate(delta_vectors)
+                self.delta_ids = np.concatenate(delta_ids)
+                self.delta_records = delta_records
+            self.change_cursor = cursor
+            self.refreshed_at = time.monotonic()
+
+    def refresh_due(self) -> bool:
+        return _chunks_changed.is_set() or time.monotonic() - self.refreshed_at >= LOCAL_INDEX_REFRESH_SECONDS
+
+    def refresh_if_due(self) -> None:
+        if not self.refresh_due():
+            return
+        _chunks_changed.clear()
+        session = get_session()
+        try:
+            self.refresh(session)
+        finally:
+            session.close()
+
+
+_index: LocalVectorIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_local_index() -> LocalVectorIndex:
+    """Índice do snapshot atual; um export novo (CURRENT trocado) é carregado no próximo refresh."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = LocalVectorIndex()
+        elif _index.refresh_due() and _current_version(_index.root) != _index.version:
+            _index = LocalVectorIndex(str(_index.root))
+        return _index
+
+
+def _rows_query():
+    return select(
+        Chunk.id,
+        Chunk.embedding,
+        Chunk.chunk_text,
+        Chunk.metadata_json,
+        Document.url,
+        Document.title,
+    ).join(Document, Document.id == Chunk.document_id).where(visible_documents())
+
+
+def _visible_chunk_ids():
+    """Só a geração ativa: um rebuild em sombra entra no índice depois do flip."""
+    return select(Chunk.id).join(Document, Document.id == Chunk.document_id).where(visible_documents())
+
+
+def _current_version(root: pathlib.Path) -> str:
+    return (root / "CURRENT").read_text(encoding="utf-8").strip()
+
+
+def _change_cursor(session: Session) -> int:
+    """
+    Menor transação ainda em andamento. Tudo abaixo dela já terminou, então
+    o próximo refresh lê as entradas com txid >= cursor sem perder commits
+    atrasados (reler uma entrada é inofensivo).
+    """
+    return session.scalar(select(func.txid_snapshot_xmin(func.txid_current_snapshot())))
+
+
+def _record(row) -> dict:
+    metadata = row.metadata_json or {}
+    return {
+        "url": row.url,
+        "title": row.title or metadata.get("title"),
+        "breadcrumbs": metadata.get("breadcrumbs", []),
+        "text": " ".join(row.chunk_text.split())[:PREVIEW_CHARS],
+    }
+
+
+def _normalize(vector) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+def _prune_versions(root: pathlib.Path, keep: str) -> None:
+    versions = sorted(p for p in root.iterdir() if p.is_dir())
+    for old in versions[:-KEEP_VERSIONS]:
+        if old.name == keep:
+            continue
+        for file in old.iterdir():
+            file.unlink()
+        old.rmdir()
+
+
+def _prune_change_log(session: Session, root: pathlib.Path) -> None:
+    """Apaga do log o que todos os snapshots mantidos já incluem."""
+    cursors = [
+        json.loads((version / "meta.json").read_text(encoding="utf-8")).get("change_cursor")
+        for version in root.iterdir()
+        if (version / "meta.json").is_file()
+    ]
+    if None in cursors or not cursors:
+        return
+    session.execute(delete(ChunkChange).where(ChunkChange.txid < min(cursors)))
+    session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Exporta chunks.embedding para o índice local memory-mapped.")
+    parser.add_argument("action", choices=("export",))
+    parser.add_argument("--path", default=LOCAL_INDEX_PATH)
+    parser.add_argument("--dtype", choices=("float32", "float16"), default=LOCAL_INDEX_DTYPE)
+    args = parser.parse_args()
+
+    session = get_session()
+    try:
+        version = export_snapshot(session, args.path, args.dtype)
+    finally:
+        session.close()
+    print(f"Snapshot exportado em {version}")
+
+
+if __name__ == "__main__":
+    main()
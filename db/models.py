@@ -2,10 +2,12 @@ from __future__ import annotations
 
 import datetime as dt
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, JSON, String, Text, UniqueConstraint, text
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Index, Integer, JSON, String, Text, UniqueConstraint, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker
 from pgvector.sqlalchemy import Vector
 
+from config import EMBEDDING_DIMENSIONS, RETRIEVAL_BACKEND
 from db.connection import get_engine
 
 
@@ -18,10 +20,22 @@ class Document(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     domain: Mapped[str] = mapped_column(String, index=True)
-    url: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    url: Mapped[str] = mapped_column(String, nullable=False)
+    # Rebuilds gravam uma geração nova em paralelo; o /ask só lê a ativa (ver DomainGeneration).
+    generation: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
     title: Mapped[str | None] = mapped_column(String, nullable=True)
     content: Mapped[str] = mapped_column(Text)
     content_hash: Mapped[str] = mapped_column(String, nullable=False)
+    # SimHash do conteúdo; quase-duplicatas apontam para o documento canônico e ficam sem chunks.
+    simhash: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    canonical_id: Mapped[int | None] = mapped_column(
+        ForeignKey("documents.id", ondelete="SET NULL"), nullable=True
+    )
+    # SimHash (com sinal) dos chunks de outras páginas pelos quais chunks desta foram descartados como
+    # quase-duplicatas; se um deles sair da página de origem, esta é reingerida (ver release_chunk_duplicates).
+    chunk_sources: Mapped[list[int] | None] = mapped_column(ARRAY(BigInteger), nullable=True)
+    # Modelo que gerou os vetores dos chunks; páginas de outro modelo são re-embedadas na ingestão.
+    embedding_model: Mapped[str | None] = mapped_column(String, nullable=True)
     last_update: Mapped[dt.datetime] = mapped_column(
         DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow
     )
@@ -30,6 +44,28 @@ class Document(Base):
         "Chunk", cascade="all, delete-orphan", back_populates="document"
     )
 
+    __table_args__ = (
+        Index("documents_url_generation_key", "url", "generation", unique=True),
+        Index("documents_chunk_sources_idx", "chunk_sources", postgresql_using="gin"),
+    )
+
+
+class DomainGeneration(Base):
+    """
+    Geração de documentos visível em cada domínio. Trocar `generation` é o
+    flip atômico do rebuild; domínios sem registro usam a geração 0.
+    """
+
+    __tablename__ = "domain_generations"
+
+    domain: Mapped[str] = mapped_column(String, primary_key=True)
+    generation: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Geração sendo gravada por um rebuild em andamento (None se não houver).
+    building: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    updated_at: Mapped[dt.datetime] = mapped_column(
+        DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow
+    )
+
 
 class Chunk(Base):
     __tablename__ = "chunks"
@@ -38,20 +74,224 @@ class Chunk(Base):
     document_id: Mapped[int] = mapped_column(ForeignKey("documents.id", ondelete="CASCADE"))
     chunk_index: Mapped[int] = mapped_column(Integer, nullable=False)
     chunk_text: Mapped[str] = mapped_column(Text)
-    embedding: Mapped[list[float]] = mapped_column(Vector(1536))
+    embedding: Mapped[list[float]] = mapped_column(Vector(EMBEDDING_DIMENSIONS))
     metadata_json: Mapped[dict] = mapped_column("metadata", JSON)
+    # Bandas do SimHash do texto (ingestion.dedup.band_keys): acham chunks quase idênticos pelo índice GIN.
+    simhash_bands: Mapped[list[int] | None] = mapped_column(ARRAY(BigInteger), nullable=True)
 
     document: Mapped["Document"] = relationship("Document", back_populates="chunks")
 
-    __table_args__ = (UniqueConstraint("document_id", "chunk_index", name="chunk_idx_unique"),)
+    __table_args__ = (
+        UniqueConstraint("document_id", "chunk_index", name="chunk_idx_unique"),
+        Index("chunks_simhash_bands_idx", "simhash_bands", postgresql_using="gin"),
+    )
+
+
+class ChunkChange(Base):
+    """
+    Log de chunks inseridos, alterados ou removidos (inclusive por troca de
+    título/URL do documento ou flip de geração), preenchido por triggers. O
+    índice local (db.local_index) relê só os chunks registrados desde o
+    último refresh; `txid` é a transação que gerou a entrada.
+    """
+
+    __tablename__ = "chunk_changes"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    chunk_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    txid: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=text("txid_current()"), index=True)
+
+
+class EmbeddingCache(Base):
+    """Embeddings já calculados, endereçados por sha256(modelo + texto do chunk)."""
+
+    __tablename__ = "embedding_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str] = mapped_column(String, nullable=False)
+    embedding: Mapped[list[float]] = mapped_column(Vector(EMBEDDING_DIMENSIONS))
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+
+
+class AnswerCache(Base):
+    """Respostas do LLM reaproveitadas para perguntas próximas com os mesmos chunks."""
+
+    __tablename__ = "answer_cache"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    question: Mapped[str] = mapped_column(Text)
+    embedding: Mapped[list[float]] = mapped_column(Vector(EMBEDDING_DIMENSIONS))
+    chunk_ids: Mapped[list[int]] = mapped_column(ARRAY(Integer), nullable=False)
+    answer: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow, index=True)
+
+    # GIN atende tanto a busca por igualdade quanto a invalidação por sobreposição (&&).
+    __table_args__ = (Index("answer_cache_chunk_ids_idx", "chunk_ids", postgresql_using="gin"),)
+
+
+class CrawlCache(Base):
+    """Validadores HTTP (ETag/Last-Modified) da última ingestão de cada URL, por geração."""
+
+    __tablename__ = "crawl_cache"
+
+    url: Mapped[str] = mapped_column(String, primary_key=True)
+    # Validadores de um rebuild ficam na geração sombra: descartada, ela não faz o crawl pular a versão ativa.
+    generation: Mapped[int] = mapped_column(Integer, primary_key=True, default=0, server_default="0")
+    domain: Mapped[str] = mapped_column(String, index=True)
+    etag: Mapped[str | None] = mapped_column(String, nullable=True)
+    last_modified: Mapped[str | None] = mapped_column(String, nullable=True)
+    links: Mapped[list] = mapped_column(JSON, default=list)
+    last_update: Mapped[dt.datetime] = mapped_column(
+        DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow
+    )
 
 
 def create_tables() -> None:
+    from db.vector_index import create_vector_index  # db.vector_index importa Chunk deste módulo
+
     engine = get_engine()
     with engine.connect() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         conn.commit()
     Base.metadata.create_all(engine)
+    _add_missing_columns(engine)
+    if RETRIEVAL_BACKEND == "local":
+        install_change_triggers(engine)
+    else:
+        drop_change_triggers(engine)
+    create_vector_index()
+
+
+def _add_missing_columns(engine) -> None:
+    """create_all não altera tabelas existentes; bancos anteriores ganham as colunas novas aqui."""
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "ALTER TABLE documents "
+                "ADD COLUMN IF NOT EXISTS simhash BIGINT, "
+                "ADD COLUMN IF NOT EXISTS canonical_id INTEGER REFERENCES documents(id) ON DELETE SET NULL, "
+                "ADD COLUMN IF NOT EXISTS generation INTEGER NOT NULL DEFAULT 0, "
+                "ADD COLUMN IF NOT EXISTS embedding_model VARCHAR, "
+                "ADD COLUMN IF NOT EXISTS chunk_sources BIGINT[]"
+            )
+        )
+        conn.execute(
+            text("CREATE INDEX IF NOT EXISTS documents_chunk_sources_idx ON documents USING gin (chunk_sources)")
+        )
+        # A URL passa a ser única por geração: o rebuild grava a geração nova ao lado da atual.
+        conn.execute(text("ALTER TABLE documents DROP CONSTRAINT IF EXISTS documents_url_key"))
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS documents_url_generation_key "
+                "ON documents (url, generation)"
+            )
+        )
+        conn.execute(text("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS simhash_bands BIGINT[]"))
+        conn.execute(
+            text("CREATE INDEX IF NOT EXISTS chunks_simhash_bands_idx ON chunks USING gin (simhash_bands)")
+        )
+        # Validadores passam a ser por geração; os existentes pertencem à geração ativa do domínio.
+        conn.execute(
+            text(
+                """
+                DO $$ BEGIN
+                    IF NOT EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'crawl_cache' AND column_name = 'generation'
+                    ) THEN
+                        ALTER TABLE crawl_cache ADD COLUMN generation INTEGER NOT NULL DEFAULT 0;
+                        UPDATE crawl_cache SET generation = g.generation
+                        FROM domain_generations g WHERE g.domain = crawl_cache.domain;
+                        ALTER TABLE crawl_cache DROP CONSTRAINT crawl_cache_pkey, ADD PRIMARY KEY (url, generation);
+                    END IF;
+                END $$
+                """
+            )
+        )
+        # Atende a remoção das respostas expiradas (api.answer_cache.purge_expired_answers).
+        conn.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_answer_cache_created_at ON answer_cache (created_at)")
+        )
+
+
+# Triggers por comando (tabelas de transição): um COPY de milhares de chunks gera um único INSERT no log.
+_CHANGE_TRIGGERS_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION log_chunk_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO chunk_changes (chunk_id) SELECT id FROM changed;
+        RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION log_document_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO chunk_changes (chunk_id)
+        SELECT c.id FROM chunks c
+        JOIN changed d ON d.id = c.document_id
+        JOIN previous p ON p.id = d.id
+        WHERE d.title IS DISTINCT FROM p.title OR d.url IS DISTINCT FROM p.url
+            OR d.generation IS DISTINCT FROM p.generation;
+        RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION log_generation_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO chunk_changes (chunk_id)
+        SELECT c.id FROM chunks c
+        JOIN documents d ON d.id = c.document_id
+        JOIN changed g ON g.domain = d.domain
+        JOIN previous p ON p.domain = g.domain
+        WHERE g.generation IS DISTINCT FROM p.generation AND d.generation IN (g.generation, p.generation);
+        RETURN NULL;
+    END $$
+    """,
+    "DROP TRIGGER IF EXISTS chunks_insert_log ON chunks",
+    "CREATE TRIGGER chunks_insert_log AFTER INSERT ON chunks REFERENCING NEW TABLE AS changed "
+    "FOR EACH STATEMENT EXECUTE FUNCTION log_chunk_changes()",
+    "DROP TRIGGER IF EXISTS chunks_update_log ON chunks",
+    "CREATE TRIGGER chunks_update_log AFTER UPDATE ON chunks REFERENCING NEW TABLE AS changed "
+    "FOR EACH STATEMENT EXECUTE FUNCTION log_chunk_changes()",
+    "DROP TRIGGER IF EXISTS chunks_delete_log ON chunks",
+    "CREATE TRIGGER chunks_delete_log AFTER DELETE ON chunks REFERENCING OLD TABLE AS changed "
+    "FOR EACH STATEMENT EXECUTE FUNCTION log_chunk_changes()",
+    "DROP TRIGGER IF EXISTS documents_update_log ON documents",
+    "CREATE TRIGGER documents_update_log AFTER UPDATE ON documents "
+    "REFERENCING OLD TABLE AS previous NEW TABLE AS changed "
+    "FOR EACH STATEMENT EXECUTE FUNCTION log_document_changes()",
+    "DROP TRIGGER IF EXISTS domain_generations_update_log ON domain_generations",
+    "CREATE TRIGGER domain_generations_update_log AFTER UPDATE ON domain_generations "
+    "REFERENCING OLD TABLE AS previous NEW TABLE AS changed "
+    "FOR EACH STATEMENT EXECUTE FUNCTION log_generation_changes()",
+]
+
+
+_CHANGE_TRIGGERS = {
+    "chunks_insert_log": "chunks",
+    "chunks_update_log": "chunks",
+    "chunks_delete_log": "chunks",
+    "documents_update_log": "documents",
+    "domain_generations_update_log": "domain_generations",
+}
+
+
+def install_change_triggers(engine=None) -> None:
+    """Triggers que alimentam chunk_changes (recriados a cada execução, na mesma transação)."""
+    with (engine or get_engine()).begin() as conn:
+        for statement in _CHANGE_TRIGGERS_DDL:
+            conn.execute(text(statement))
+
+
+def drop_change_triggers(engine=None) -> None:
+    """
+    Sem o índice local ninguém lê chunk_changes: remove os triggers e esvazia
+    o log, que cresceria a cada escrita de chunk e a cada flip de geração.
+    """
+    with (engine or get_engine()).begin() as conn:
+        for trigger, table in _CHANGE_TRIGGERS.items():
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table}"))
+        conn.execute(text("TRUNCATE chunk_changes"))
 
 
 if __name__ == "__main__":
@@ -1,46 +1,566 @@
 from __future__ import annotations
 
-from typing import Iterable
+import hashlib
+import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Mapping
 
-from sqlalchemy import delete, select
+from pgvector.utils import to_db
+from sqlalchemy import Select, cast, delete, func, insert as orm_insert, select, text, update
+from sqlalchemy.dialects.postgresql import BIT, insert
 from sqlalchemy.orm import Session
 
-from db.models import Chunk, Document
+from db.crawl_cache import CachedPage
+from db.models import AnswerCache, Chunk, CrawlCache, Document, DomainGeneration, EmbeddingCache
+from observability.metrics import CHUNK_ROWS, INSERT_CHUNK_ROWS_SECONDS, REPLACE_CHUNKS_SECONDS
 
+# "copy" usa COPY FROM STDIN do psycopg; "executemany" usa INSERTs em lote do SQLAlchemy.
+CHUNK_WRITE_MODE = os.getenv("CHUNK_WRITE_MODE", "copy")
+CHUNK_COPY_COLUMNS = ("document_id", "chunk_index", "chunk_text", "embedding", "metadata", "simhash_bands")
 
-def get_document_by_url(session: Session, url: str) -> Document | None:
-    return session.scalars(select(Document).where(Document.url == url)).first()
+
+def visible_documents():
+    """
+    Filtro dos documentos da geração ativa do seu domínio. Subconsulta
+    correlacionada: entra em buscas sobre chunks que fazem join com documents.
+    """
+    active = select(DomainGeneration.generation).where(DomainGeneration.domain == Document.domain).scalar_subquery()
+    return Document.generation == func.coalesce(active, 0)
+
+
+def _generation_filter(generation: int | None):
+    return visible_documents() if generation is None else Document.generation == generation
+
+
+def get_document_by_url(session: Session, url: str, generation: int | None = None) -> Document | None:
+    """Documento da URL na geração dada ou, sem ela, na geração ativa."""
+    return session.scalars(select(Document).where(Document.url == url, _generation_filter(generation))).first()
+
+
+def visible_urls(session: Session, domain: str, urls: Iterable[str]) -> list[str]:
+    """As URLs de `urls` que têm documento na geração ativa do domínio."""
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return []
+    return list(
+        session.scalars(
+            select(Document.url).where(Document.domain == domain, Document.url.in_(urls), visible_documents())
+        )
+    )
 
 
 def save_document(
-    session: Session, *, domain: str, url: str, title: str, content: str, content_hash: str
+    session: Session,
+    *,
+    domain: str,
+    url: str,
+    title: str,
+    content: str,
+    content_hash: str,
+    simhash: int | None = None,
+    canonical_id: int | None = None,
+    generation: int | None = None,
+    embedding_model: str | None = None,
+    chunk_sources: list[int] | None = None,
 ) -> Document:
-    document = get_document_by_url(session, url)
+    document = get_document_by_url(session, url, generation)
     if not document:
-        document = Document(domain=domain, url=url)
+        if generation is None:
+            generation = active_generation(session, domain)
+        document = Document(domain=domain, url=url, generation=generation)
         session.add(document)
     document.title = title
     document.content = content
     document.content_hash = content_hash
+    document.simhash = simhash
+    document.canonical_id = canonical_id
+    document.embedding_model = embedding_model
+    document.chunk_sources = chunk_sources or None
     return document
 
 
-def replace_chunks(session: Session, document: Document, chunks_data: Iterable[dict]) -> None:
-    session.query(Chunk).filter(Chunk.document_id == document.id).delete()
-    session.flush()
-    for chunk in chunks_data:
-        session.add(
-            Chunk(
-                document_id=document.id,
-                chunk_index=chunk["chunk_index"],
-                chunk_text=chunk["chunk_text"],
-                embedding=chunk["embedding"],
-                metadata_json=chunk["metadata"],
+def stale_embedding_models(session: Session, embedding_model: str) -> list[tuple[str, str]]:
+    """
+    (domínio, modelo) dos documentos visíveis embedados com outro modelo.
+    Documentos anteriores à coluna (embedding_model NULL) não entram.
+    """
+    return [
+        tuple(row)
+        for row in session.execute(
+            select(Document.domain, Document.embedding_model)
+            .where(
+                visible_documents(),
+                Document.embedding_model.is_not(None),
+                Document.embedding_model != embedding_model,
+            )
+            .distinct()
+            .order_by(Document.domain)
+        )
+    ]
+
+
+def embedding_column_dimensions(session: Session) -> int | None:
+    """Largura declarada de chunks.embedding no banco (o typmod do vector), ou None sem a tabela."""
+    typmod = session.scalar(
+        text(
+            "SELECT atttypmod FROM pg_attribute "
+            "WHERE attrelid = to_regclass('chunks') AND attname = 'embedding' AND NOT attisdropped"
+        )
+    )
+    return typmod if typmod is not None and typmod > 0 else None
+
+
+def find_canonical_document(
+    session: Session,
+    *,
+    domain: str,
+    url: str,
+    simhash: int,
+    max_distance: int,
+    generation: int | None = None,
+) -> Document | None:
+    """
+    Documento canônico do domínio a até `max_distance` bits de `simhash`
+    (valor com sinal, como gravado em documents.simhash). Requer PostgreSQL 14+ (bit_count).
+    """
+    distance = func.bit_count(cast(Document.simhash.op("#")(simhash), BIT(64)))
+    return session.scalars(
+        select(Document)
+        .where(
+            Document.domain == domain,
+            Document.url != url,
+            _generation_filter(generation),
+            Document.canonical_id.is_(None),
+            Document.simhash.is_not(None),
+            distance <= max_distance,
+        )
+        .order_by(distance, Document.id)
+        .limit(1)
+    ).first()
+
+
+def release_duplicates(session: Session, canonical_id: int) -> list[str]:
+    """
+    Desliga as quase-duplicatas de um documento canônico que mudou e devolve
+    as URLs delas para reingestão. Sem hash, SimHash e validadores HTTP, elas
+    não são puladas pelo próximo crawl nem escolhidas como canônicas enquanto
+    estão sem chunks.
+    """
+    urls = list(
+        session.scalars(
+            update(Document)
+            .where(Document.canonical_id == canonical_id)
+            .values(canonical_id=None, content_hash="", simhash=None)
+            .returning(Document.url)
+        )
+    )
+    if urls:
+        session.execute(delete(CrawlCache).where(CrawlCache.url.in_(urls)))
+    return urls
+
+
+def release_chunk_duplicates(session: Session, document: Document, fingerprints: Iterable[int]) -> list[str]:
+    """
+    Como `release_duplicates`, para páginas que descartaram chunks por serem
+    quase-duplicatas de chunks de `document` que acabaram de sair dele
+    (`fingerprints`: SimHash com sinal). Sem hash nem validadores, elas
+    voltam a ser processadas e recuperam o texto como chunk próprio.
+    """
+    fingerprints = sorted(set(fingerprints))
+    if not fingerprints:
+        return []
+    urls = list(
+        session.scalars(
+            update(Document)
+            .where(
+                Document.chunk_sources.overlap(fingerprints),
+                Document.domain == document.domain,
+                Document.generation == document.generation,
+                Document.id != document.id,
             )
+            .values(content_hash="", chunk_sources=None)
+            .returning(Document.url)
+        )
+    )
+    if urls:
+        session.execute(delete(CrawlCache).where(CrawlCache.url.in_(urls)))
+    return urls
+
+
+def similar_chunk_fingerprints(
+    session: Session,
+    *,
+    domain: str,
+    url: str,
+    band_keys: Iterable[int],
+    generation: int | None = None,
+) -> list[tuple[str, int]]:
+    """
+    (url do documento, simhash) dos chunks de outras páginas do domínio que
+    compartilham alguma banda com `band_keys`: candidatos a quase-duplicata,
+    achados pelo índice GIN sem varrer o domínio. A distância fica com quem chama.
+    """
+    band_keys = sorted(set(band_keys))
+    if not band_keys:
+        return []
+    rows = session.execute(
+        select(Document.url, Chunk.metadata_json["simhash"].as_string())
+        .join(Chunk, Chunk.document_id == Document.id)
+        .where(
+            Chunk.simhash_bands.overlap(band_keys),
+            Document.domain == domain,
+            Document.url != url,
+            _generation_filter(generation),
+        )
+    ).all()
+    # Texto e não inteiro: o fingerprint tem 64 bits e as_integer() converte para INTEGER.
+    return [(url, int(fingerprint)) for url, fingerprint in rows if fingerprint is not None]
+
+
+@dataclass
+class ChunkWriteStats:
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    # SimHash (metadata["simhash"]) de chunks que saíram do documento, para `release_chunk_duplicates`.
+    removed_simhashes: list[int] = field(default_factory=list)
+
+    @property
+    def rows_touched(self) -> int:
+        return self.inserted + self.updated + self.deleted
+
+
+@REPLACE_CHUNKS_SECONDS.time()
+def replace_chunks(
+    session: Session,
+    document: Document,
+    chunks_data: Iterable[dict],
+    pending_rows: list[dict] | None = None,
+    rewrite: bool = False,
+) -> ChunkWriteStats:
+    """
+    Aplica os novos chunks do documento como um diff sobre os atuais.
+
+    Chunks com o mesmo texto (sha256) são mantidos e só recebem UPDATE se o
+    índice ou os metadados mudaram; o resto vira INSERT/DELETE. Assim uma
+    edição pequena não reescreve a página inteira nem o índice vetorial.
+    Com `rewrite` (vetores de outro modelo), todos os chunks são regravados.
+
+    Com `pending_rows`, os INSERTs são acumulados na lista para um único
+    `insert_chunk_rows` no fim do lote de páginas.
+    """
+    session.flush()  # garante document.id para documentos novos
+    existing = session.execute(
+        select(Chunk.id, Chunk.chunk_index, Chunk.chunk_text, Chunk.metadata_json, Chunk.simhash_bands).where(
+            Chunk.document_id == document.id
+        )
+    ).all()
+    by_hash: dict[str, list] = defaultdict(list)
+    for row in existing:
+        by_hash[chunk_text_hash(row.chunk_text)].append(row)
+
+    chunks_data = list(chunks_data)
+    matches: list[tuple] = []
+    inserts: list[dict] = []
+    for chunk in chunks_data:
+        candidates = None if rewrite else by_hash.get(chunk_text_hash(chunk["chunk_text"]))
+        if not candidates:
+            inserts.append(chunk)
+            continue
+        row = next((r for r in candidates if r.chunk_index == chunk["chunk_index"]), candidates[0])
+        candidates.remove(row)
+        matches.append((row, chunk))
+
+    stale_ids = [row.id for rows in by_hash.values() for row in rows]
+    kept_simhashes = {chunk["metadata"].get("simhash") for chunk in chunks_data}
+    removed_simhashes = {
+        row.metadata_json.get("simhash") for rows in by_hash.values() for row in rows if row.metadata_json
+    } - kept_simhashes - {None}
+    if stale_ids:
+        session.execute(delete(Chunk).where(Chunk.id.in_(stale_ids)))
+
+    changed = [
+        (row, chunk)
+        for row, chunk in matches
+        if row.chunk_index != chunk["chunk_index"]
+        or row.metadata_json != chunk["metadata"]
+        or row.simhash_bands != chunk.get("simhash_bands")
+    ]
+    invalidate_answers(session, stale_ids + [row.id for row, _ in changed])
+    moved = [(row, chunk) for row, chunk in changed if row.chunk_index != chunk["chunk_index"]]
+    if moved:
+        # Índices temporários negativos evitam violar chunk_idx_unique quando chunks trocam de posição.
+        session.execute(
+            update(Chunk), [{"id": row.id, "chunk_index": -1 - chunk["chunk_index"]} for row, chunk in moved]
+        )
+    if changed:
+        session.execute(
+            update(Chunk),
+            [
+                {
+                    "id": row.id,
+                    "chunk_index": chunk["chunk_index"],
+                    "metadata_json": chunk["metadata"],
+                    "simhash_bands": chunk.get("simhash_bands"),
+                }
+                for row, chunk in changed
+            ],
+        )
+
+    rows = [{"document_id": document.id, **chunk} for chunk in inserts]
+    if pending_rows is not None:
+        pending_rows.extend(rows)
+    else:
+        insert_chunk_rows(session, rows)
+    stats = ChunkWriteStats(
+        inserted=len(inserts),
+        updated=len(changed),
+        deleted=len(stale_ids),
+        unchanged=len(matches) - len(changed),
+        removed_simhashes=sorted(removed_simhashes),
+    )
+    for operation in ("inserted", "updated", "deleted", "unchanged"):
+        CHUNK_ROWS.labels(operation).inc(getattr(stats, operation))
+    return stats
+
+
+@INSERT_CHUNK_ROWS_SECONDS.time()
+def insert_chunk_rows(session: Session, rows: Iterable[dict]) -> int:
+    """
+    Grava chunks em massa (document_id, chunk_index, chunk_text, embedding, metadata, simhash_bands).
+
+    Em PostgreSQL/psycopg usa COPY FROM STDIN; nos demais casos, ou com
+    CHUNK_WRITE_MODE=executemany, cai para INSERT em lote.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    connection = session.connection()
+    if CHUNK_WRITE_MODE == "copy" and connection.dialect.driver == "psycopg":
+        _copy_chunk_rows(connection.connection.driver_connection, rows)
+    else:
+        session.execute(
+            orm_insert(Chunk),
+            [
+                {
+                    "document_id": row["document_id"],
+                    "chunk_index": row["chunk_index"],
+                    "chunk_text": row["chunk_text"],
+                    "embedding": row["embedding"],
+                    "metadata_json": row["metadata"],
+                    "simhash_bands": row.get("simhash_bands"),
+                }
+                for row in rows
+            ],
+        )
+    return len(rows)
+
+
+def _copy_chunk_rows(dbapi_connection, rows: list[dict]) -> None:
+    # Mesma conexão/transação da Session: o COPY só vale após o commit do chamador.
+    statement = f"COPY {Chunk.__tablename__} ({', '.join(CHUNK_COPY_COLUMNS)}) FROM STDIN"
+    with dbapi_connection.cursor() as cursor:
+        with cursor.copy(statement) as copy:
+            for row in rows:
+                copy.write_row(
+                    (
+                        row["document_id"],
+                        row["chunk_index"],
+                        row["chunk_text"],
+                        to_db(row["embedding"]),
+                        json.dumps(row["metadata"], ensure_ascii=False),
+                        row.get("simhash_bands"),
+                    )
+                )
+
+
+def chunk_text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_cached_embeddings(session: Session, keys: Iterable[str]) -> dict[str, list[float]]:
+    keys = list(keys)
+    if not keys:
+        return {}
+    stmt = select(EmbeddingCache.key, EmbeddingCache.embedding).where(EmbeddingCache.key.in_(keys))
+    return {key: embedding for key, embedding in session.execute(stmt)}
+
+
+def store_embeddings(session: Session, embeddings: Mapping[str, list[float]], model: str) -> None:
+    if not embeddings:
+        return
+    stmt = insert(EmbeddingCache).on_conflict_do_nothing(index_elements=[EmbeddingCache.key])
+    session.execute(
+        stmt,
+        [{"key": key, "model": model, "embedding": embedding} for key, embedding in embeddings.items()],
+    )
+
+
+def save_crawl_cache(
+    session: Session,
+    *,
+    domain: str,
+    url: str,
+    etag: str | None,
+    last_modified: str | None,
+    links: Iterable[str],
+    generation: int | None = None,
+) -> None:
+    """Validadores da URL na geração dada ou, sem ela, na geração ativa do domínio."""
+    if generation is None:
+        generation = active_generation(session, domain)
+    entry = session.get(CrawlCache, (url, generation))
+    if not entry:
+        entry = CrawlCache(url=url, generation=generation)
+        session.add(entry)
+    entry.domain = domain
+    entry.etag = etag
+    entry.last_modified = last_modified
+    entry.links = sorted(links)
+
+
+def crawl_cache_lookup(
+    session: Session, domain: str | None = None, embedding_model: str | None = None
+) -> Callable[[str], CachedPage | None]:
+    """
+    Função de consulta para `Crawler(cache_lookup=...)` baseada na tabela crawl_cache.
+
+    Com `domain`, os validadores do domínio são carregados numa única consulta
+    e a busca por URL não toca mais o banco. Com `embedding_model`, URLs cujo
+    documento ativo foi embedado com outro modelo (ou sem modelo registrado)
+    ficam sem validadores: o GET não é condicional e a página é re-embedada.
+    Só valem os validadores da geração ativa, nunca os de um rebuild em curso.
+    """
+    stale = None
+    if embedding_model is not None:
+        stale = select(Document.url).where(
+            visible_documents(), Document.embedding_model.is_distinct_from(embedding_model)
         )
+    if domain is not None:
+        query = select(CrawlCache).where(CrawlCache.domain == domain, _visible_crawl_cache())
+        if stale is not None:
+            query = query.where(CrawlCache.url.not_in(stale.where(Document.domain == domain)))
+        preloaded = {entry.url: _cached_page(entry) for entry in session.scalars(query)}
+        return preloaded.get
+
+    def lookup(url: str) -> CachedPage | None:
+        entry = session.scalars(select(CrawlCache).where(CrawlCache.url == url, _visible_crawl_cache())).first()
+        if entry is None:
+            return None
+        if stale is not None and session.scalar(select(stale.where(Document.url == url).exists())):
+            return None
+        return _cached_page(entry)
+
+    return lookup
+
+
+def _visible_crawl_cache():
+    """Como `visible_documents`, para os validadores em crawl_cache."""
+    active = select(DomainGeneration.generation).where(DomainGeneration.domain == CrawlCache.domain).scalar_subquery()
+    return CrawlCache.generation == func.coalesce(active, 0)
+
+
+def _cached_page(entry: CrawlCache) -> CachedPage:
+    return CachedPage(etag=entry.etag, last_modified=entry.last_modified, links=list(entry.links or []))
+
+
+def invalidate_answers(session: Session, chunk_ids: Iterable[int] | Select) -> int:
+    """
+    Remove respostas em cache que citam algum dos chunks alterados/removidos.
+    `chunk_ids` pode ser um SELECT de ids, resolvido no próprio banco
+    (ARRAY(subconsulta)) sem trazer os ids para o Python.
+    """
+    if isinstance(chunk_ids, Select):
+        chunk_ids = func.array(chunk_ids.scalar_subquery())
+    else:
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return 0
+    result = session.execute(delete(AnswerCache).where(AnswerCache.chunk_ids.overlap(chunk_ids)))
+    return result.rowcount or 0
 
 
 def delete_domain(session: Session, domain: str) -> int:
+    invalidate_answers(session, select(Chunk.id).join(Document).where(Document.domain == domain))
+    session.execute(delete(CrawlCache).where(CrawlCache.domain == domain))
+    session.execute(delete(DomainGeneration).where(DomainGeneration.domain == domain))
     stmt = delete(Document).where(Document.domain == domain)
     result = session.execute(stmt)
     return result.rowcount or 0
+
+
+def active_generation(session: Session, domain: str) -> int:
+    state = session.get(DomainGeneration, domain)
+    return state.generation if state else 0
+
+
+def begin_generation(session: Session, domain: str) -> int:
+    """
+    Reserva a próxima geração do domínio para um rebuild. Os documentos dela
+    ficam invisíveis para o /ask até `activate_generation`.
+    """
+    state = session.get(DomainGeneration, domain, with_for_update=True)
+    if state is None:
+        state = DomainGeneration(domain=domain, generation=0)
+        session.add(state)
+    latest = session.scalar(select(func.max(Document.generation)).where(Document.domain == domain))
+    # Acima de qualquer geração já gravada, inclusive sobras de rebuilds interrompidos.
+    state.building = max(latest or 0, state.generation, state.building or 0) + 1
+    return state.building
+
+
+def activate_generation(session: Session, domain: str, generation: int) -> None:
+    """Flip atômico: uma única linha passa a apontar para a geração nova (commit do chamador)."""
+    state = session.get(DomainGeneration, domain, with_for_update=True)
+    state.generation = generation
+    if state.building == generation:
+        state.building = None
+
+
+def abandon_generation(session: Session, domain: str, generation: int) -> None:
+    """Desiste de uma geração em construção; `purge_inactive_generations` apaga as linhas dela."""
+    state = session.get(DomainGeneration, domain, with_for_update=True)
+    if state is not None and state.building == generation:
+        state.building = None
+
+
+def purge_inactive_generations(session: Session, domain: str, batch_size: int = 500) -> int:
+    """
+    Apaga, em lotes com commit próprio, os documentos (e chunks, via cascade)
+    de gerações que não são a ativa nem a em construção. Lotes curtos evitam
+    uma transação longa disputando o banco com o /ask.
+    """
+    removed = 0
+    while True:
+        state = session.get(DomainGeneration, domain)
+        keep = [state.generation, state.building] if state else [0]
+        ids = session.scalars(
+            select(Document.id)
+            .where(Document.domain == domain, Document.generation.not_in([g for g in keep if g is not None]))
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        invalidate_answers(session, select(Chunk.id).where(Chunk.document_id.in_(ids)))
+        removed += session.execute(delete(Document).where(Document.id.in_(ids))).rowcount or 0
+        session.commit()
+
+    # Validadores de gerações descartadas ou substituídas saem junto com os documentos delas.
+    session.execute(
+        delete(CrawlCache).where(
+            CrawlCache.domain == domain, CrawlCache.generation.not_in([g for g in keep if g is not None])
+        )
+    )
+    # Validadores de URLs que sumiram no rebuild fariam o crawl incremental pular a página (304).
+    session.execute(
+        delete(CrawlCache).where(
+            CrawlCache.domain == domain,
+            _visible_crawl_cache(),
+            ~select(Document.id).where(Document.url == CrawlCache.url, visible_documents()).exists(),
+        )
+    )
+    session.commit()
+    return removed
@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import re
+from dataclasses import dataclass
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Select, cast, func, literal, literal_column, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.types import UserDefinedType
+
+from db.connection import get_engine
+from db.models import Chunk, Document
+from db.queries import visible_documents
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "chunks_embedding_idx"
+# Nome do índice novo durante um rebuild, antes de assumir INDEX_NAME.
+BUILD_INDEX_NAME = "chunks_embedding_idx_build"
+INDEX_METHODS = ("hnsw", "ivfflat")
+QUANTIZATIONS = ("none", "halfvec", "binary")
+DIMENSIONS = Chunk.embedding.type.dim
+
+VECTOR_INDEX_METHOD = os.getenv("VECTOR_INDEX_METHOD", "hnsw")
+# Valores padrão de busca por requisição; vazio mantém o padrão do servidor.
+VECTOR_EF_SEARCH = os.getenv("VECTOR_EF_SEARCH")
+VECTOR_PROBES = os.getenv("VECTOR_PROBES")
+# pgvector 0.8+: "relaxed_order"/"strict_order" continuam a varredura HNSW quando o filtro de
+# geração descarta candidatos (rebuild em andamento); vazio mantém o padrão do servidor.
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "")
+# Índice sobre uma expressão compacta de embedding; a tabela mantém o vetor completo para o re-rank.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# Matryoshka: indexa só as primeiras N dimensões (0 = largura total).
+VECTOR_PREFIX_DIMENSIONS = int(os.getenv("VECTOR_PREFIX_DIMENSIONS", "0"))
+# Tamanho da pré-seleção = top_k * fator, re-ranqueada com o vetor float32.
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+# Padrão e teto de hnsw.ef_search no pgvector: o HNSW devolve no máximo ef_search candidatos.
+HNSW_DEFAULT_EF_SEARCH = 40
+HNSW_MAX_EF_SEARCH = 1000
+
+
+class _PgType(UserDefinedType):
+    """Tipo SQL só para CAST (halfvec/bit ainda não existem no pgvector-python 0.2)."""
+
+    cache_ok = True
+
+    def __init__(self, spec: str) -> None:
+        self.spec = spec
+
+    def get_col_spec(self, **kw) -> str:
+        return self.spec
+
+
+def _prefix_width(prefix_dimensions: int) -> int:
+    if prefix_dimensions < 0 or prefix_dimensions > DIMENSIONS:
+        raise ValueError(f"Dimensões de prefixo fora de 1..{DIMENSIONS}: {prefix_dimensions}")
+    return prefix_dimensions or DIMENSIONS
+
+
+def indexed_expression(quantization: str, prefix_dimensions: int = 0) -> tuple[str, str]:
+    """
+    (expressão, operator class) do índice. O prefixo não é renormalizado: a
+    distância de cosseno e o sinal usado por binary_quantize não dependem da norma.
+    """
+    width = _prefix_width(prefix_dimensions)
+    source = f"subvector(embedding, 1, {width})" if width != DIMENSIONS else "embedding"
+    if quantization == "none":
+        if source == "embedding":
+            return "embedding", "vector_cosine_ops"
+        return f"({source}::vector({width}))", "vector_cosine_ops"
+    if quantization == "halfvec":
+        return f"({source}::halfvec({width}))", "halfvec_cosine_ops"
+    if quantization == "binary":
+        return f"(binary_quantize({source})::bit({width}))", "bit_hamming_ops"
+    raise ValueError(f"Quantização desconhecida: {quantization}")
+
+
+@dataclass
+class VectorIndexConfig:
+    method: str = VECTOR_INDEX_METHOD
+    m: int = int(os.getenv("HNSW_M", "16"))
+    ef_construction: int = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+    lists: int = int(os.getenv("IVFFLAT_LISTS", "100"))
+    quantization: str = VECTOR_QUANTIZATION
+    prefix_dimensions: int = VECTOR_PREFIX_DIMENSIONS
+
+    def ddl(self, concurrently: bool = False, name: str = INDEX_NAME) -> str:
+        if self.method == "hnsw":
+            options = f"m = {int(self.m)}, ef_construction = {int(self.ef_construction)}"
+        elif self.method == "ivfflat":
+            options = f"lists = {int(self.lists)}"
+        else:
+            raise ValueError(f"Método de índice desconhecido: {self.method}")
+        expression, opclass = indexed_expression(self.quantization, self.prefix_dimensions)
+        keyword = "CONCURRENTLY " if concurrently else ""
+        return (
+            f"CREATE INDEX {keyword}{name} ON chunks "
+            f"USING {self.method} ({expression} {opclass}) WITH ({options})"
+        )
+
+    def matches(self, indexdef: str) -> bool:
+        """
+        Compara com `pg_get_indexdef` do índice existente. O Postgres reescreve
+        a definição (schema, parênteses, aspas nas opções e omite a operator
+        class padrão do tipo), então a comparação ignora essas diferenças.
+        """
+        _expression, opclass = indexed_expression(self.quantization, self.prefix_dimensions)
+        expected = self.ddl()
+        current = _normalize_ddl(indexdef)
+        return current in (_normalize_ddl(expected), _normalize_ddl(expected.replace(f" {opclass})", ")")))
+
+
+def create_vector_index(
+    config: VectorIndexConfig | None = None,
+    *,
+    concurrently: bool = False,
+    maintenance_work_mem: str | None = None,
+) -> None:
+    """
+    Cria o índice ANN de chunks.embedding. Se já existe com a mesma definição,
+    não faz nada; se a definição mudou (método, parâmetros, VECTOR_QUANTIZATION,
+    VECTOR_PREFIX_DIMENSIONS) ou um build CONCURRENTLY anterior o deixou
+    inválido, reconstrói: um índice antigo com outra expressão não serviria à
+    `first_stage_distance` e o /ask cairia em varredura sequencial.
+    """
+    config = config or VectorIndexConfig()
+    state = _index_state(INDEX_NAME)
+    if state is None:
+        _build_index(config, INDEX_NAME, concurrently=concurrently, maintenance_work_mem=maintenance_work_mem)
+        return
+    indexdef, valid = state
+    if valid and config.matches(indexdef):
+        return
+    logger.warning(
+        "Índice %s %s; reconstruindo com: %s",
+        INDEX_NAME,
+        "diverge da configuração" if valid else "está inválido",
+        config.ddl(),
+    )
+    rebuild_vector_index(config, concurrently=concurrently, maintenance_work_mem=maintenance_work_mem)
+
+
+def drop_vector_index(*, concurrently: bool = False) -> None:
+    keyword = "CONCURRENTLY " if concurrently else ""
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX {keyword}IF EXISTS {INDEX_NAME}"))
+
+
+def rebuild_vector_index(
+    config: VectorIndexConfig | None = None,
+    *,
+    concurrently: bool = False,
+    maintenance_work_mem: str | None = None,
+) -> None:
+    """
+    Recria o índice com novos parâmetros (IVFFlat precisa disso após grandes cargas).
+
+    O índice novo é construído com outro nome enquanto o atual segue atendendo
+    as buscas; só então, numa única transação, o antigo é removido e o novo
+    assume INDEX_NAME. Exige espaço em disco para os dois durante o build.
+    """
+    config = config or VectorIndexConfig()
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Sobra de um rebuild interrompido (um build CONCURRENTLY falho deixa o índice inválido).
+        conn.execute(text(f"DROP INDEX IF EXISTS {BUILD_INDEX_NAME}"))
+    _build_index(config, BUILD_INDEX_NAME, concurrently=concurrently, maintenance_work_mem=maintenance_work_mem)
+    with get_engine().begin() as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+        conn.execute(text(f"ALTER INDEX {BUILD_INDEX_NAME} RENAME TO {INDEX_NAME}"))
+
+
+def _build_index(
+    config: VectorIndexConfig, name: str, *, concurrently: bool, maintenance_work_mem: str | None
+) -> None:
+    # CREATE INDEX CONCURRENTLY não roda dentro de transação.
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if maintenance_work_mem:
+            conn.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"), {"value": maintenance_work_mem})
+        conn.execute(text(config.ddl(concurrently=concurrently, name=name)))
+
+
+def _index_state(name: str) -> tuple[str, bool] | None:
+    """(definição, válido) do índice `name`, ou None se não existe."""
+    with get_engine().connect() as conn:
+        row = conn.execute(
+            text(
+                "SELECT pg_get_indexdef(i.indexrelid), i.indisvalid FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ),
+            {"name": name},
+        ).first()
+    return (row[0], row[1]) if row else None
+
+
+def _normalize_ddl(ddl: str) -> str:
+    return re.sub(r"[\s()'\"]", "", ddl.lower()).replace("public.", "")
+
+
+def describe_vector_index() -> str | None:
+    with get_engine().connect() as conn:
+        return conn.execute(
+            text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"), {"name": INDEX_NAME}
+        ).scalar()
+
+
+def apply_search_settings(
+    session: Session,
+    *,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    limit: int | None = None,
+) -> None:
+    """
+    Ajusta recall/latência da busca ANN só para a transação atual (SET LOCAL).
+
+    `ef_search` vale para HNSW e `probes` para IVFFlat; sem valor, usa
+    VECTOR_EF_SEARCH / VECTOR_PROBES e, na falta deles, o padrão do servidor.
+    `limit` é o LIMIT da busca no índice (ver `first_stage_limit`): o HNSW não
+    devolve mais que ef_search candidatos, então ef_search sobe até ele.
+    """
+    ef = int(ef_search or VECTOR_EF_SEARCH or 0)
+    if limit and limit > (ef or HNSW_DEFAULT_EF_SEARCH):
+        ef = min(limit, HNSW_MAX_EF_SEARCH)
+    settings = {
+        "hnsw.ef_search": ef,
+        "ivfflat.probes": probes or VECTOR_PROBES,
+    }
+    for name, value in settings.items():
+        if value:
+            session.execute(
+                text("SELECT set_config(:name, :value, true)"), {"name": name, "value": str(int(value))}
+            )
+    if VECTOR_ITERATIVE_SCAN:
+        session.execute(
+            text("SELECT set_config('hnsw.iterative_scan', :value, true)"), {"value": VECTOR_ITERATIVE_SCAN}
+        )
+
+
+def first_stage_distance(
+    query_embedding: list[float],
+    quantization: str = VECTOR_QUANTIZATION,
+    prefix_dimensions: int = VECTOR_PREFIX_DIMENSIONS,
+):
+    """Distância na mesma expressão do índice (ver `indexed_expression`), para o planner usá-lo."""
+    width = _prefix_width(prefix_dimensions)
+    if quantization == "none" and width == DIMENSIONS:
+        return Chunk.embedding.cosine_distance(query_embedding)
+
+    column = Chunk.embedding
+    if width != DIMENSIONS:
+        # Constantes literais: com bind params a expressão não casa com a do índice.
+        column = func.subvector(column, literal_column("1"), literal_column(str(width)))
+    query = cast(literal(list(query_embedding[:width]), type_=Vector(width)), Vector(width))
+    if quantization == "none":
+        return cast(column, Vector(width)).op("<=>")(query)
+    if quantization == "halfvec":
+        halfvec = _PgType(f"halfvec({width})")
+        return cast(column, halfvec).op("<=>")(cast(query, halfvec))
+    if quantization == "binary":
+        bit = _PgType(f"bit({width})")
+        return cast(func.binary_quantize(column), bit).op("<~>")(cast(func.binary_quantize(query), bit))
+    raise ValueError(f"Quantização desconhecida: {quantization}")
+
+
+def first_stage_limit(
+    top_k: int,
+    quantization: str = VECTOR_QUANTIZATION,
+    prefix_dimensions: int = VECTOR_PREFIX_DIMENSIONS,
+    rerank_factor: int = VECTOR_RERANK_FACTOR,
+) -> int:
+    """Candidatos que `nearest_chunk_ids` pede ao índice: `top_k`, ou a pré-seleção do re-rank."""
+    if quantization == "none" and _prefix_width(prefix_dimensions) == DIMENSIONS:
+        return top_k
+    return top_k * max(rerank_factor, 1)
+
+
+def nearest_chunk_ids(
+    query_embedding: list[float],
+    top_k: int,
+    *,
+    quantization: str = VECTOR_QUANTIZATION,
+    prefix_dimensions: int = VECTOR_PREFIX_DIMENSIONS,
+    rerank_factor: int = VECTOR_RERANK_FACTOR,
+) -> Select:
+    """
+    Ids dos `top_k` chunks mais próximos. Com quantização ou prefixo, a busca
+    ANN roda no índice compacto sobre `top_k * rerank_factor` candidatos,
+    re-ranqueados pela distância de cosseno do vetor completo.
+
+    Só entram chunks da geração ativa de cada domínio: a geração sombra de um
+    rebuild em andamento e a antiga à espera de limpeza ficam de fora.
+    """
+    first_stage = first_stage_distance(query_embedding, quantization, prefix_dimensions)
+    if quantization == "none" and _prefix_width(prefix_dimensions) == DIMENSIONS:
+        return _visible_chunks(Chunk.id).order_by(first_stage).limit(top_k)
+    shortlist = (
+        _visible_chunks(Chunk.id, Chunk.embedding)
+        .order_by(first_stage)
+        .limit(first_stage_limit(top_k, quantization, prefix_dimensions, rerank_factor))
+        .subquery("shortlist")
+    )
+    return (
+        select(shortlist.c.id)
+        .order_by(shortlist.c.embedding.cosine_distance(query_embedding))
+        .limit(top_k)
+    )
+
+
+def _visible_chunks(*columns) -> Select:
+    return select(*columns).join(Document, Document.id == Chunk.document_id).where(visible_documents())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gerencia o índice ANN (pgvector) de chunks.embedding.")
+    parser.add_argument("action", choices=("create", "rebuild", "drop", "show"))
+    parser.add_argument("--method", choices=INDEX_METHODS, default=VECTOR_INDEX_METHOD)
+    parser.add_argument("--m", type=int, default=VectorIndexConfig.m, help="HNSW: vizinhos por nó.")
+    parser.add_argument(
+        "--ef-construction", type=int, default=VectorIndexConfig.ef_construction, dest="ef_construction"
+    )
+    parser.add_argument("--lists", type=int, default=VectorIndexConfig.lists, help="IVFFlat: número de listas.")
+    parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATIONS,
+        default=VECTOR_QUANTIZATION,
+        help="Indexa embedding::halfvec ou binary_quantize(embedding) (pgvector >= 0.7).",
+    )
+    parser.add_argument(
+        "--prefix-dimensions",
+        type=int,
+        default=VECTOR_PREFIX_DIMENSIONS,
+        dest="prefix_dimensions",
+        help="Indexa só subvector(embedding, 1, N); 0 usa todas as dimensões.",
+    )
+    parser.add_argument("--concurrently", action="store_true", help="Não bloqueia escritas durante o build.")
+    parser.add_argument("--maintenance-work-mem", dest="maintenance_work_mem", help="Ex.: 2GB")
+    args = parser.parse_args()
+
+    config = VectorIndexConfig(
+        method=args.method,
+        m=args.m,
+        ef_construction=args.ef_construction,
+        lists=args.lists,
+        quantization=args.quantization,
+        prefix_dimensions=args.prefix_dimensions,
+    )
+    if args.action == "create":
+        create_vector_index(config, concurrently=args.concurrently, maintenance_work_mem=args.maintenance_work_mem)
+    elif args.action == "rebuild":
+        rebuild_vector_index(config, concurrently=args.concurrently, maintenance_work_mem=args.maintenance_work_mem)
+    elif args.action == "drop":
+        drop_vector_index(concurrently=args.concurrently)
+    print(describe_vector_index() or "Nenhum índice vetorial em chunks.embedding")
+
+
+if __name__ == "__main__":
+    main()
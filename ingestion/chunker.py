@@ -1,17 +1,17 @@
 from __future__ import annotations
 
+import os
 from dataclasses import dataclass
-from typing import Iterable, List
+from typing import List, Sequence
 
-from bs4 import BeautifulSoup, Tag
-from markdownify import markdownify as html_to_md
 from ftfy import fix_text
 
-from crawler.clean_html import extract_main
-from ingestion.embeddings import count_tokens
-from crawler.extract import PageContent
+from ingestion.embeddings import count_tokens, max_input_tokens, try_count_tokens
+from crawler.extract import PageContent, ensure_document
+from observability.metrics import CHUNK_SECONDS
 
-HEADING_TAGS = ("h1", "h2", "h3", "h4")
+# Tokens repetidos entre chunks vizinhos de uma mesma seção (linhas inteiras).
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
 
 
 @dataclass
@@ -21,12 +21,19 @@ class Chunk:
     metadata: dict
 
 
-def chunk_page(page: PageContent, max_tokens: int = 1000) -> List[Chunk]:
+@CHUNK_SECONDS.time()
+def chunk_page(
+    page: PageContent, max_tokens: int | None = None, overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> List[Chunk]:
     """
     Cria chunks baseados em headings preservando contexto hierárquico.
+
+    Sem `max_tokens`, usa 1000 ou o limite de entrada do modelo de embeddings,
+    o que for menor (um modelo local costuma truncar em 512).
     """
-    main = extract_main(page.raw_html)
-    sections = list(_split_sections(main, page))
+    if max_tokens is None:
+        max_tokens = min(1000, max_input_tokens())
+    sections = ensure_document(page).sections
 
     chunks: List[Chunk] = []
     for idx, section in enumerate(sections):
@@ -45,7 +52,12 @@ def chunk_page(page: PageContent, max_tokens: int = 1000) -> List[Chunk]:
             )
         else:
             chunks.extend(
-                _split_large_chunk(section, max_tokens=max_tokens, base_index=len(chunks))
+                _split_large_chunk(
+                    section,
+                    max_tokens=max_tokens,
+                    base_index=len(chunks),
+                    overlap_tokens=overlap_tokens,
+                )
             )
     return chunks
 
@@ -61,84 +73,160 @@ def _base_metadata(section: dict, chunk_index: int) -> dict:
     }
 
 
-def _split_sections(root: Tag, page: PageContent) -> Iterable[dict]:
-    hierarchy: list[str] = []
-    current = {
-        "title": page.title,
-        "depth": 1,
-        "parts": [],
-        "breadcrumbs": [],
-        "url": page.url,
-        "domain": page.url.split("://", 1)[-1].split("/", 1)[0],
-    }
-
-    for node in root.children:
-        if isinstance(node, Tag) and node.name in HEADING_TAGS:
-            if current["parts"]:
-                yield {
-                    "title": current["title"],
-                    "text": "\n\n".join(current["parts"]),
-                    "depth": current["depth"],
-                    "breadcrumbs": list(current["breadcrumbs"]),
-                    "url": current["url"],
-                    "domain": current["domain"],
-                }
-                current["parts"] = []
-            text = fix_text(node.get_text(strip=True))
-            depth = int(node.name[1])
-            hierarchy = hierarchy[: depth - 1]
-            hierarchy.append(text)
-            current.update(
-                {
-                    "title": text or page.title,
-                    "depth": depth,
-                    "breadcrumbs": list(hierarchy),
-                    "url": page.url,
-                    "domain": page.url.split("://", 1)[-1].split("/", 1)[0],
-                }
-            )
-        else:
-            markdown = html_to_md(str(node), strip=[])
-            current["parts"].append(fix_text(markdown))
-
-    if current["parts"]:
-        yield {
-            "title": current["title"],
-            "text": "\n\n".join(current["parts"]),
-            "depth": current["depth"],
-            "breadcrumbs": list(current["breadcrumbs"]),
-            "url": current["url"],
-            "domain": current["domain"],
-        }
-
-
-def _split_large_chunk(section: dict, max_tokens: int, base_index: int) -> List[Chunk]:
-    text = section["text"]
-    sentences = text.split("\n")
-    buffer: list[str] = []
+def _split_large_chunk(
+    section: dict, max_tokens: int, base_index: int, overlap_tokens: int = 0
+) -> List[Chunk]:
+    """
+    Divide uma seção grande em chunks de até `max_tokens`, quebrando entre linhas.
+
+    Cada linha é codificada um número constante de vezes e o total do buffer é
+    mantido de forma incremental (ver `_TokenBuffer`), então o custo é linear no
+    tamanho da seção.
+    Com `overlap_tokens`, cada chunk recomeça com as últimas linhas do anterior
+    que cabem nesse orçamento. Linhas que sozinhas passam de `max_tokens` são
+    quebradas entre palavras.
+    """
+    buffer = _TokenBuffer()
     chunks: List[Chunk] = []
 
-    def flush():
-        if not buffer:
-            return
-        chunk_text = "\n".join(buffer).strip()
-        if not chunk_text:
-            buffer.clear()
-            return
-        chunks.append(
-            Chunk(
-                index=base_index + len(chunks),
-                text=chunk_text,
-                metadata=_base_metadata(section, base_index + len(chunks)),
+    def flush() -> None:
+        chunk_text = "\n".join(buffer.lines).strip()
+        if chunk_text:
+            chunks.append(
+                Chunk(
+                    index=base_index + len(chunks),
+                    text=chunk_text,
+                    metadata=_base_metadata(section, base_index + len(chunks)),
+                )
             )
-        )
-        buffer.clear()
 
-    for sentence in sentences:
-        candidate = buffer + [sentence]
-        if count_tokens("\n".join(candidate)) > max_tokens:
+    for line in section["text"].split("\n"):
+        if buffer.lines and buffer.count_with(line) > max_tokens:
             flush()
-        buffer.append(sentence)
+            buffer = _TokenBuffer(_overlap_tail(buffer.lines, overlap_tokens))
+            if buffer.lines and buffer.count_with(line) > max_tokens:
+                buffer = _TokenBuffer()
+        if not buffer.lines and count_tokens(line) > max_tokens:
+            *pieces, line = _split_long_line(line, max_tokens)
+            for piece in pieces:
+                buffer.append(piece)
+                flush()
+                buffer = _TokenBuffer()
+        buffer.append(line)
 
     flush()
     return chunks
+
+
+class _TokenBuffer:
+    """
+    Linhas de um chunk em construção e a contagem de tokens de "\\n".join(linhas).
+
+    O pré-tokenizador do tiktoken sempre corta logo após a quebra de linha que
+    antecede uma linha com conteúdo; só linhas em branco se fundem com a anterior
+    (ex.: "\\n\\n" vira um token). Por isso o buffer é mantido em grupos, uma
+    linha com conteúdo mais as linhas em branco seguintes, e
+    tokens(join) = soma de tokens(grupo + "\\n") dos grupos fechados + tokens(último grupo),
+    igual a codificar o buffer inteiro.
+    """
+
+    def __init__(self, lines: Sequence[str] = ()) -> None:
+        self.lines: list[str] = []
+        self._closed_tokens = 0
+        self._closed_words = 0
+        self._closed_fallback = False
+        self._group: list[str] = []
+        self._closing: tuple[int, int | None] | None = None
+        for line in lines:
+            self.append(line)
+
+    def count_with(self, line: str) -> int:
+        """Tokens de "\\n".join(self.lines + [line]), sem recodificar o buffer."""
+        if self._group and not line.strip():
+            tokens, words, fallback = self._measure(self._group + [line])
+            return self._total(tokens, words, fallback)
+        if not self._group:
+            tokens, words, fallback = self._measure([line])
+            return self._total(tokens, words, fallback)
+        closing = self._closing_tokens()
+        line_tokens = try_count_tokens(line)
+        words = len(" ".join(self._group).split()) + len(line.split())
+        fallback = closing is None or line_tokens is None
+        return self._total((closing or 0) + (line_tokens or 0), words, fallback)
+
+    def append(self, line: str) -> None:
+        if self._group and line.strip():
+            closing = self._closing_tokens()
+            self._closed_tokens += closing or 0
+            self._closed_words += len(" ".join(self._group).split())
+            self._closed_fallback |= closing is None
+            self._group = []
+            self._closing = None
+        self._group.append(line)
+        self.lines.append(line)
+
+    def _closing_tokens(self) -> int | None:
+        """Tokens do último grupo seguido de "\\n" (memorizado até o grupo mudar)."""
+        if self._closing is None or self._closing[0] != len(self._group):
+            self._closing = (len(self._group), try_count_tokens("\n".join(self._group) + "\n"))
+        return self._closing[1]
+
+    def _measure(self, group: list[str]) -> tuple[int, int, bool]:
+        tokens = try_count_tokens("\n".join(group))
+        return tokens or 0, len(" ".join(group).split()), tokens is None
+
+    def _total(self, tokens: int, words: int, fallback: bool) -> int:
+        # Mesmo fallback de count_tokens: se alguma parte não codifica, o texto todo também não.
+        if fallback or self._closed_fallback:
+            return max(1, self._closed_words + words)
+        return self._closed_tokens + tokens
+
+
+def _overlap_tail(lines: Sequence[str], overlap_tokens: int) -> list[str]:
+    """Últimas linhas de `lines` cujo total cabe em `overlap_tokens`."""
+    tail: list[str] = []
+    used = 0
+    for line in reversed(lines):
+        used += count_tokens(line)
+        if used > overlap_tokens:
+            break
+        tail.append(line)
+    tail.reverse()
+    while tail and not tail[0].strip():
+        tail.pop(0)
+    return tail
+
+
+def _split_long_line(line: str, max_tokens: int) -> list[str]:
+    """Quebra entre palavras uma linha que sozinha excede `max_tokens`."""
+    pieces: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+    for word in line.split(" "):
+        word_tokens = count_tokens(" " + word)
+        if word_tokens > max_tokens:
+            if current:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            pieces.extend(_split_long_word(word, max_tokens))
+            continue
+        if current and current_tokens + word_tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(word)
+        current_tokens += word_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces or [line]
+
+
+def _split_long_word(word: str, max_tokens: int) -> list[str]:
+    """Último recurso (URLs, base64, minificados): corta por caracteres."""
+    pieces = []
+    while word:
+        size = max(1, len(word) * max_tokens // max(count_tokens(word), 1))
+        while size > 1 and count_tokens(word[:size]) > max_tokens:
+            size = size * 3 // 4
+        pieces.append(word[:size])
+        word = word[size:]
+    return pieces
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from collections import defaultdict
+from typing import Generic, Hashable, TypeVar
+
+import numpy as np
+
+# Distância de Hamming máxima (em 64 bits) para considerar duas páginas/chunks quase idênticos; 0 desativa.
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))
+DEDUP_CHUNK_MAX_DISTANCE = int(os.getenv("DEDUP_CHUNK_MAX_DISTANCE", "3"))
+# Textos curtos geram fingerprints pouco confiáveis (menus, avisos) e ficam de fora.
+DEDUP_MIN_WORDS = int(os.getenv("DEDUP_MIN_WORDS", "20"))
+
+SHINGLE_SIZE = 3
+_WORD_RE = re.compile(r"\w+")
+_BIT_WEIGHTS = 1 << np.arange(64, dtype=np.uint64)
+
+K = TypeVar("K", bound=Hashable)
+
+
+def simhash(text: str, min_words: int = DEDUP_MIN_WORDS) -> int | None:
+    """
+    SimHash de 64 bits sobre shingles de 3 palavras (minúsculas).
+
+    Textos que diferem em poucos trechos (versão impressa, data de revisão,
+    parâmetros na URL) ficam a poucos bits de distância. Devolve None para
+    textos com menos de `min_words` palavras.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < max(min_words, SHINGLE_SIZE):
+        return None
+    shingles = {" ".join(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    bits = (hashes[:, None] & _BIT_WEIGHTS) != 0
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    return int(np.bitwise_or.reduce(_BIT_WEIGHTS[votes])) if votes.any() else 0
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_signed(fingerprint: int) -> int:
+    """Fingerprint de 64 bits sem sinal -> BIGINT do Postgres."""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def to_unsigned(value: int) -> int:
+    return value & ((1 << 64) - 1)
+
+
+def band_keys(fingerprint: int, max_distance: int) -> list[int]:
+    """
+    Bandas de `fingerprint` (as mesmas do SimHashIndex) como BIGINTs para o
+    índice GIN de chunks.simhash_bands. Cada chave embute o número de bandas e
+    a posição: valores gravados com outro `max_distance` não colidem com os
+    atuais, só deixam de ser encontrados.
+    """
+    bands = max_distance + 1
+    width = 64 // bands
+    mask = (1 << width) - 1
+    return [(bands << 56) | (band << 48) | ((fingerprint >> (band * width)) & mask) for band in range(bands)]
+
+
+class SimHashIndex(Generic[K]):
+    """
+    Busca de fingerprints a até `max_distance` bits por bandas: com
+    max_distance + 1 bandas, dois valores tão próximos coincidem em pelo menos
+    uma delas, então só esses candidatos são comparados.
+    """
+
+    def __init__(self, max_distance: int) -> None:
+        self.max_distance = max_distance
+        self._bands = max_distance + 1
+        self._width = 64 // self._bands
+        self._buckets: list[dict[int, list[tuple[int, K]]]] = [defaultdict(list) for _ in range(self._bands)]
+
+    def add(self, fingerprint: int, key: K) -> None:
+        for band, value in enumerate(self._band_values(fingerprint)):
+            self._buckets[band][value].append((fingerprint, key))
+
+    def find(self, fingerprint: int, exclude: K | None = None) -> K | None:
+        """Chave de um fingerprint próximo, ignorando `exclude`; None se não houver."""
+        found = self.match(fingerprint, exclude)
+        return found[1] if found else None
+
+    def match(self, fingerprint: int, exclude: K | None = None) -> tuple[int, K] | None:
+        """Como `find`, mas devolve também o fingerprint encontrado."""
+        for band, value in enumerate(self._band_values(fingerprint)):
+            for other, key in self._buckets[band].get(value, ()):
+                if key != exclude and hamming(fingerprint, other) <= self.max_distance:
+                    return other, key
+        return None
+
+    def _band_values(self, fingerprint: int) -> list[int]:
+        mask = (1 << self._width) - 1
+        return [(fingerprint >> (band * self._width)) & mask for band in range(self._bands)]
@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib
+import logging
+import os
+import pathlib
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+import tiktoken
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+
+from config import EMBEDDING_DIMENSIONS
+
+logger = logging.getLogger(__name__)
+
+# "openai" (API), "onnx" (modelo local na CPU via ONNX Runtime) ou "hashing" (determinístico, para testes).
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+# ONNX: diretório com model.onnx e tokenizer.json (export do Hugging Face, ex.: via optimum).
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "models/embedding")
+EMBEDDING_MAX_TOKENS = int(os.getenv("EMBEDDING_MAX_TOKENS", "512"))
+EMBEDDING_POOLING = os.getenv("EMBEDDING_POOLING", "mean")  # "mean" ou "cls"
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = padrão do ONNX Runtime
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+_WORD_RE = re.compile(r"\w+")
+
+_client: OpenAI | None = None
+_async_client: AsyncOpenAI | None = None
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        _client = OpenAI()
+    return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI()
+    return _async_client
+
+
+class EmbeddingProvider(ABC):
+    """
+    Backend de embeddings. `embed` recebe um lote já dimensionado por
+    `ingestion.embeddings` (batch_tokens/batch_size) e devolve vetores de
+    EMBEDDING_DIMENSIONS na mesma ordem; `count_tokens` usa o tokenizador do
+    modelo (None se indisponível, e o chamador conta palavras).
+    """
+
+    name = ""
+    default_model = ""
+    batch_tokens = 100_000
+    batch_size = 512
+    concurrency = 4
+    max_input_tokens = 8191
+
+    def __init__(self, model: str, dimensions: int = EMBEDDING_DIMENSIONS) -> None:
+        self.model = model
+        self.dimensions = dimensions
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> List[list[float]]:
+        """Vetores de `texts`, na mesma ordem."""
+
+    async def aembed(self, texts: list[str]) -> List[list[float]]:
+        return await asyncio.to_thread(self.embed, texts)
+
+    def count_tokens(self, text: str) -> int | None:
+        return len(text.split())
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """API de embeddings da OpenAI (ou compatível, via OPENAI_BASE_URL), com retry em rate limit."""
+
+    name = "openai"
+    default_model = "text-embedding-3-small"
+
+    def embed(self, texts: list[str]) -> List[list[float]]:
+        client = get_client()
+        attempt = 0
+        while True:
+            try:
+                response = client.embeddings.create(input=texts, **self._params())
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as exc:
+                if attempt >= EMBEDDING_MAX_RETRIES:
+                    raise
+                delay = _retry_delay(exc, attempt)
+                attempt += 1
+                _log_retry(exc, attempt, delay)
+                time.sleep(delay)
+
+    async def aembed(self, texts: list[str]) -> List[list[float]]:
+        client = get_async_client()
+        attempt = 0
+        while True:
+            try:
+                response = await client.embeddings.create(input=texts, **self._params())
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as exc:
+                if attempt >= EMBEDDING_MAX_RETRIES:
+                    raise
+                delay = _retry_delay(exc, attempt)
+                attempt += 1
+                _log_retry(exc, attempt, delay)
+                await asyncio.sleep(delay)
+
+    def count_tokens(self, text: str) -> int | None:
+        encoding = _tiktoken_encoding(self.model)
+        if encoding is None:
+            return None
+        try:
+            return len(encoding.encode(text))
+        except Exception:
+            return None
+
+    def _params(self) -> dict:
+        params = {"model": self.model}
+        # Os modelos text-embedding-3 encurtam o vetor (Matryoshka) para a largura da coluna.
+        if self.model.startswith("text-embedding-3"):
+            params["dimensions"] = self.dimensions
+        return params
+
+
+class OnnxEmbeddingProvider(EmbeddingProvider):
+    """
+    Modelo de embeddings local na CPU (ONNX Runtime + tokenizers), sem rede.
+    Requer `pip install onnxruntime tokenizers` e um export com model.onnx e
+    tokenizer.json em EMBEDDING_MODEL_PATH. O ONNX Runtime já paraleliza cada
+    lote entre os núcleos, então os lotes são menores e sequenciais.
+    """
+
+    name = "onnx"
+    batch_tokens = 16_384
+    batch_size = 32
+    concurrency = 1
+    # O limite do modelo inclui os tokens especiais ([CLS]/[SEP]) que a contagem não vê.
+    max_input_tokens = EMBEDDING_MAX_TOKENS - 2
+
+    def __init__(self, model: str, dimensions: int = EMBEDDING_DIMENSIONS, path: str = EMBEDDING_MODEL_PATH) -> None:
+        super().__init__(model, dimensions)
+        self.path = pathlib.Path(path)
+        self._tokenizer = None
+        self._counter = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def embed(self, texts: list[str]) -> List[list[float]]:
+        tokenizer, session = self._load_tokenizer(), self._load_session()
+        encodings = tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        inputs = {node.name for node in session.get_inputs()}
+        output = session.run(None, {name: value for name, value in feeds.items() if name in inputs})[0]
+        if output.ndim == 3:  # last_hidden_state: (lote, tokens, largura)
+            if EMBEDDING_POOLING == "cls":
+                output = output[:, 0]
+            else:
+                mask = feeds["attention_mask"][..., None].astype(np.float32)
+                output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if output.shape[1] < self.dimensions:
+            raise ValueError(
+                f"O modelo em {self.path} gera vetores de {output.shape[1]} dimensões; "
+                f"EMBEDDING_DIMENSIONS={self.dimensions}"
+            )
+        # Modelos Matryoshka toleram o corte; a normalização mantém a distância de cosseno.
+        vectors = output[:, : self.dimensions].astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.tolist()
+
+    def count_tokens(self, text: str) -> int | None:
+        try:
+            self._load_tokenizer()
+        except Exception:
+            return None
+        return len(self._counter.encode(text, add_special_tokens=False).ids)
+
+    def _load_tokenizer(self):
+        with self._lock:
+            if self._tokenizer is None:
+                Tokenizer = _import_optional("tokenizers").Tokenizer
+                tokenizer = Tokenizer.from_file(str(self.path / "tokenizer.json"))
+                # Cópia sem truncamento nem padding: o chunker precisa do tamanho real do texto.
+                counter = Tokenizer.from_str(tokenizer.to_str())
+                counter.no_truncation()
+                counter.no_padding()
+                tokenizer.enable_truncation(max_length=EMBEDDING_MAX_TOKENS)
+                tokenizer.enable_padding(pad_id=tokenizer.token_to_id("[PAD]") or 0)
+                self._tokenizer, self._counter = tokenizer, counter
+            return self._tokenizer
+
+    def _load_session(self):
+        with self._lock:
+            if self._session is None:
+                onnxruntime = _import_optional("onnxruntime")
+                options = onnxruntime.SessionOptions()
+                if EMBEDDING_THREADS:
+                    options.intra_op_num_threads = EMBEDDING_THREADS
+                self._session = onnxruntime.InferenceSession(
+                    str(self.path / "model.onnx"), options, providers=["CPUExecutionProvider"]
+                )
+                logger.info("Modelo de embeddings ONNX carregado de %s", self.path)
+            return self._session
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Feature hashing das palavras: determinístico, sem modelo nem rede. Textos
+    com vocabulário parecido ficam próximos no cosseno; serve para testes e
+    benchmarks, não para produção.
+    """
+
+    name = "hashing"
+    default_model = "hashing-v1"
+    concurrency = 1
+    max_input_tokens = 1_000_000
+
+    def embed(self, texts: list[str]) -> List[list[float]]:
+        return [hashing_embedding(text, self.dimensions).tolist() for text in texts]
+
+
+PROVIDERS: dict[str, type[EmbeddingProvider]] = {
+    provider.name: provider for provider in (OpenAIEmbeddingProvider, OnnxEmbeddingProvider, HashingEmbeddingProvider)
+}
+
+
+def provider_class(name: str = EMBEDDING_PROVIDER) -> type[EmbeddingProvider]:
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"EMBEDDING_PROVIDER desconhecido: {name} (use {', '.join(PROVIDERS)})") from None
+
+
+def default_model(name: str = EMBEDDING_PROVIDER) -> str:
+    """Identificador do modelo, que também entra na chave do cache de embeddings."""
+    if name == OnnxEmbeddingProvider.name:
+        return f"onnx:{pathlib.Path(EMBEDDING_MODEL_PATH).name}"
+    return provider_class(name).default_model
+
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or default_model()
+
+
+@lru_cache
+def get_provider() -> EmbeddingProvider:
+    return provider_class()(EMBEDDING_MODEL)
+
+
+def hashing_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[digest % dimensions] += 1.0 if digest >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+def _import_optional(module: str):
+    try:
+        return importlib.import_module(module)
+    except ImportError as exc:
+        raise RuntimeError(
+            f"EMBEDDING_PROVIDER=onnx requer {module}: pip install onnxruntime tokenizers"
+        ) from exc
+
+
+@lru_cache
+def _tiktoken_encoding(model: str):
+    """Encoding do tiktoken, ou None se não puder ser carregado (sem rede e sem cache local)."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as exc:
+        # Guardado no lru_cache: sem isso cada contagem tentaria baixar o arquivo BPE de novo.
+        logger.warning("tiktoken indisponível (%s); contagem de tokens por palavras", exc)
+        return None
+
+
+def _retry_delay(exc: Exception, attempt: int) -> float:
+    """Backoff exponencial com jitter, respeitando Retry-After quando a API informa."""
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        if retry_after:
+            return float(retry_after)
+    except ValueError:
+        pass
+    return min(60.0, 2**attempt) * random.uniform(0.5, 1.0)
+
+
+def _log_retry(exc: Exception, attempt: int, delay: float) -> None:
+    logger.warning(
+        "Embeddings: %s (tentativa %d/%d), nova tentativa em %.1fs",
+        type(exc).__name__,
+        attempt,
+        EMBEDDING_MAX_RETRIES,
+        delay,
+    )
@@ -1,41 +1,152 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import logging
 import os
-from functools import lru_cache
-from typing import Iterable, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List
 
-import tiktoken
-from openai import OpenAI
+from sqlalchemy.orm import Session
 
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
-_client: OpenAI | None = None
+from config import EMBEDDING_DIMENSIONS
+from db.queries import embedding_column_dimensions, stale_embedding_models
+# get_client/get_async_client continuam expostos aqui (o /ask usa o cliente para o chat).
+from ingestion.embedding_providers import (
+    EMBEDDING_MODEL,
+    EmbeddingProvider,
+    get_async_client,
+    get_client,
+    get_provider,
+    provider_class,
+)
+from observability.metrics import EMBED_BATCH_SECONDS, EMBED_BATCH_TEXTS, EMBED_BATCH_TOKENS
 
+logger = logging.getLogger(__name__)
 
-def get_client() -> OpenAI:
-    global _client
-    if _client is None:
-        _client = OpenAI()
-    return _client
+# Limites por requisição; os padrões vêm do provedor (a API da OpenAI aceita até
+# 2048 entradas e ~300k tokens; um modelo local na CPU prefere lotes menores).
+_defaults = provider_class()
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", str(_defaults.batch_tokens)))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", str(_defaults.batch_size)))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", str(_defaults.concurrency)))
 
 
 def embed_texts(texts: Iterable[str]) -> List[list[float]]:
-    """Gera embeddings preservando a ordem dos textos."""
-    client = get_client()
-    response = client.embeddings.create(model=EMBEDDING_MODEL, input=list(texts))
-    return [item.embedding for item in response.data]
+    """
+    Gera embeddings preservando a ordem dos textos.
 
+    Os textos são agrupados em lotes por orçamento de tokens e os lotes vão
+    para o provedor (EMBEDDING_PROVIDER) em paralelo (EMBEDDING_CONCURRENCY).
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    provider = get_provider()
+    batches = list(_token_batches(texts))
+    if len(batches) == 1:
+        return _embed_batch(provider, texts)
 
-@lru_cache
-def _encoding():
-    try:
-        return tiktoken.encoding_for_model(EMBEDDING_MODEL)
-    except KeyError:
-        return tiktoken.get_encoding("cl100k_base")
+    results: List[list[float]] = [[] for _ in texts]
+    workers = min(EMBEDDING_CONCURRENCY, len(batches))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as pool:
+        vectors_per_batch = pool.map(lambda batch: _embed_batch(provider, batch[1]), batches)
+        for (start, batch), vectors in zip(batches, vectors_per_batch):
+            results[start : start + len(batch)] = vectors
+    return results
+
+
+async def aembed_texts(texts: Iterable[str]) -> List[list[float]]:
+    """Versão assíncrona de `embed_texts` (mesmos lotes e limites)."""
+    texts = list(texts)
+    if not texts:
+        return []
+    provider = get_provider()
+    limit = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+    async def run(batch: list[str]) -> List[list[float]]:
+        async with limit:
+            started = time.perf_counter()
+            vectors = await provider.aembed(batch)
+            EMBED_BATCH_SECONDS.labels(provider.name).observe(time.perf_counter() - started)
+            return vectors
+
+    batches = list(_token_batches(texts))
+    results: List[list[float]] = [[] for _ in texts]
+    for (start, batch), vectors in zip(batches, await asyncio.gather(*(run(b) for _, b in batches))):
+        results[start : start + len(batch)] = vectors
+    return results
+
+
+def _token_batches(texts: list[str]) -> Iterator[tuple[int, list[str]]]:
+    """Lotes contíguos (offset, textos) dentro de EMBEDDING_BATCH_TOKENS/EMBEDDING_BATCH_SIZE."""
+    start = 0
+    batch: list[str] = []
+    batch_tokens = 0
+    for position, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if batch and (
+            batch_tokens + tokens > EMBEDDING_BATCH_TOKENS or len(batch) >= EMBEDDING_BATCH_SIZE
+        ):
+            yield _observed(start, batch, batch_tokens)
+            start, batch, batch_tokens = position, [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield _observed(start, batch, batch_tokens)
+
+
+def _observed(start: int, batch: list[str], tokens: int) -> tuple[int, list[str]]:
+    EMBED_BATCH_TEXTS.observe(len(batch))
+    EMBED_BATCH_TOKENS.observe(tokens)
+    return start, batch
+
+
+def _embed_batch(provider: EmbeddingProvider, texts: list[str]) -> List[list[float]]:
+    started = time.perf_counter()
+    vectors = provider.embed(texts)
+    EMBED_BATCH_SECONDS.labels(provider.name).observe(time.perf_counter() - started)
+    return vectors
+
+
+def embedding_key(text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Chave do cache de embeddings: o mesmo texto no mesmo modelo gera o mesmo vetor."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def check_stored_embeddings(session: Session) -> None:
+    """
+    Falha se o banco guarda vetores que o provedor atual não consegue comparar:
+    coluna chunks.embedding de outra largura ou documentos visíveis embedados
+    com outro modelo. Nos dois casos as buscas por similaridade dariam lixo.
+    """
+    dimensions = embedding_column_dimensions(session)
+    if dimensions is not None and dimensions != EMBEDDING_DIMENSIONS:
+        raise RuntimeError(
+            f"chunks.embedding tem {dimensions} dimensões e EMBEDDING_DIMENSIONS é {EMBEDDING_DIMENSIONS}: "
+            "recrie as tabelas e reingira os domínios com scripts/rebuild_domain.py."
+        )
+    stale = stale_embedding_models(session, EMBEDDING_MODEL)
+    if stale:
+        found = ", ".join(f"{domain} ({model})" for domain, model in stale)
+        raise RuntimeError(
+            f"Documentos embedados com outro modelo que {EMBEDDING_MODEL}: {found}. "
+            "Reconstrua esses domínios com scripts/rebuild_domain.py antes de subir a API."
+        )
+
+
+def max_input_tokens() -> int:
+    """Maior entrada que o modelo do provedor ativo embute sem truncar."""
+    return get_provider().max_input_tokens
 
 
 def count_tokens(text: str) -> int:
-    """Conta tokens para chunking. Fallback simples caso tiktoken falhe."""
-    try:
-        return len(_encoding().encode(text))
-    except Exception:
-        return max(1, len(text.split()))
+    """Conta tokens para chunking com o tokenizador do provedor ativo, ou por palavras."""
+    tokens = try_count_tokens(text)
+    return tokens if tokens is not None else max(1, len(text.split()))
+
+
+def try_count_tokens(text: str) -> int | None:
+    """Como `count_tokens`, mas devolve None em vez de aplicar o fallback por palavras."""
+    return get_provider().count_tokens(text)
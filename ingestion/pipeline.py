@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor
+from contextlib import aclosing
+from typing import Callable, Sequence
+
+from sqlalchemy.orm import Session
+
+from crawler.crawl import Crawler
+from crawler.extract import PageContent
+from ingestion.updater import (
+    DedupState,
+    EmbeddedPage,
+    IngestionResult,
+    embed_pages,
+    prepare_page,
+    reingest_pages,
+    write_pages,
+)
+
+_DONE = object()
+
+
+async def run_pipeline(
+    crawler: Crawler,
+    base_url: str,
+    *,
+    executor: Executor,
+    workers: int,
+    embed_session: Session,
+    write_session: Session,
+    batch_pages: int = 16,
+    generation: int | None = None,
+    on_result: Callable[[PageContent, IngestionResult], None] | None = None,
+    should_stop: Callable[[], bool] | None = None,
+) -> list[IngestionResult]:
+    """
+    Crawl + ingestão em estágios encadeados por filas limitadas:
+
+        download -> parse (executor) -> payload/chunks (executor) -> embeddings -> gravação
+
+    Com um ProcessPoolExecutor, parse e chunking usam vários núcleos enquanto
+    os downloads, a API de embeddings e o banco seguem em paralelo. As filas
+    limitadas seguram o estágio anterior quando o seguinte fica para trás;
+    `workers` é o número de tarefas de preparo (use o tamanho do pool).
+    Embeddings e gravação usam sessões próprias porque rodam em threads distintas.
+    Com `generation`, as páginas vão para essa geração (rebuild em sombra).
+    Quando `should_stop` devolve True, o crawl para e as páginas já baixadas
+    terminam de passar pelos estágios.
+    """
+    pages: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    prepared: asyncio.Queue = asyncio.Queue(maxsize=batch_pages * 2)
+    embedded: asyncio.Queue = asyncio.Queue(maxsize=2)
+    results: list[IngestionResult] = []
+    dedup = DedupState()  # duplicatas entre lotes, antes de chegarem ao banco
+    loop = asyncio.get_running_loop()
+
+    async def fetch() -> None:
+        async with aclosing(crawler.crawl_async(base_url)) as crawled:
+            async for page in crawled:
+                if should_stop and should_stop():
+                    break
+                await pages.put(page)
+        for _ in range(workers):
+            await pages.put(_DONE)
+
+    async def prepare() -> None:
+        while (page := await pages.get()) is not _DONE:
+            await prepared.put(await loop.run_in_executor(executor, prepare_page, page))
+        await prepared.put(_DONE)
+
+    async def embed() -> None:
+        finished = 0
+        batch = []
+        while finished < workers:
+            item = await prepared.get()
+            if item is _DONE:
+                finished += 1
+            else:
+                batch.append(item)
+            if batch and (len(batch) >= batch_pages or finished == workers):
+                await embedded.put(await asyncio.to_thread(_embed_batch, embed_session, batch, dedup, generation))
+                batch = []
+        await embedded.put(_DONE)
+
+    async def write() -> None:
+        while (batch := await embedded.get()) is not _DONE:
+            batch_results = await asyncio.to_thread(write_pages, write_session, batch, generation)
+            for entry, result in zip(batch, batch_results):
+                results.append(result)
+                if on_result:
+                    on_result(entry.prepared.page, result)
+
+    async with asyncio.TaskGroup() as group:
+        group.create_task(fetch())
+        for _ in range(workers):
+            group.create_task(prepare())
+        group.create_task(embed())
+        group.create_task(write())
+
+    # Quase-duplicatas de páginas que mudaram: a fila já passou por elas, então são baixadas de novo aqui.
+    released = [url for result in results for url in result.released_duplicates]
+    if released:
+        results += await asyncio.to_thread(reingest_pages, write_session, released, generation, dedup)
+    return results
+
+
+def _embed_batch(
+    session: Session, batch: Sequence, dedup: DedupState, generation: int | None
+) -> list[EmbeddedPage]:
+    pending = embed_pages(session, batch, dedup, generation)
+    session.commit()  # grava o cache de embeddings antes de liberar o lote
+    return pending
@@ -1,15 +1,49 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import os
+from dataclasses import dataclass, field
 from typing import Sequence
 
 from sqlalchemy.orm import Session
 
-from db.queries import get_document_by_url, replace_chunks, save_document
+from db.local_index import notify_chunks_changed
+from db.queries import (
+    abandon_generation,
+    activate_generation,
+    begin_generation,
+    find_canonical_document,
+    get_cached_embeddings,
+    get_document_by_url,
+    insert_chunk_rows,
+    purge_inactive_generations,
+    release_chunk_duplicates,
+    release_duplicates,
+    replace_chunks,
+    save_crawl_cache,
+    save_document,
+    similar_chunk_fingerprints,
+    store_embeddings,
+    visible_urls,
+)
+from crawler.crawl import Crawler, CrawlerConfig
 from ingestion.chunker import Chunk, chunk_page
-from ingestion.documents import build_payload
-from ingestion.embeddings import embed_texts
+from ingestion.dedup import (
+    DEDUP_CHUNK_MAX_DISTANCE,
+    DEDUP_MAX_DISTANCE,
+    SimHashIndex,
+    band_keys,
+    simhash,
+    to_signed,
+    to_unsigned,
+)
+from ingestion.documents import DocumentPayload, build_payload
+from ingestion.embeddings import EMBEDDING_MODEL, embed_texts, embedding_key
 from crawler.extract import PageContent
+from observability.metrics import CACHE_LOOKUPS
+
+# Páginas publicadas que um rebuild pode perder por falha de download (exceto 404/410)
+# antes de a geração nova ser descartada em vez de ativada.
+REBUILD_MAX_ERRORS = int(os.getenv("REBUILD_MAX_ERRORS", "0"))
 
 
 @dataclass
@@ -18,34 +52,367 @@ class IngestionResult:
     created: bool
     updated: bool
     chunks: int
+    embeddings_reused: int = 0
+    chunks_inserted: int = 0
+    chunks_updated: int = 0
+    chunks_deleted: int = 0
+    chunks_skipped: int = 0
+    duplicate_of: str | None = None
+    # Quase-duplicatas ligadas a esta página (ou a chunks que saíram dela); `ingest_pages` as reingere.
+    released_duplicates: list[str] = field(default_factory=list)
 
+    @property
+    def rows_touched(self) -> int:
+        return self.chunks_inserted + self.chunks_updated + self.chunks_deleted
 
-def ingest_page(session: Session, page: PageContent) -> IngestionResult:
-    payload = build_payload(page)
-    existing = get_document_by_url(session, payload.url)
-    if existing and existing.content_hash == payload.content_hash:
-        return IngestionResult(url=payload.url, created=False, updated=False, chunks=len(existing.chunks))
 
-    chunks = chunk_page(page)
-    embeddings = embed_texts(chunk.text for chunk in chunks)
-    chunk_entries = _build_chunk_entries(chunks, embeddings)
-    document = save_document(
-        session,
-        domain=payload.domain,
-        url=payload.url,
-        title=payload.title,
-        content=payload.content,
-        content_hash=payload.content_hash,
-    )
-    replace_chunks(session, document, chunk_entries)
+def ingest_page(session: Session, page: PageContent, dedup: DedupState | None = None) -> IngestionResult:
+    return ingest_pages(session, [page], dedup=dedup)[0]
+
+
+def ingest_pages(
+    session: Session,
+    pages: Sequence[PageContent],
+    generation: int | None = None,
+    dedup: DedupState | None = None,
+) -> list[IngestionResult]:
+    """
+    Ingere várias páginas numa única transação.
+
+    Os chunks de todas as páginas alteradas são embedados juntos, para que
+    `embed_texts` monte lotes cheios em vez de uma requisição por página.
+    Sem `generation`, grava na geração ativa do domínio. Quem ingere vários
+    lotes (rebuild, script) passa o mesmo `dedup` a todos.
+    """
+    prepared = [prepare_page(page, chunk=False) for page in pages]
+    results = write_pages(session, embed_pages(session, prepared, dedup, generation), generation)
+    released = [url for result in results for url in result.released_duplicates]
+    if released:
+        reingest_pages(session, released, generation, dedup)
+    return results
+
+
+def reingest_pages(
+    session: Session,
+    urls: Sequence[str],
+    generation: int | None = None,
+    dedup: DedupState | None = None,
+) -> list[IngestionResult]:
+    """
+    Baixa de novo e reingere páginas cujo canônico mudou, ou que tinham
+    descartado um chunk que saiu da página de origem: voltam a ter chunks
+    próprios ou são ligadas ao canônico atual. Se o download falhar, a página
+    fica sem hash nem validadores (ver `release_duplicates`) e o próximo crawl
+    a reingere.
+    """
+    crawler = Crawler(CrawlerConfig(max_pages=1, seed_sitemap=False))
+    pages = [page for url in dict.fromkeys(urls) for page in crawler.crawl(url)]
+    return ingest_pages(session, pages, generation, dedup) if pages else []
+
+
+def start_rebuild(session: Session, domain: str) -> int:
+    """Abre uma geração sombra para o rebuild; o /ask segue lendo a atual."""
+    generation = begin_generation(session, domain)
+    session.commit()
+    return generation
+
+
+def finish_rebuild(session: Session, domain: str, generation: int) -> int:
+    """Publica a geração do rebuild e apaga a anterior em lotes; devolve os documentos removidos."""
+    activate_generation(session, domain, generation)
+    session.commit()
+    notify_chunks_changed()
+    return purge_inactive_generations(session, domain)
+
+
+def lost_pages(session: Session, domain: str, crawler: Crawler) -> list[str]:
+    """
+    Páginas da geração ativa que o crawl do rebuild não conseguiu baixar:
+    sumiriam do /ask com o flip. 404/410 (`crawler.gone`) são remoções
+    legítimas, e falhas em URLs que ainda não estavam publicadas só deixam
+    de acrescentar páginas; nenhuma das duas conta.
+    """
+    return visible_urls(session, domain, crawler.failed)
+
+
+def abort_rebuild(session: Session, domain: str, generation: int) -> int:
+    """Descarta a geração de um rebuild cancelado ou com falha; a ativa não é tocada."""
+    session.rollback()
+    abandon_generation(session, domain, generation)
     session.commit()
+    return purge_inactive_generations(session, domain)
+
+
+@dataclass
+class PreparedPage:
+    """Payload e chunks calculados fora do banco (podem vir de outro processo)."""
+
+    page: PageContent
+    payload: DocumentPayload
+    chunks: list[Chunk] | None = None
+
+
+@dataclass
+class EmbeddedPage:
+    prepared: PreparedPage
+    existed: bool
+    unchanged_chunks: int | None = None
+    embeddings: list[list[float]] = field(default_factory=list)
+    reused: int = 0
+    duplicate_of: str | None = None
+    chunks_skipped: int = 0
+    # SimHash dos chunks de outras páginas pelos quais os descartados foram trocados (documents.chunk_sources).
+    chunk_sources: list[int] = field(default_factory=list)
+    # Os chunks atuais vieram de outro modelo: nenhum vetor gravado pode ser mantido.
+    rewrite: bool = False
+
+
+@dataclass
+class DedupState:
+    """
+    Fingerprints de páginas e chunks vistos nesta execução, por domínio. Um
+    rebuild ou script mantém um único estado entre lotes para achar duplicatas
+    que ainda não foram gravadas no banco; as já gravadas vêm das consultas
+    (documents.simhash e o índice de chunks.simhash_bands), então o estado
+    começa vazio e cresce só com o que a execução ingere.
+    """
+
+    pages: dict[str, SimHashIndex[str]] = field(default_factory=dict)
+    chunks: dict[str, SimHashIndex[str]] = field(default_factory=dict)
+
+    def page_index(self, domain: str) -> SimHashIndex[str]:
+        return self.pages.setdefault(domain, SimHashIndex(DEDUP_MAX_DISTANCE))
 
-    return IngestionResult(
-        url=payload.url,
-        created=existing is None,
-        updated=existing is not None,
-        chunks=len(chunk_entries),
+    def chunk_index(self, domain: str) -> SimHashIndex[str]:
+        return self.chunks.setdefault(domain, SimHashIndex(DEDUP_CHUNK_MAX_DISTANCE))
+
+
+def prepare_page(page: PageContent, *, chunk: bool = True) -> PreparedPage:
+    """Parte CPU-bound da ingestão (ftfy, chunking, tokens); `chunk=False` adia o chunking."""
+    return PreparedPage(page=page, payload=build_payload(page), chunks=chunk_page(page) if chunk else None)
+
+
+def embed_pages(
+    session: Session,
+    prepared: Sequence[PreparedPage],
+    dedup: DedupState | None = None,
+    generation: int | None = None,
+) -> list[EmbeddedPage]:
+    """
+    Compara hashes com o banco e embeda os chunks das páginas alteradas ou
+    embedadas com outro modelo (documents.embedding_model).
+
+    Antes dos embeddings, páginas quase idênticas a outra do domínio (SimHash)
+    são ligadas a ela e ficam sem chunks, e chunks quase idênticos a um já
+    gravado em outra página são descartados.
+
+    Só grava no cache de embeddings; o commit fica com quem chama (pode ser
+    uma sessão diferente da usada em `write_pages`).
+    """
+    dedup = dedup or DedupState()
+    pending: list[EmbeddedPage] = []
+    changed: list[EmbeddedPage] = []
+    for item in prepared:
+        existing = get_document_by_url(session, item.payload.url, generation)
+        same_model = existing is not None and existing.embedding_model == EMBEDDING_MODEL
+        if same_model and existing.content_hash == item.payload.content_hash:
+            pending.append(EmbeddedPage(item, existed=True, unchanged_chunks=len(existing.chunks)))
+            continue
+        entry = EmbeddedPage(item, existed=existing is not None, rewrite=existing is not None and not same_model)
+        entry.duplicate_of = _find_duplicate_page(session, dedup, item.payload, generation)
+        if entry.duplicate_of is not None:
+            item.chunks = []
+        else:
+            if item.chunks is None:
+                item.chunks = chunk_page(item.page)
+            entry.chunk_sources = _drop_duplicate_chunks(session, dedup, item, generation)
+            entry.chunks_skipped = len(entry.chunk_sources)
+        pending.append(entry)
+        changed.append(entry)
+
+    texts = [chunk.text for entry in changed for chunk in entry.prepared.chunks]
+    if texts:
+        embeddings, reused = _embed_with_cache(session, texts)
+        offset = 0
+        for entry in changed:
+            count = len(entry.prepared.chunks)
+            entry.embeddings = embeddings[offset : offset + count]
+            entry.reused = sum(reused[offset : offset + count])
+            offset += count
+    return pending
+
+
+def write_pages(
+    session: Session, pending: Sequence[EmbeddedPage], generation: int | None = None
+) -> list[IngestionResult]:
+    """Grava documentos e chunks já embedados e faz o commit."""
+    results: list[IngestionResult] = []
+    new_rows: list[dict] = []
+    validators_changed = False
+    chunks_changed = False
+    removed_chunks: list[tuple] = []
+
+    for entry in pending:
+        page, payload = entry.prepared.page, entry.prepared.payload
+        if entry.unchanged_chunks is not None:
+            validators_changed |= _remember_validators(session, page, payload.domain, generation)
+            results.append(
+                IngestionResult(url=payload.url, created=False, updated=False, chunks=entry.unchanged_chunks)
+            )
+            continue
+
+        chunk_entries = _build_chunk_entries(entry.prepared.chunks, entry.embeddings)
+        canonical = get_document_by_url(session, entry.duplicate_of, generation) if entry.duplicate_of else None
+        document = save_document(
+            session,
+            domain=payload.domain,
+            url=payload.url,
+            title=payload.title,
+            content=payload.content,
+            content_hash=payload.content_hash,
+            simhash=to_signed(payload.simhash) if payload.simhash is not None else None,
+            canonical_id=canonical.id if canonical else None,
+            generation=generation,
+            embedding_model=EMBEDDING_MODEL,
+            chunk_sources=sorted({to_signed(fingerprint) for fingerprint in entry.chunk_sources}),
+        )
+        stats = replace_chunks(session, document, chunk_entries, pending_rows=new_rows, rewrite=entry.rewrite)
+        # O conteúdo mudou: as páginas ligadas a este documento podem ter deixado de ser duplicatas.
+        released = release_duplicates(session, document.id) if entry.existed else []
+        if stats.removed_simhashes:
+            removed_chunks.append((document, stats.removed_simhashes, released))
+        _remember_validators(session, page, payload.domain, generation)
+        chunks_changed = True
+        results.append(
+            IngestionResult(
+                url=payload.url,
+                created=not entry.existed,
+                updated=entry.existed,
+                chunks=len(chunk_entries),
+                embeddings_reused=entry.reused,
+                chunks_inserted=stats.inserted,
+                chunks_updated=stats.updated,
+                chunks_deleted=stats.deleted,
+                chunks_skipped=entry.chunks_skipped,
+                duplicate_of=entry.duplicate_of,
+                released_duplicates=released,
+            )
+        )
+
+    # Páginas que descartaram um chunk que saiu do documento perderiam esse texto. Só depois do
+    # lote inteiro: uma página dele pode ter casado com o chunk antigo antes da gravação.
+    for document, simhashes, released in removed_chunks:
+        released += release_chunk_duplicates(session, document, [to_signed(value) for value in simhashes])
+
+    if chunks_changed:
+        insert_chunk_rows(session, new_rows)
+        session.commit()
+        notify_chunks_changed()
+    elif validators_changed:
+        session.commit()
+    return results
+
+
+def _find_duplicate_page(
+    session: Session, dedup: DedupState, payload: DocumentPayload, generation: int | None = None
+) -> str | None:
+    """URL da página canônica da qual `payload` é quase-duplicata, ou None."""
+    if DEDUP_MAX_DISTANCE <= 0 or payload.simhash is None:
+        return None
+    index = dedup.page_index(payload.domain)
+    duplicate_of = index.find(payload.simhash, exclude=payload.url)
+    if duplicate_of is None:
+        canonical = find_canonical_document(
+            session,
+            domain=payload.domain,
+            url=payload.url,
+            simhash=to_signed(payload.simhash),
+            max_distance=DEDUP_MAX_DISTANCE,
+            generation=generation,
+        )
+        duplicate_of = canonical.url if canonical else None
+    if duplicate_of is None:
+        index.add(payload.simhash, payload.url)
+    return duplicate_of
+
+
+def _drop_duplicate_chunks(
+    session: Session, dedup: DedupState, item: PreparedPage, generation: int | None = None
+) -> list[int]:
+    """
+    Remove chunks quase idênticos a chunks de outras páginas e renumera os
+    restantes. Devolve, por chunk descartado, o SimHash do chunk que ficou no
+    lugar dele, para a página ser reingerida se esse chunk sumir.
+    """
+    if DEDUP_CHUNK_MAX_DISTANCE <= 0:
+        return []
+    url, domain = item.payload.url, item.payload.domain
+    fingerprints = [simhash(chunk.text) for chunk in item.chunks]
+    # Candidatos já gravados: só os chunks que dividem alguma banda com os desta página.
+    stored: SimHashIndex[str] = SimHashIndex(DEDUP_CHUNK_MAX_DISTANCE)
+    keys = [key for fingerprint in fingerprints if fingerprint is not None for key in _band_keys(fingerprint)]
+    for other_url, fingerprint in similar_chunk_fingerprints(
+        session, domain=domain, url=url, band_keys=keys, generation=generation
+    ):
+        stored.add(to_unsigned(fingerprint), other_url)
+
+    index = dedup.chunk_index(domain)
+    kept: list[Chunk] = []
+    sources: list[int] = []
+    for chunk, fingerprint in zip(item.chunks, fingerprints):
+        if fingerprint is not None:
+            match = index.match(fingerprint, exclude=url) or stored.match(fingerprint)
+            if match is not None:
+                sources.append(match[0])
+                continue
+            chunk.metadata["simhash"] = fingerprint
+        kept.append(chunk)
+    for position, chunk in enumerate(kept):
+        chunk.index = position
+        chunk.metadata["chunk_index"] = position
+        if "simhash" in chunk.metadata:
+            index.add(chunk.metadata["simhash"], url)
+    item.chunks = kept
+    return sources
+
+
+def _band_keys(fingerprint: int) -> list[int]:
+    return band_keys(fingerprint, DEDUP_CHUNK_MAX_DISTANCE)
+
+
+def _embed_with_cache(session: Session, texts: Sequence[str]) -> tuple[list[list[float]], list[bool]]:
+    """Reaproveita vetores de textos já embedados; só os inéditos vão para a API."""
+    keys = [embedding_key(text) for text in texts]
+    vectors = get_cached_embeddings(session, set(keys))
+    reused = [key in vectors for key in keys]
+    CACHE_LOOKUPS.labels("embedding", "hits").inc(sum(reused))
+    CACHE_LOOKUPS.labels("embedding", "misses").inc(len(reused) - sum(reused))
+
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        fresh = dict(zip(missing, embed_texts(missing.values())))
+        store_embeddings(session, fresh, EMBEDDING_MODEL)
+        vectors.update(fresh)
+    return [vectors[key] for key in keys], reused
+
+
+def _remember_validators(session: Session, page: PageContent, domain: str, generation: int | None = None) -> bool:
+    """
+    Guarda ETag/Last-Modified para o próximo crawl fazer GET condicional. Num
+    rebuild, ficam na geração sombra e só passam a valer com o flip.
+    """
+    if not page.etag and not page.last_modified:
+        return False
+    save_crawl_cache(
+        session,
+        domain=domain,
+        url=page.url,
+        etag=page.etag,
+        last_modified=page.last_modified,
+        links=page.links,
+        generation=generation,
     )
+    return True
 
 
 def _build_chunk_entries(chunks: Sequence[Chunk], embeddings: Sequence[list[float]]) -> list[dict]:
@@ -57,6 +424,11 @@ def _build_chunk_entries(chunks: Sequence[Chunk], embeddings: Sequence[list[floa
                 "chunk_text": chunk.text,
                 "embedding": embedding,
                 "metadata": chunk.metadata,
+                "simhash_bands": (
+                    _band_keys(chunk.metadata["simhash"])
+                    if "simhash" in chunk.metadata and DEDUP_CHUNK_MAX_DISTANCE > 0
+                    else None
+                ),
             }
         )
     return payload
@@ -1,15 +1,40 @@
 from __future__ import annotations
 
-from fastapi import FastAPI
+import argparse
+import asyncio
+import sys
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST
 from dotenv import load_dotenv
 
 from api.ask import router as ask_router
 from api.ingest_url import router as ingest_router
 from api.rebuild_domain import router as rebuild_router
+from db.connection import get_session
+from ingestion.embeddings import check_stored_embeddings
+from observability.metrics import render_metrics
 
 load_dotenv()
 
-app = FastAPI(title="Corp Guide RAG")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Recusa subir com vetores de outro modelo ou largura no banco (ver check_stored_embeddings)."""
+    await asyncio.to_thread(_check_embeddings)
+    yield
+
+
+def _check_embeddings() -> None:
+    session = get_session()
+    try:
+        check_stored_embeddings(session)
+    finally:
+        session.close()
+
+
+app = FastAPI(title="Corp Guide RAG", lifespan=lifespan)
 
 app.include_router(ingest_router)
 app.include_router(rebuild_router)
@@ -19,3 +44,30 @@ app.include_router(ask_router)
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    """Métricas no formato do Prometheus (latência por etapa, caches e pool do banco)."""
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+def serve() -> None:
+    """Sobe o uvicorn; no Windows força o SelectorEventLoop exigido pelo psycopg assíncrono."""
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Sobe a API Corp Guide RAG.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8011)
+    args = parser.parse_args()
+
+    options = {}
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        # Sem isso o uvicorn troca a política pela do ProactorEventLoop; nos demais sistemas fica o uvloop.
+        options["loop"] = "none"
+    uvicorn.run(app, host=args.host, port=args.port, **options)
+
+
+if __name__ == "__main__":
+    serve()
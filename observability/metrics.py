@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import logging
+import os
+import pathlib
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.exposition import push_to_gateway, write_to_textfile
+from prometheus_client.registry import Collector
+from sqlalchemy.pool import QueuePool
+
+from db.connection import get_async_engine, get_engine
+
+logger = logging.getLogger(__name__)
+
+# Scripts de ingestão: Pushgateway (ex.: http://localhost:9091) e/ou arquivo no formato texto
+# (ex.: para o textfile collector do node_exporter), gravados ao sair.
+METRICS_PUSHGATEWAY = os.getenv("METRICS_PUSHGATEWAY", "")
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+
+_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+_TOKEN_BUCKETS = (100, 500, 1000, 5000, 10_000, 25_000, 50_000, 100_000, 200_000, 300_000)
+_LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+FETCH_SECONDS = Histogram(
+    "corp_guide_crawl_fetch_seconds", "Download de uma página pelo crawler, por status HTTP.", ["status"]
+)
+PARSE_SECONDS = Histogram("corp_guide_parse_page_seconds", "parse_page: HTML -> PageContent.")
+CHUNK_SECONDS = Histogram("corp_guide_chunk_page_seconds", "chunk_page: seções -> chunks.")
+EMBED_BATCH_SECONDS = Histogram(
+    "corp_guide_embedding_batch_seconds", "Um lote de embeddings no provedor.", ["provider"], buckets=_LLM_BUCKETS
+)
+EMBED_BATCH_TEXTS = Histogram(
+    "corp_guide_embedding_batch_texts", "Textos por lote de embeddings.", buckets=_SIZE_BUCKETS
+)
+EMBED_BATCH_TOKENS = Histogram(
+    "corp_guide_embedding_batch_tokens", "Tokens por lote de embeddings.", buckets=_TOKEN_BUCKETS
+)
+REPLACE_CHUNKS_SECONDS = Histogram(
+    "corp_guide_replace_chunks_seconds", "replace_chunks: diff dos chunks de um documento."
+)
+INSERT_CHUNK_ROWS_SECONDS = Histogram(
+    "corp_guide_insert_chunk_rows_seconds", "insert_chunk_rows: gravação em massa dos chunks novos (COPY ou INSERT)."
+)
+CHUNK_ROWS = Counter("corp_guide_chunk_rows", "Linhas de chunks gravadas, por operação.", ["operation"])
+RETRIEVAL_SECONDS = Histogram("corp_guide_ask_retrieval_seconds", "Busca vetorial do /ask.", ["backend"])
+LLM_SECONDS = Histogram(
+    "corp_guide_llm_answer_seconds", "Resposta do LLM no /ask.", ["mode", "outcome"], buckets=_LLM_BUCKETS
+)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "corp_guide_llm_first_token_seconds", "Tempo até o primeiro trecho no /ask/stream.", buckets=_LLM_BUCKETS
+)
+# cache: query_embedding, answer ou embedding; outcome: hits, shared_hits ou misses.
+CACHE_LOOKUPS = Counter("corp_guide_cache_lookups", "Consultas aos caches, por resultado.", ["cache", "outcome"])
+
+
+class DatabasePoolCollector(Collector):
+    """Uso dos pools de conexão dos engines já criados (síncrono e assíncrono), lido a cada coleta."""
+
+    def describe(self):
+        return self._families()
+
+    def collect(self):
+        families = self._families()
+        checked_out, idle, size, overflow = families
+        for name, pool in _pools():
+            checked_out.add_metric([name], pool.checkedout())
+            idle.add_metric([name], pool.checkedin())
+            size.add_metric([name], pool.size())
+            overflow.add_metric([name], pool.overflow())
+        return families
+
+    @staticmethod
+    def _families() -> list[GaugeMetricFamily]:
+        return [
+            GaugeMetricFamily("corp_guide_db_pool_checked_out", "Conexões em uso.", labels=["engine"]),
+            GaugeMetricFamily("corp_guide_db_pool_idle", "Conexões ociosas no pool.", labels=["engine"]),
+            GaugeMetricFamily("corp_guide_db_pool_size", "Tamanho configurado do pool.", labels=["engine"]),
+            GaugeMetricFamily(
+                "corp_guide_db_pool_overflow", "Conexões além do tamanho do pool (negativo: vagas).", labels=["engine"]
+            ),
+        ]
+
+
+POOL_COLLECTOR = DatabasePoolCollector()
+REGISTRY.register(POOL_COLLECTOR)
+
+
+def render_metrics() -> bytes:
+    """Exposição no formato texto do Prometheus (corpo do GET /metrics)."""
+    return generate_latest(_registry())
+
+
+def export_metrics(job: str, pushgateway: str = METRICS_PUSHGATEWAY, path: str = METRICS_FILE) -> None:
+    """Envia as métricas ao Pushgateway e/ou grava em `path`; falhas só geram aviso."""
+    registry = _registry()
+    if pushgateway:
+        try:
+            push_to_gateway(pushgateway, job=job, registry=registry)
+        except OSError as exc:
+            logger.warning("Falha ao enviar métricas para %s: %s", pushgateway, exc)
+    if path:
+        try:
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            write_to_textfile(path, registry)
+        except OSError as exc:
+            logger.warning("Falha ao gravar métricas em %s: %s", path, exc)
+
+
+def _registry() -> CollectorRegistry:
+    """
+    Com PROMETHEUS_MULTIPROC_DIR, soma os valores gravados por todos os
+    processos (pool de parse/chunking, workers do uvicorn); sem ela, só os
+    deste processo.
+    """
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(POOL_COLLECTOR)
+    return registry
+
+
+def _pools():
+    engines = []
+    # Só engines já criados: a coleta não deve criar engines nem abrir conexões.
+    if get_engine.cache_info().currsize:
+        engines.append(("sync", get_engine()))
+    if get_async_engine.cache_info().currsize:
+        engines.append(("async", get_async_engine().sync_engine))
+    for name, engine in engines:
+        if isinstance(engine.pool, QueuePool):  # NullPool/StaticPool não têm tamanho
+            yield name, engine.pool
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import argparse
+import json
 import sys
 import textwrap
 
@@ -20,14 +21,38 @@ def pretty_print(response: dict) -> None:
     print(f"\nContextos utilizados: {len(response['contexts'])}")
 
 
+def stream_answer(base_url: str, payload: dict) -> None:
+    """Consome o SSE de /ask/stream imprimindo a resposta conforme chega."""
+    with requests.post(f"{base_url}/ask/stream", json=payload, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line.split(":", 1)[1].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line.split(":", 1)[1])
+                if event == "contexts":
+                    print(f"\nPergunta: {data['question']}")
+                    print(f"Contextos utilizados: {len(data['contexts'])}\n")
+                    print("Resposta:")
+                elif event == "token":
+                    print(data["text"], end="", flush=True)
+                elif event == "done":
+                    print("\n\n(resposta em cache)" if data.get("cached") else "")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Faz uma pergunta ao endpoint /ask.")
     parser.add_argument("question", help="Pergunta em linguagem natural.")
     parser.add_argument("--url", default="http://127.0.0.1:8011", help="Base URL da API (42 chars máx).")
     parser.add_argument("--top-k", type=int, default=6, dest="top_k", help="Quantidade de contextos.")
+    parser.add_argument("--stream", action="store_true", help="Mostra a resposta conforme é gerada (SSE).")
     args = parser.parse_args()
 
     payload = {"question": args.question, "top_k": args.top_k}
+    if args.stream:
+        stream_answer(args.url.rstrip("/"), payload)
+        return
     response = requests.post(f"{args.url.rstrip('/')}/ask", json=payload, timeout=60)
     response.raise_for_status()
     pretty_print(response.json())
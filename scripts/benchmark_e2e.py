@@ -0,0 +1,404 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import math
+import os
+import pathlib
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+# Lidos na importação dos módulos da API: sem cache de respostas, toda pergunta passa pela busca e pelo LLM.
+os.environ.setdefault("ANSWER_CACHE_MAX_DISTANCE", "0")
+
+import httpx
+import numpy as np
+
+from bench.fake_openai import FakeOpenAIServer
+from bench.fixture_site import TOPICS, VOCABULARY, FixtureServer, generate_portal
+from crawler.crawl import Crawler, CrawlerConfig
+from crawler.extract import PageContent, parse_page
+from db.connection import get_session
+from db.models import Chunk, create_tables
+from db.queries import delete_domain, store_embeddings
+from ingestion.embeddings import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_TOKENS,
+    EMBEDDING_MODEL,
+    count_tokens,
+    embed_texts,
+    embedding_key,
+)
+from ingestion.updater import DedupState, ingest_page, prepare_page
+
+# (métrica, maior é melhor) comparadas com --baseline.
+KEY_METRICS = (
+    ("crawl.pages_per_second", True),
+    ("parse.parse_ms.p50", False),
+    ("parse.prepare_ms.p50", False),
+    ("embed.efficiency", True),
+    ("embed.texts_per_second", True),
+    ("ingest.ms_per_page.p50", False),
+    ("ingest.ms_per_page.p95", False),
+    ("ask.latency_ms.p50", False),
+    ("ask.latency_ms.p95", False),
+    ("ask.latency_ms.p99", False),
+)
+ENV_KNOBS = (
+    "HTML_PARSER",
+    "CHUNK_OVERLAP_TOKENS",
+    "CHUNK_WRITE_MODE",
+    "EMBEDDING_PROVIDER",
+    "EMBEDDING_BATCH_TOKENS",
+    "EMBEDDING_BATCH_SIZE",
+    "EMBEDDING_CONCURRENCY",
+    "RETRIEVAL_BACKEND",
+    "VECTOR_INDEX_METHOD",
+    "VECTOR_EF_SEARCH",
+    "VECTOR_QUANTIZATION",
+    "VECTOR_PREFIX_DIMENSIONS",
+)
+
+
+def summarize(samples: list[float]) -> dict:
+    """Média e percentis (ms) de uma lista de amostras."""
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+
+def run_crawl(base_url: str, max_pages: int, concurrency: int, workers: int) -> tuple[list[PageContent], dict]:
+    """Crawl assíncrono do portal local, com parse num pool de processos como no rebuild."""
+    config = CrawlerConfig(max_pages=max_pages, concurrency=concurrency)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        crawler = Crawler(config, parse_executor=executor)
+
+        async def crawl() -> list[PageContent]:
+            return [page async for page in crawler.crawl_async(base_url + "/")]
+
+        started = time.perf_counter()
+        pages = asyncio.run(crawl())
+        elapsed = time.perf_counter() - started
+    return pages, {
+        "pages": len(pages),
+        "failed": len(crawler.failed),
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(len(pages) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def run_parse(pages: list[PageContent]) -> tuple[list[str], dict]:
+    """Tempo de parse do HTML e de payload + chunking por página, num único processo."""
+    parse_ms: list[float] = []
+    prepare_ms: list[float] = []
+    texts: list[str] = []
+    for page in pages:
+        started = time.perf_counter()
+        parsed = parse_page(page.url, page.raw_html)
+        parse_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        prepared = prepare_page(parsed)
+        prepare_ms.append((time.perf_counter() - started) * 1000)
+        texts.extend(chunk.text for chunk in prepared.chunks)
+    return texts, {
+        "pages": len(pages),
+        "chunks": len(texts),
+        "chunks_per_page": round(len(texts) / len(pages), 2) if pages else 0.0,
+        "parse_ms": summarize(parse_ms),
+        "prepare_ms": summarize(prepare_ms),
+    }
+
+
+def run_embed(fake: FakeOpenAIServer, texts: list[str]) -> tuple[list[list[float]], dict]:
+    """
+    Embeddings de todos os chunks via `embed_texts`. `efficiency` compara o
+    número de requisições com o mínimo possível dentro de
+    EMBEDDING_BATCH_TOKENS / EMBEDDING_BATCH_SIZE (1.0 = lotes sempre cheios);
+    fica None com um provedor local, que não passa pelo servidor falso.
+    """
+    fake.reset_stats()
+    started = time.perf_counter()
+    vectors = embed_texts(texts)
+    elapsed = time.perf_counter() - started
+    stats = fake.reset_stats()
+
+    requests = max(stats.embedding_requests, 1)
+    ideal = max(
+        math.ceil(stats.embedding_tokens / EMBEDDING_BATCH_TOKENS), math.ceil(len(texts) / EMBEDDING_BATCH_SIZE), 1
+    )
+    return vectors, {
+        "texts": len(texts),
+        "tokens": stats.embedding_tokens,
+        "requests": stats.embedding_requests,
+        "texts_per_request": round(stats.embedding_inputs / requests, 2),
+        "tokens_per_request": round(stats.embedding_tokens / requests, 1),
+        "efficiency": round(ideal / requests, 3) if stats.embedding_requests else None,
+        "seconds": round(elapsed, 3),
+        "texts_per_second": round(len(texts) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def run_ingest(
+    fake: FakeOpenAIServer, pages: list[PageContent], texts: list[str], vectors: list[list[float]]
+) -> dict:
+    """
+    `ingest_page` página a página com o cache de embeddings já preenchido:
+    mede hash, chunking, deduplicação e gravação no Postgres, sem a API.
+    """
+    session = get_session()
+    try:
+        cached = {embedding_key(text): vector for text, vector in zip(texts, vectors)}
+        store_embeddings(session, cached, EMBEDDING_MODEL)
+        session.commit()
+        fake.reset_stats()
+
+        timings: list[float] = []
+        inserted = 0
+        dedup = DedupState()
+        started = time.perf_counter()
+        for page in pages:
+            page_started = time.perf_counter()
+            result = ingest_page(session, page, dedup)
+            timings.append((time.perf_counter() - page_started) * 1000)
+            inserted += result.chunks_inserted
+        elapsed = time.perf_counter() - started
+    finally:
+        session.close()
+    return {
+        "pages": len(pages),
+        "chunks_inserted": inserted,
+        "ms_per_page": summarize(timings),
+        "pages_per_second": round(len(pages) / elapsed, 2) if elapsed else 0.0,
+        "embedding_requests": fake.reset_stats().embedding_requests,
+    }
+
+
+def build_questions(count: int, seed: int) -> list[str]:
+    """Perguntas distintas (sem acerto no cache de embeddings) com o vocabulário do portal."""
+    rng = random.Random(seed)
+    questions: set[str] = set()
+    while len(questions) < count:
+        action, first, second = rng.choice(VOCABULARY), rng.choice(VOCABULARY), rng.choice(VOCABULARY)
+        questions.add(f"Como {action} {rng.choice(TOPICS)} com {first} e {second}?")
+    return sorted(questions)
+
+
+def run_ask(fake: FakeOpenAIServer, questions: list[str], concurrency: int, warmup: int, top_k: int) -> dict:
+    """Carga concorrente no POST /ask de uma API local (uvicorn numa thread)."""
+    with api_server() as base_url:
+        for question in questions[:warmup]:
+            response = httpx.post(f"{base_url}/ask", json={"question": question, "top_k": top_k}, timeout=60)
+            response.raise_for_status()
+        fake.reset_stats()
+        latencies, errors, elapsed = asyncio.run(_ask_load(base_url, questions[warmup:], concurrency, top_k))
+    stats = fake.reset_stats()
+    total = len(questions) - warmup
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "latency_ms": summarize(latencies),
+        "requests_per_second": round(total / elapsed, 2) if elapsed else 0.0,
+        "embedding_requests": stats.embedding_requests,
+        "chat_requests": stats.chat_requests,
+    }
+
+
+async def _ask_load(
+    base_url: str, questions: list[str], concurrency: int, top_k: int
+) -> tuple[list[float], int, float]:
+    pending = iter(questions)
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        for question in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.post("/ask", json={"question": question, "top_k": top_k})
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+
+@contextmanager
+def api_server():
+    """Sobe a API (main.app) num uvicorn em thread, numa porta livre."""
+    import uvicorn
+
+    from main import app
+
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="bench-api", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("A API não subiu para o benchmark.")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Métricas de KEY_METRICS que pioraram mais que `tolerance` (fração) em relação ao baseline."""
+    regressions = []
+    print(f"{'métrica':28} | {'baseline':>10} | {'atual':>10} | {'variação':>8}")
+    for name, higher_is_better in KEY_METRICS:
+        current, previous = _lookup(results, name), _lookup(baseline, name)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = -change if higher_is_better else change
+        flag = " <- regressão" if worse > tolerance else ""
+        print(f"{name:28} | {previous:>10.2f} | {current:>10.2f} | {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def _lookup(results: dict, name: str) -> float | None:
+    value = results
+    for key in name.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark ponta a ponta sem rede: portal local, OpenAI simulada e o Postgres do docker-compose. "
+            "Mede crawl, parse/chunking, lotes de embeddings, gravação do ingest_page e latência do /ask."
+        )
+    )
+    parser.add_argument("--pages", type=int, default=500, help="Páginas de conteúdo do portal gerado.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=16, help="Downloads simultâneos do crawler.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos de parse no crawl.")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0, dest="embedding_latency_ms")
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0, dest="chat_latency_ms")
+    parser.add_argument("--ask-requests", type=int, default=200, dest="ask_requests")
+    parser.add_argument("--ask-concurrency", type=int, default=16, dest="ask_concurrency")
+    parser.add_argument("--ask-warmup", type=int, default=5, dest="ask_warmup")
+    parser.add_argument("--top-k", type=int, default=6, dest="top_k")
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: data/bench/e2e-<data>.json).")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparar.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Piora relativa aceita antes de falhar (0.2 = 20%%)."
+    )
+    parser.add_argument("--keep", action="store_true", help="Mantém no banco os documentos do portal gerado.")
+    args = parser.parse_args()
+
+    create_tables()
+    portal = generate_portal(args.pages, seed=args.seed)
+    fake = FakeOpenAIServer(
+        dimensions=Chunk.embedding.type.dim,
+        embedding_latency=args.embedding_latency_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000,
+        count_tokens=count_tokens,
+    )
+    with fake, FixtureServer(portal) as site:
+        # Os clientes OpenAI são criados na primeira chamada e leem estas variáveis.
+        os.environ["OPENAI_BASE_URL"] = fake.base_url
+        os.environ["OPENAI_API_KEY"] = "bench"
+        results: dict = {}
+        try:
+            print(f"Portal local em {site.base_url} ({len(portal.pages)} páginas)")
+            pages, results["crawl"] = run_crawl(site.base_url, len(portal.pages), args.concurrency, args.workers)
+            print(f"crawl   | {results['crawl']['pages_per_second']} páginas/s")
+            texts, results["parse"] = run_parse(pages)
+            parse = results["parse"]
+            print(f"parse   | {parse['parse_ms']['p50']} ms/página (p50), chunking {parse['prepare_ms']['p50']} ms")
+            vectors, results["embed"] = run_embed(fake, texts)
+            print(f"embed   | {results['embed']['requests']} requisições, eficiência {results['embed']['efficiency']}")
+            results["ingest"] = run_ingest(fake, pages, texts, vectors)
+            print(f"ingest  | {results['ingest']['ms_per_page']['p50']} ms/página (p50)")
+            questions = build_questions(args.ask_requests + args.ask_warmup, args.seed)
+            results["ask"] = run_ask(fake, questions, args.ask_concurrency, args.ask_warmup, args.top_k)
+            latency = results["ask"]["latency_ms"]
+            print(f"ask     | p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms")
+        finally:
+            if not args.keep:
+                session = get_session()
+                try:
+                    delete_domain(session, site.domain)
+                    session.commit()
+                finally:
+                    session.close()
+
+    report = {
+        "created_at": dt.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            **{key: value for key, value in vars(args).items() if key not in ("output", "baseline", "keep")},
+            "env": {name: os.environ[name] for name in ENV_KNOBS if name in os.environ},
+        },
+        **results,
+    }
+    default_output = REPO_ROOT / "data" / "bench" / f"e2e-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output = pathlib.Path(args.output or default_output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Resultados gravados em {output}")
+
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} métricas pioraram mais de {args.tolerance:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from db.connection import get_session
+from db.models import Chunk, Document
+from db.queries import visible_documents
+from db.vector_index import (
+    DIMENSIONS,
+    INDEX_METHODS,
+    INDEX_NAME,
+    QUANTIZATIONS,
+    VectorIndexConfig,
+    apply_search_settings,
+    create_vector_index,
+    first_stage_limit,
+    nearest_chunk_ids,
+)
+from ingestion.embeddings import embed_texts
+
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN de uma consulta do SQLAlchemy, com os mesmos parâmetros que ela envia ao banco."""
+
+    inherit_cache = False
+
+    def __init__(self, statement) -> None:
+        self.statement = statement
+
+
+@compiles(_Explain)
+def _compile_explain(element, compiler, **kw) -> str:
+    return "EXPLAIN " + compiler.process(element.statement, **kw)
+
+
+def sample_queries(session: Session, count: int, seed: int) -> list[list[float]]:
+    """Embeddings de chunks visíveis sorteados como consultas."""
+    ids = np.array(session.scalars(_visible_chunk_ids()).all(), dtype=np.int64)
+    if not len(ids):
+        return []
+    chosen = np.random.default_rng(seed).choice(ids, size=min(count, len(ids)), replace=False)
+    rows = session.scalars(select(Chunk.embedding).where(Chunk.id.in_(chosen.tolist())).order_by(Chunk.id))
+    return [np.asarray(vector, dtype=np.float32).tolist() for vector in rows]
+
+
+def exact_search(session: Session, query: list[float], top_k: int) -> tuple[list[int], float]:
+    """Top-k exato (varredura sequencial, sem índice) com o vetor completo, e sua latência."""
+    started = time.perf_counter()
+    session.execute(text("SET LOCAL enable_indexscan = off"))
+    ids = session.scalars(nearest_chunk_ids(query, top_k, quantization="none", prefix_dimensions=0)).all()
+    elapsed = time.perf_counter() - started
+    session.rollback()
+    return list(ids), elapsed
+
+
+def ann_search(
+    session: Session,
+    query: list[float],
+    top_k: int,
+    config: VectorIndexConfig,
+    rerank_factor: int,
+    search: dict,
+) -> tuple[list[int], float]:
+    """A mesma consulta do /ask (nearest_chunk_ids com SET LOCAL de ef_search/probes), cronometrada."""
+    started = time.perf_counter()
+    limit = first_stage_limit(top_k, config.quantization, config.prefix_dimensions, rerank_factor)
+    apply_search_settings(session, **search, limit=limit)
+    ids = session.scalars(_nearest(query, top_k, config, rerank_factor)).all()
+    elapsed = time.perf_counter() - started
+    session.rollback()
+    return list(ids), elapsed
+
+
+def uses_index(
+    session: Session, query: list[float], top_k: int, config: VectorIndexConfig, rerank_factor: int
+) -> bool:
+    """Se o plano da consulta passa pelo índice (senão a latência medida é de uma varredura)."""
+    plan = "\n".join(session.scalars(_Explain(_nearest(query, top_k, config, rerank_factor))))
+    session.rollback()
+    return INDEX_NAME in plan
+
+
+def index_size(session: Session) -> int:
+    return session.scalar(text("SELECT pg_relation_size(CAST(:name AS regclass))"), {"name": INDEX_NAME}) or 0
+
+
+def _nearest(query: list[float], top_k: int, config: VectorIndexConfig, rerank_factor: int):
+    return nearest_chunk_ids(
+        query,
+        top_k,
+        quantization=config.quantization,
+        prefix_dimensions=config.prefix_dimensions,
+        rerank_factor=rerank_factor,
+    )
+
+
+def _visible_chunk_ids():
+    return select(Chunk.id).join(Document, Document.id == Chunk.document_id).where(visible_documents())
+
+
+def _search_settings(method: str, ef_search: list[int], probes: list[int]) -> list[dict]:
+    if method == "hnsw":
+        return [{"ef_search": value} for value in ef_search] or [{}]
+    return [{"probes": value} for value in probes] or [{}]
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    return float(np.percentile(values, percentile)) * 1000 if values else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Mede recall@k e latência de nearest_chunk_ids no Postgres para cada configuração do índice "
+            "(método, prefixo Matryoshka, quantização, ef_search/probes, re-rank) contra uma varredura exata. "
+            f"Reconstrói {INDEX_NAME} a cada configuração e restaura a padrão ao final: use um banco de homologação."
+        )
+    )
+    parser.add_argument("--questions", help="Arquivo com uma pergunta por linha (padrão: amostra de chunks).")
+    parser.add_argument("--queries", type=int, default=200, help="Chunks sorteados como consulta.")
+    parser.add_argument("--methods", nargs="+", choices=INDEX_METHODS, default=["hnsw"])
+    parser.add_argument("--dims", type=int, nargs="+", default=[128, 256, 512, DIMENSIONS])
+    parser.add_argument("--quantizations", nargs="+", choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[40, 100], dest="ef_search")
+    parser.add_argument("--probes", type=int, nargs="*", default=[1, 10], help="IVFFlat: listas visitadas.")
+    parser.add_argument("--top-k", type=int, default=6, dest="top_k")
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[4], dest="rerank_factors")
+    parser.add_argument("--maintenance-work-mem", dest="maintenance_work_mem", help="Ex.: 2GB")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    session = get_session()
+    try:
+        if args.questions:
+            lines = pathlib.Path(args.questions).read_text(encoding="utf-8").splitlines()
+            queries = embed_texts([line for line in lines if line.strip()])
+        else:
+            queries = sample_queries(session, args.queries, args.seed)
+        if not queries:
+            sys.exit("Nenhum embedding encontrado.")
+
+        exact, exact_seconds = zip(*(exact_search(session, query, args.top_k) for query in queries))
+        total = session.scalar(select(func.count()).select_from(_visible_chunk_ids().subquery()))
+        print(f"{total} chunks visíveis, {len(queries)} consultas, top_k={args.top_k}")
+        print(
+            f"Varredura exata: p50 {_percentile(exact_seconds, 50):.2f} ms, "
+            f"p95 {_percentile(exact_seconds, 95):.2f} ms por consulta"
+        )
+        print(
+            f"{'método':7} | {'dims':>5} | {'quantização':11} | {'busca':14} | {'re-rank':>7} | {'índice MB':>9} | "
+            f"{'usa índice':10} | {'recall@k':>8} | {'p50 ms':>8} | {'p95 ms':>8}"
+        )
+
+        for method in args.methods:
+            for dims in args.dims:
+                if dims > DIMENSIONS:
+                    continue
+                for quantization in args.quantizations:
+                    config = VectorIndexConfig(
+                        method=method, quantization=quantization, prefix_dimensions=0 if dims == DIMENSIONS else dims
+                    )
+                    # Reconstrói só se a definição atual do índice for outra (ver create_vector_index).
+                    create_vector_index(config, maintenance_work_mem=args.maintenance_work_mem)
+                    size_mb = index_size(session) / 2**20
+                    session.rollback()
+                    compact = quantization != "none" or dims != DIMENSIONS
+                    for rerank_factor in args.rerank_factors if compact else [1]:
+                        planned = uses_index(session, queries[0], args.top_k, config, rerank_factor)
+                        for search in _search_settings(method, args.ef_search, args.probes):
+                            found, seconds = zip(
+                                *(
+                                    ann_search(session, query, args.top_k, config, rerank_factor, search)
+                                    for query in queries
+                                )
+                            )
+                            hits = sum(len(set(a) & set(b)) for a, b in zip(exact, found))
+                            recall = hits / max(sum(len(ids) for ids in exact), 1)
+                            label = ", ".join(f"{name}={value}" for name, value in search.items()) or "padrão"
+                            print(
+                                f"{method:7} | {dims:>5} | {quantization:11} | {label:14} | {rerank_factor:>7} | "
+                                f"{size_mb:>9.1f} | {'sim' if planned else 'não':10} | {recall:>8.3f} | "
+                                f"{_percentile(seconds, 50):>8.2f} | {_percentile(seconds, 95):>8.2f}"
+                            )
+    finally:
+        session.close()
+        # Volta ao índice da configuração do ambiente (VECTOR_INDEX_METHOD, VECTOR_QUANTIZATION, ...).
+        create_vector_index(maintenance_work_mem=args.maintenance_work_mem)
+
+
+if __name__ == "__main__":
+    main()
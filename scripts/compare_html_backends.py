@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import argparse
+import pathlib
+import sys
+import time
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from crawler.clean_html import PARSER_BACKENDS
+from crawler.extract import parse_page
+
+# Páginas de exemplo versionadas (com e sem <main>, fragmento sem <html>, <article>): o corpus padrão.
+FIXTURES = REPO_ROOT / "scripts" / "fixtures" / "html"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compara o texto e as seções extraídos por cada backend de parser num corpus de arquivos HTML."
+    )
+    parser.add_argument(
+        "corpus",
+        nargs="?",
+        default=str(FIXTURES),
+        help="Diretório com arquivos .html (busca recursiva); padrão: scripts/fixtures/html.",
+    )
+    parser.add_argument("--reference", default="html.parser", choices=PARSER_BACKENDS)
+    parser.add_argument("--candidate", default="lxml", choices=PARSER_BACKENDS)
+    args = parser.parse_args()
+
+    files = sorted(pathlib.Path(args.corpus).rglob("*.html"))
+    if not files:
+        sys.exit(f"Nenhum arquivo .html em {args.corpus}")
+
+    timings = {args.reference: 0.0, args.candidate: 0.0}
+    mismatches: list[pathlib.Path] = []
+    for path in files:
+        html = path.read_text(encoding="utf-8", errors="ignore")
+        outputs = {}
+        for backend in timings:
+            started = time.perf_counter()
+            document = parse_page(path.as_uri(), html, backend=backend).document
+            timings[backend] += time.perf_counter() - started
+            outputs[backend] = (document.text, document.sections)
+        if outputs[args.reference] != outputs[args.candidate]:
+            mismatches.append(path)
+            print(f"DIFERENTE | {path}")
+
+    for backend, elapsed in timings.items():
+        print(f"{backend:12} | {elapsed:.2f}s ({len(files) / elapsed:.1f} páginas/s)")
+    print(f"Resumo: {len(files) - len(mismatches)}/{len(files)} arquivos idênticos.")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import argparse
-
+import asyncio
+import atexit
+import os
 import pathlib
 import sys
 
@@ -9,35 +11,169 @@ REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
 if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 
+from concurrent.futures import ProcessPoolExecutor
+
 from crawler.crawl import Crawler, CrawlerConfig
 from db.connection import get_session
-from db.queries import delete_domain
-from ingestion.updater import ingest_page
+from db.queries import crawl_cache_lookup
+from ingestion.embeddings import EMBEDDING_MODEL
+from ingestion.pipeline import run_pipeline
+from ingestion.updater import (
+    REBUILD_MAX_ERRORS,
+    DedupState,
+    abort_rebuild,
+    finish_rebuild,
+    ingest_pages,
+    lost_pages,
+    start_rebuild,
+)
+from observability.metrics import METRICS_FILE, METRICS_PUSHGATEWAY, export_metrics
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Rebuild all documents for a domain.")
     parser.add_argument("base_url", help="URL base para iniciar o crawl (ex.: http://site/)")
     parser.add_argument("--max-pages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16, help="Downloads simultâneos.")
+    parser.add_argument("--per-host", type=int, default=6, dest="per_host", help="Conexões por host.")
+    parser.add_argument("--sync", action="store_true", help="Usa o crawler sequencial (requests).")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Atualiza a geração ativa com GET condicional (ETag/Last-Modified) em vez de reconstruir o domínio.",
+    )
+    parser.add_argument(
+        "--batch-pages",
+        type=int,
+        default=16,
+        dest="batch_pages",
+        help="Páginas ingeridas por lote (os embeddings do lote vão juntos para a API).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processos para parse e chunking no modo assíncrono (padrão: núcleos da máquina).",
+    )
+    parser.add_argument(
+        "--max-errors",
+        type=int,
+        default=REBUILD_MAX_ERRORS,
+        dest="max_errors",
+        help="Páginas publicadas que podem falhar no download antes de o rebuild ser descartado (404/410 não contam).",
+    )
+    parser.add_argument(
+        "--metrics-push",
+        default=METRICS_PUSHGATEWAY,
+        dest="metrics_push",
+        help="Pushgateway que recebe as métricas ao sair (ex.: http://localhost:9091).",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=METRICS_FILE,
+        dest="metrics_file",
+        help="Grava as métricas neste arquivo ao sair (formato texto do Prometheus).",
+    )
     args = parser.parse_args()
+    # Também em erro ou Ctrl+C: um rebuild interrompido é justamente o que se quer investigar.
+    atexit.register(export_metrics, "rebuild_domain", args.metrics_push, args.metrics_file)
 
     base_url = args.base_url.rstrip("/") + "/"
     domain = base_url.split("://", 1)[1].split("/", 1)[0]
 
     session = get_session()
-    removed = delete_domain(session, domain)
-    session.commit()
-    print(f"Removed {removed} documentos antigos de {domain}")
-
-    crawler = Crawler(CrawlerConfig(max_pages=args.max_pages))
-    pages = chunks = 0
-    for page in crawler.crawl(base_url):
-        result = ingest_page(session, page)
-        pages += 1
-        chunks += result.chunks
-        status = "novo" if result.created else "atualizado"
-        print(f"{status:10} | {page.url} -> {result.chunks} chunks")
-    print(f"Resumo: {pages} páginas, {chunks} chunks gerados.")
+    cache_lookup = None
+    generation = None
+    if args.incremental:
+        # Validadores do domínio carregados de uma vez: o crawl não consulta o banco por URL.
+        # Páginas embedadas com outro modelo ficam de fora e são baixadas e re-embedadas.
+        cache_lookup = crawl_cache_lookup(session, domain, EMBEDDING_MODEL)
+    else:
+        # Geração sombra: o /ask segue respondendo com a atual até o flip no fim.
+        generation = start_rebuild(session, domain)
+        print(f"Gravando a geração {generation} de {domain}")
+
+    config = CrawlerConfig(
+        max_pages=args.max_pages,
+        concurrency=args.concurrency,
+        max_connections_per_host=args.per_host,
+    )
+    totals = {"pages": 0, "chunks": 0}
+
+    def report(page, result) -> None:
+        totals["pages"] += 1
+        totals["chunks"] += result.chunks
+        status = "novo" if result.created else "atualizado" if result.updated else "sem mudança"
+        if result.duplicate_of:
+            print(f"{'duplicata':10} | {page.url} -> {result.duplicate_of}")
+            return
+        skipped = f", {result.chunks_skipped} duplicados" if result.chunks_skipped else ""
+        print(f"{status:10} | {page.url} -> {result.chunks} chunks ({result.rows_touched} linhas alteradas{skipped})")
+
+    try:
+        if args.sync:
+            crawler = Crawler(config, cache_lookup=cache_lookup)
+            batch: list = []
+            dedup = DedupState()
+            for page in crawler.crawl(base_url):
+                batch.append(page)
+                if len(batch) >= args.batch_pages:
+                    _ingest_batch(session, batch, report, dedup, generation)
+            _ingest_batch(session, batch, report, dedup, generation)
+        else:
+            workers = max(args.workers, 1)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                crawler = Crawler(config, cache_lookup=cache_lookup, parse_executor=executor)
+                embed_session = get_session()
+                try:
+                    asyncio.run(
+                        run_pipeline(
+                            crawler,
+                            base_url,
+                            executor=executor,
+                            workers=workers,
+                            embed_session=embed_session,
+                            write_session=session,
+                            batch_pages=args.batch_pages,
+                            generation=generation,
+                            on_result=report,
+                        )
+                    )
+                finally:
+                    embed_session.close()
+    except BaseException:
+        if generation is not None:
+            abort_rebuild(session, domain, generation)
+            print(f"Rebuild interrompido; geração {generation} descartada, a anterior segue ativa.")
+        raise
+    print(f"Resumo: {totals['pages']} páginas, {totals['chunks']} chunks gerados.")
+    lost = lost_pages(session, domain, crawler) if generation is not None else []
+    if generation is not None and not totals["pages"]:
+        # Site fora do ar não deve esvaziar o domínio: a geração atual continua valendo.
+        abort_rebuild(session, domain, generation)
+        print(f"Nenhuma página ingerida; geração {generation} descartada.")
+    elif len(lost) > args.max_errors:
+        # Páginas publicadas que falharam sumiriam do /ask com o flip (mesma regra do /rebuild-domain).
+        abort_rebuild(session, domain, generation)
+        for url in lost:
+            print(f"{'falhou':10} | {url}")
+        sys.exit(
+            f"{len(lost)} páginas publicadas não foram baixadas (--max-errors={args.max_errors}); "
+            f"geração {generation} descartada."
+        )
+    elif generation is not None:
+        removed = finish_rebuild(session, domain, generation)
+        print(f"Geração {generation} ativa; {removed} documentos da anterior removidos.")
+    if crawler.not_modified:
+        print(f"{len(crawler.not_modified)} páginas puladas (304 Not Modified).")
+    if crawler.gone:
+        print(f"{len(crawler.gone)} páginas removidas do site (404/410).")
+
+
+def _ingest_batch(session, batch: list, report, dedup: DedupState, generation: int | None = None) -> None:
+    for page, result in zip(batch, ingest_pages(session, batch, generation, dedup)):
+        report(page, result)
+    batch.clear()
 
 
 if __name__ == "__main__":
@@ -9,11 +9,11 @@ $repoRoot = Split-Path -Parent (Split-Path -Parent $MyInvocation.MyCommand.Path)
 Set-Location $repoRoot
 
 $venvPath = Join-Path $repoRoot ".venv"
-$uvicornPath = Join-Path $venvPath "Scripts\\uvicorn.exe"
+$pythonPath = Join-Path $venvPath "Scripts\\python.exe"
 $activateScript = Join-Path $venvPath "Scripts\\Activate.ps1"
 
-if (-not (Test-Path $uvicornPath)) {
-    Write-Error "uvicorn not found in $uvicornPath. Activate/install the virtualenv first."
+if (-not (Test-Path $pythonPath)) {
+    Write-Error "python not found in $pythonPath. Activate/install the virtualenv first."
     exit 1
 }
 
@@ -36,7 +36,8 @@ Stop-PortProcess -TargetPort $Port
 $serverCommand = @"
 Set-Location "$repoRoot"
 . "$activateScript"
-uvicorn main:app --host $ApiHost --port $Port
+# main.py sobe o uvicorn com o SelectorEventLoop (o /ask usa psycopg assíncrono).
+python main.py --host $ApiHost --port $Port
 "@
 
 Write-Host "Starting uvicorn on http://$ApiHost`:$Port ..."